@@ -0,0 +1,161 @@
+"""
+Реестр активных заявок в памяти процесса.
+Активных заявок немного, поэтому меню обратной связи, списки заявок администраторов
+и преподавателей читают их отсюда, а не из feedback_messages. Реестр загружается
+из базы данных один раз и затем обновляется при создании, закрытии и возврате заявки.
+При WORKERS > 1 заявки меняют другие процессы, поэтому реестр отключается.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from metrics import registry
+
+active_requests_gauge = registry.gauge(
+    "active_requests", "Активные заявки в реестре в памяти"
+)
+
+
+class ActiveRequest(NamedTuple):
+    """Активная заявка; поля в порядке колонок feedback_messages"""
+    id: int
+    user_id: int
+    username: Optional[str]
+    first_name: Optional[str]
+    message_text: str
+    created_at: str  # UTC, формат CURRENT_TIMESTAMP SQLite
+    direction_id: Optional[int]
+
+
+def _newest_first(requests: Iterable[ActiveRequest]) -> List[ActiveRequest]:
+    return sorted(requests, key=lambda r: (r.created_at, r.id), reverse=True)
+
+
+class ActiveRequestRegistry:
+    """Активные заявки, проиндексированные по id, user_id и direction_id"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.loaded = False
+        self._by_id: Dict[int, ActiveRequest] = {}
+        self._by_user: Dict[int, Set[int]] = defaultdict(set)
+        self._by_direction: Dict[Optional[int], Set[int]] = defaultdict(set)
+        # Изменения, пришедшие во время загрузки, применяются поверх загруженного снимка
+        self._pending: Optional[List[Tuple[str, object]]] = None
+
+        # Справочники для вывода: названия направлений и направления преподавателей
+        self.direction_names: Optional[Dict[int, str]] = None
+        self.teacher_directions: Optional[Dict[int, Set[int]]] = None
+        self.directions_version = 0
+
+    # Загрузка
+    def begin_load(self):
+        """Начать загрузку: изменения до finish_load откладываются"""
+        self._pending = []
+
+    def finish_load(self, requests: Iterable[ActiveRequest]):
+        """Заменить содержимое снимком из БД и применить отложенные изменения"""
+        pending, self._pending = self._pending or [], None
+        self._by_id.clear()
+        self._by_user.clear()
+        self._by_direction.clear()
+        for request in requests:
+            self._insert(request)
+        for operation, value in pending:
+            if operation == "add":
+                self._insert(value)
+            else:
+                self._delete(value)
+        self.loaded = True
+        active_requests_gauge.set(len(self._by_id))
+
+    def invalidate(self):
+        """Забыть всё; реестр перезагрузится при следующем чтении"""
+        self.loaded = False
+        self._pending = None
+        self._by_id.clear()
+        self._by_user.clear()
+        self._by_direction.clear()
+        self.invalidate_directions()
+
+    def invalidate_directions(self):
+        """Сбросить справочники направлений после изменения направлений или привязок"""
+        self.direction_names = None
+        self.teacher_directions = None
+        self.directions_version += 1
+
+    def set_directions(self, names: Dict[int, str], teacher_directions: Dict[int, Set[int]], version: int):
+        """Сохранить справочники, если они не менялись, пока шла загрузка"""
+        if version == self.directions_version:
+            self.direction_names = names
+            self.teacher_directions = teacher_directions
+
+    # Изменения
+    def _insert(self, request: ActiveRequest):
+        self._by_id[request.id] = request
+        self._by_user[request.user_id].add(request.id)
+        self._by_direction[request.direction_id].add(request.id)
+
+    def _delete(self, request_id: int):
+        request = self._by_id.pop(request_id, None)
+        if request is None:
+            return
+        for index, key in ((self._by_user, request.user_id), (self._by_direction, request.direction_id)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(request_id)
+                if not ids:
+                    del index[key]
+
+    def add(self, request: ActiveRequest):
+        """Заявка создана или возвращена в активные"""
+        if self._pending is not None:
+            self._pending.append(("add", request))
+        elif self.loaded:
+            self._insert(request)
+            active_requests_gauge.set(len(self._by_id))
+
+    def remove(self, request_id: int):
+        """Заявка закрыта"""
+        if self._pending is not None:
+            self._pending.append(("remove", request_id))
+        elif self.loaded:
+            self._delete(request_id)
+            active_requests_gauge.set(len(self._by_id))
+
+    # Чтение
+    def get(self, request_id: int) -> Optional[ActiveRequest]:
+        return self._by_id.get(request_id)
+
+    def latest_for_user(self, user_id: int) -> Optional[ActiveRequest]:
+        """Самая свежая активная заявка пользователя"""
+        ids = self._by_user.get(user_id)
+        if not ids:
+            return None
+        return _newest_first(self._by_id[i] for i in ids)[0]
+
+    def all(self) -> List[ActiveRequest]:
+        """Все активные заявки, новые первыми"""
+        return _newest_first(self._by_id.values())
+
+    def for_directions(self, direction_ids: Iterable[int]) -> List[ActiveRequest]:
+        """Активные заявки по направлениям, новые первыми"""
+        ids = set()
+        for direction_id in direction_ids:
+            ids |= self._by_direction.get(direction_id, set())
+        return _newest_first(self._by_id[i] for i in ids)
+
+    def count_for_direction(self, direction_id: int) -> int:
+        return len(self._by_direction.get(direction_id, ()))
+
+    def summary(self, now: datetime = None) -> Tuple[int, int, int]:
+        """Число активных заявок: всего, за сутки, за час"""
+        now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+        day_ago = (now - timedelta(days=1)).strftime("%Y-%m-%d %H:%M:%S")
+        hour_ago = (now - timedelta(hours=1)).strftime("%Y-%m-%d %H:%M:%S")
+        today = sum(1 for r in self._by_id.values() if r.created_at > day_ago)
+        hour = sum(1 for r in self._by_id.values() if r.created_at > hour_ago)
+        return len(self._by_id), today, hour
+
+    def __len__(self):
+        return len(self._by_id)
@@ -2,30 +2,41 @@
 Расширенные хендлеры для администраторов
 """
 import asyncio
+import os
+import tempfile
 import aiosqlite
 from datetime import datetime, timedelta
 from aiogram import Router, F
 from aiogram.filters import Command, StateFilter
-from aiogram.types import Message, CallbackQuery
+from aiogram.types import Message, CallbackQuery, FSInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton
 
 from database import db
+import archive
 from chat_handler import ChatType, ChatBehavior, require_permission
+from request_service import close_request, CLOSED, ALREADY_CLOSED
 from enhanced_keyboards import (
     get_admin_requests_keyboard, get_statistics_keyboard, 
     get_settings_keyboard, get_quick_actions_for_request,
     get_request_detail_keyboard, get_working_hours_keyboard,
-    get_day_working_hours_keyboard
+    get_day_working_hours_keyboard, get_page_navigation_buttons
 )
+from pagination import OLDER, parse_page_callback_data, encode_rank_cursor, decode_rank_cursor
+from request_search import parse_search_text, format_snippet, SearchQueryError
+from response_times import format_percentiles
+from metadata_cache import metadata
+from analytics import analytics, format_requests_report, format_users_report
+from data_export import export_table, FORMATS as EXPORT_FORMATS
+from backup import backup_database, list_backups
 from keyboards import (
     get_admin_management_keyboard, get_teacher_management_keyboard,
     get_notification_settings_keyboard
 )
 
-admin_router = Router()
+admin_router = Router(name="admin")
 
 def escape_markdown(text: str) -> str:
     """Экранирует специальные символы Markdown"""
@@ -106,20 +117,29 @@ async def admin_settings_menu(message: Message, **kwargs):
 
 # Обработка заявок
 
+# Заявок на странице списка активных заявок
+ACTIVE_REQUESTS_PAGE_SIZE = 5
+
 @admin_router.callback_query(F.data == "requests_active")
+@admin_router.callback_query(F.data.startswith("requests_active:"))
 async def show_active_requests(callback: CallbackQuery):
-    """Показать активные заявки с улучшенным интерфейсом"""
-    active_requests = await get_active_requests_detailed()
-    
-    if not active_requests:
+    """Показать активные заявки с улучшенным интерфейсом (постранично)"""
+    cursor, direction = parse_page_callback_data(callback.data, "requests_active")
+    page = await db.get_requests_page(status='active', cursor=cursor, direction=direction, limit=ACTIVE_REQUESTS_PAGE_SIZE)
+    if not page.rows and cursor:
+        # Заявки страницы успели закрыть - возвращаемся к началу списка
+        page = await db.get_requests_page(status='active', limit=ACTIVE_REQUESTS_PAGE_SIZE)
+    
+    if not page.rows:
         text = "🎫 <b>Активные заявки</b>\n\n✅ Активных заявок нет!"
         keyboard = get_admin_requests_keyboard()
     else:
-        text = "🎫 <b>Активные заявки</b>\n\n"
+        total = (await db.get_active_requests_counts())[0]
+        text = f"🎫 <b>Активные заявки</b> ({total})\n\n"
         builder = InlineKeyboardBuilder()
         
-        for request in active_requests[:5]:  # Показываем только первые 5 для лучшего UX
-            request_id, user_id, username, first_name, message_text, created_at, direction_name = request
+        for request in page.rows:
+            request_id, user_id, username, first_name, message_text, created_at, status, direction_name = request
             
             # Форматируем дату
             created_date = datetime.fromisoformat(created_at).strftime("%d.%m %H:%M")
@@ -134,22 +154,20 @@ async def show_active_requests(callback: CallbackQuery):
             text += f"📚 {direction_name or 'Без направления'}\n"
             text += f"💬 {short_message}\n\n"
             
-            # Добавляем кнопку для детального просмотра каждой заявки
-            builder.add(InlineKeyboardButton(
+            # Добавляем кнопку для детального просмотра каждой заявки (каждая на отдельной строке)
+            builder.row(InlineKeyboardButton(
                 text=f"📝 #{request_id} - {user_display[:15]}",
                 callback_data=f"request_detail:{request_id}"
             ))
-
         
-        if len(active_requests) > 5:
-            text += f"... и еще {len(active_requests) - 5} заявок\n\n"
-            text += "💡 Нажмите на заявку для детального просмотра"
+        text += "💡 Нажмите на заявку для детального просмотра"
         
-        # Добавляем кнопки управления
-        builder.add(InlineKeyboardButton(text="🔄 Обновить", callback_data="requests_active"))
-        builder.add(InlineKeyboardButton(text="⬅️ К меню заявок", callback_data="requests_menu"))
-        
-        builder.adjust(1)  # Каждая заявка на отдельной строке
+        # Листание и кнопки управления
+        navigation = get_page_navigation_buttons(page, "requests_active")
+        if navigation:
+            builder.row(*navigation)
+        builder.row(InlineKeyboardButton(text="🔄 Обновить", callback_data="requests_active"))
+        builder.row(InlineKeyboardButton(text="⬅️ К меню заявок", callback_data="requests_menu"))
         keyboard = builder.as_markup()
     
     # Проверяем, отличается ли новое содержимое от текущего
@@ -184,62 +202,182 @@ async def show_closed_requests(callback: CallbackQuery):
 
 @admin_router.callback_query(F.data == "requests_search")
 async def start_request_search(callback: CallbackQuery, state: FSMContext):
-    """Начать поиск заявок по пользователю"""
+    """Начать поиск заявок по пользователю или по тексту"""
     await callback.message.answer(
         "🔍 *Поиск заявок*\n\n"
-        "Отправьте ID пользователя или username (с @) для поиска его заявок:",
+        "Отправьте ID пользователя или username (с @) для поиска его заявок "
+        "или слова для поиска по тексту заявок и ответов.\n\n"
+        "Фильтры для поиска по тексту:\n"
+        "• статус:активные или статус:закрытые\n"
+        "• с:01.09.2024 по:31.12.2024\n"
+        "• направление:робото (часть названия)\n\n"
+        "Например: логин не работает статус:активные",
         parse_mode="Markdown"
     )
     await state.set_state(AdminStates.waiting_for_request_search)
     await callback.answer()
 
+# Заявок на странице результатов поиска
+SEARCH_PAGE_SIZE = 15
+
+def format_search_page(page, search_type: str, search_query: str) -> str:
+    """Текст страницы результатов поиска заявок (HTML)"""
+    text = f"🔍 <b>Заявки пользователя</b> ({search_type})\n\n"
+    
+    for request in page.rows:
+        request_id, user_id, username, first_name, message_text, created_at, status, direction_name = request
+        
+        created_date = datetime.fromisoformat(created_at).strftime("%d.%m.%Y %H:%M")
+        status_emoji = "🔓" if status == 'active' else "🔒"
+        short_message = message_text[:40] + "..." if len(message_text) > 40 else message_text
+        short_message = escape_html(short_message)
+        
+        text += f"{status_emoji} <b>#{request_id}</b> ({created_date})\n"
+        text += f"📚 {direction_name or 'Без направления'}\n"
+        text += f"💬 {short_message}\n\n"
+    
+    text += f"💡 Используйте /msg {escape_html(search_query)} для подробной переписки"
+    return text
+
+def parse_search_query(search_query: str):
+    """Фильтр поиска (username или user_id), описание и ключ для callback_data; None, если это поиск по тексту"""
+    if search_query.startswith('@') and ' ' not in search_query:
+        username = search_query[1:]
+        return {"username": username}, f"username @{username}", f"u:{username}"
+    try:
+        user_id = int(search_query)
+    except ValueError:
+        return None
+    return {"user_id": user_id}, f"ID {user_id}", f"i:{user_id}"
+
+async def get_search_page(search_query: str, cursor=None, direction: str = OLDER):
+    """Страница результатов поиска с клавиатурой листания; None при неверном формате запроса"""
+    parsed = parse_search_query(search_query)
+    if parsed is None:
+        return None
+    filters, search_type, key = parsed
+    page = await db.get_requests_page(cursor=cursor, direction=direction, limit=SEARCH_PAGE_SIZE, **filters)
+    
+    keyboard = None
+    # callback_data ограничена 64 байтами: для слишком длинного запроса листание не предлагаем
+    navigation = get_page_navigation_buttons(page, f"rq_search:{key}") if len(key) <= 40 else []
+    if navigation:
+        builder = InlineKeyboardBuilder()
+        builder.row(*navigation)
+        keyboard = builder.as_markup()
+    return page, search_type, keyboard
+
 @admin_router.message(StateFilter(AdminStates.waiting_for_request_search))
 async def process_request_search(message: Message, state: FSMContext):
     """Обработать поиск заявок"""
     search_query = message.text.strip()
     
-    # Определяем тип поиска
-    if search_query.startswith('@'):
-        # Поиск по username
-        username = search_query[1:]
-        user_requests = await get_requests_by_username(username)
-        search_type = f"username @{username}"
-    else:
-        try:
-            # Поиск по ID
-            user_id = int(search_query)
-            user_requests = await get_requests_by_user_id(user_id)
-            search_type = f"ID {user_id}"
-        except ValueError:
-            await message.answer("❌ Неверный формат. Используйте ID (число) или @username")
-            return
+    # Определяем тип поиска и получаем первую страницу
+    result = await get_search_page(search_query)
+    if result is None:
+        await process_text_search(message, state, search_query)
+        return
+    page, search_type, keyboard = result
     
-    if not user_requests:
+    if not page.rows:
         await message.answer(f"🔍 По запросу '{search_type}' заявки не найдены.")
     else:
-        text = f"🔍 <b>Заявки пользователя</b> ({search_type})\n\n"
-        
-        for request in user_requests[:15]:  # Первые 15 заявок
-            request_id, message_text, created_at, status, direction_name = request
-            
-            created_date = datetime.fromisoformat(created_at).strftime("%d.%m.%Y %H:%M")
-            status_emoji = "🔓" if status == 'active' else "🔒"
-            short_message = message_text[:40] + "..." if len(message_text) > 40 else message_text
-            short_message = escape_html(short_message)
-            
-            text += f"{status_emoji} <b>#{request_id}</b> ({created_date})\n"
-            text += f"📚 {direction_name or 'Без направления'}\n"
-            text += f"💬 {short_message}\n\n"
-        
-        if len(user_requests) > 15:
-            text += f"... и еще {len(user_requests) - 15} заявок\n\n"
-        
-        text += f"💡 Используйте /msg {search_query} для подробной переписки"
-        
-        await message.answer(text, parse_mode="HTML")
+        await message.answer(format_search_page(page, search_type, search_query), parse_mode="HTML", reply_markup=keyboard)
     
     await state.clear()
 
+# Результатов на странице полнотекстового поиска
+TEXT_SEARCH_PAGE_SIZE = 5
+
+async def render_text_search(params: dict, query_text: str, cursor=None, direction: str = OLDER):
+    """Текст (HTML) и клавиатура страницы полнотекстового поиска; None, если ничего не найдено"""
+    page = await db.search_requests(**params, cursor=cursor, direction=direction, limit=TEXT_SEARCH_PAGE_SIZE)
+    if not page.rows:
+        return None
+    
+    text = f"🔍 <b>Поиск по тексту:</b> {escape_html(query_text)}\n\n"
+    builder = InlineKeyboardBuilder()
+    for request_id, user_id, username, first_name, created_at, status, direction_name, snippet, score in page.rows:
+        created_date = datetime.fromisoformat(created_at).strftime("%d.%m.%Y")
+        status_emoji = "🔓" if status == 'active' else "🔒"
+        user_display = f"@{username}" if username else f"ID{user_id}"
+        
+        text += f"{status_emoji} <b>#{request_id}</b> ({created_date}) {escape_html(user_display)}\n"
+        text += f"📚 {escape_html(direction_name or 'Без направления')}\n"
+        text += f"💬 {format_snippet(snippet or '', escape_html)}\n\n"
+        builder.row(InlineKeyboardButton(text=f"📝 #{request_id}", callback_data=f"request_detail:{request_id}"))
+    
+    navigation = get_page_navigation_buttons(
+        page, "fts_page", encode=encode_rank_cursor, labels=("⬅️ Назад", "Дальше ➡️")
+    )
+    if navigation:
+        builder.row(*navigation)
+    return text, builder.as_markup()
+
+async def process_text_search(message: Message, state: FSMContext, search_query: str):
+    """Полнотекстовый поиск: параметры сохраняются в данных FSM для листания"""
+    try:
+        params = parse_search_text(search_query, await db.get_all_directions())
+    except SearchQueryError as e:
+        await message.answer(f"❌ {e}")
+        return
+    
+    rendered = await render_text_search(params, search_query)
+    if not rendered:
+        await message.answer("🔍 По вашему запросу заявки не найдены.")
+        await state.clear()
+        return
+    
+    # Состояние сбрасываем, а запрос оставляем в данных - по нему листаются страницы
+    await state.set_state(None)
+    await state.update_data(request_search={"params": params, "query": search_query})
+    text, keyboard = rendered
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+@admin_router.callback_query(F.data.startswith("fts_page:"))
+async def text_search_page(callback: CallbackQuery, state: FSMContext):
+    """Листание результатов полнотекстового поиска"""
+    if not await db.is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав для выполнения этой команды.", show_alert=True)
+        return
+    
+    search = (await state.get_data()).get("request_search")
+    if not search:
+        await callback.answer("ℹ️ Поиск устарел, выполните его заново", show_alert=True)
+        return
+    
+    cursor, direction = parse_page_callback_data(callback.data, "fts_page", decode=decode_rank_cursor)
+    rendered = await render_text_search(search["params"], search["query"], cursor, direction)
+    if not rendered:
+        await callback.answer("ℹ️ Результатов на этой странице больше нет", show_alert=True)
+        return
+    
+    text, keyboard = rendered
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer()
+
+@admin_router.callback_query(F.data.startswith("rq_search:"))
+async def request_search_page(callback: CallbackQuery):
+    """Листание результатов поиска заявок"""
+    if not await db.is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав для выполнения этой команды.", show_alert=True)
+        return
+    
+    # rq_search:u:username:направление:курсор или rq_search:i:user_id:направление:курсор
+    _, kind, value, *_ = callback.data.split(":")
+    prefix = f"rq_search:{kind}:{value}"
+    search_query = f"@{value}" if kind == "u" else value
+    cursor, direction = parse_page_callback_data(callback.data, prefix)
+    
+    result = await get_search_page(search_query, cursor, direction)
+    if result is None or not result[0].rows:
+        await callback.answer("ℹ️ Заявок на этой странице больше нет", show_alert=True)
+        return
+    page, search_type, keyboard = result
+    
+    await callback.message.edit_text(format_search_page(page, search_type, search_query), parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer()
+
 # Новые обработчики расширенного функционала заявок
 
 @admin_router.callback_query(F.data == "requests_menu")
@@ -383,54 +521,11 @@ async def process_request_answer(message: Message, state: FSMContext):
         await state.clear()
         return
     
-    # Получаем информацию о заявке
-    request_info = await get_request_detailed_info(request_id)
-    if not request_info:
-        await message.answer("❌ Заявка не найдена")
-        await state.clear()
-        return
-    
-    user_id = request_info[1]
     admin_reply = message.text
-    admin_id = message.from_user.id
     
-    # Отправляем ответ пользователю
+    # Закрываем заявку и отправляем ответ пользователю
     try:
-        await message.bot.send_message(
-            user_id,
-            f"✅ *Ответ на вашу заявку #{request_id}*\n\n"
-            f"👤 *Ответил:* Администратор\n"
-            f"📋 *Статус:* Заявка закрыта\n\n"
-            f"💬 *Ваша заявка:*\n{request_info[4]}\n\n"
-            f"📝 *Ответ:*\n{admin_reply}\n\n"
-            f"💡 Теперь вы можете создать новую заявку, если это необходимо.",
-            parse_mode="Markdown"
-        )
-        
-        # Закрываем заявку в базе данных
-        success = await db.close_request(request_id)
-        
-        if success:
-            # Обновляем статус в админских уведомлениях
-            await db.update_notification_status(message.bot, request_id, "Закрыта (Администратор)", admin_reply)
-            
-            # Отправляем уведомления преподавателям о закрытии заявки
-            await db.notify_teachers_about_closed_request(message.bot, request_id, "Администратор", admin_reply)
-            
-            await message.answer(
-                f"✅ *Ответ отправлен!*\n\n"
-                f"📝 Заявка #{request_id} закрыта\n"
-                f"👤 Пользователь уведомлен\n"
-                f"👨‍🏫 Преподаватели уведомлены",
-                parse_mode="Markdown"
-            )
-        else:
-            await message.answer(
-                f"⚠️ *Ответ отправлен, но заявка не закрыта в БД*\n\n"
-                f"Обратитесь к техническому администратору",
-                parse_mode="Markdown"
-            )
-            
+        result = await close_request(message.bot, request_id, message.from_user.id, "Администратор", answer_text=admin_reply)
     except Exception as e:
         await message.answer(
             f"❌ *Ошибка отправки ответа*\n\n"
@@ -438,6 +533,23 @@ async def process_request_answer(message: Message, state: FSMContext):
             f"Ошибка: {str(e)}",
             parse_mode="Markdown"
         )
+        await state.clear()
+        return
+    
+    if result == CLOSED:
+        await message.answer(
+            f"✅ *Ответ отправлен!*\n\n"
+            f"📝 Заявка #{request_id} закрыта\n"
+            f"👤 Пользователь уведомлен\n"
+            f"👨‍🏫 Преподаватели уведомлены",
+            parse_mode="Markdown"
+        )
+    elif result == ALREADY_CLOSED:
+        await message.answer(
+            f"⚠️ Заявка #{request_id} уже закрыта другим сотрудником, ваш ответ не отправлен."
+        )
+    else:
+        await message.answer("❌ Заявка не найдена")
     
     await state.clear()
 
@@ -446,19 +558,15 @@ async def close_request_callback(callback: CallbackQuery):
     """Закрыть заявку"""
     request_id = int(callback.data.split(":")[1])
     
-    # Закрываем заявку
-    success = await db.close_request(request_id)
+    # Закрываем заявку без ответа (уведомления обновляются внутри close_request)
+    result = await close_request(callback.bot, request_id, callback.from_user.id, "Администратор")
     
-    if success:
-        # Обновляем статус в админских уведомлениях (без ответа)
-        await db.update_notification_status(callback.bot, request_id, "Закрыта (Администратор)")
-        
-        # Отправляем уведомления преподавателям о закрытии заявки (без ответа)
-        await db.notify_teachers_about_closed_request(callback.bot, request_id, "Администратор", "Заявка закрыта без ответа")
-        
+    if result == CLOSED:
         await callback.answer("✅ Заявка закрыта", show_alert=True)
         # Обновляем информацию о заявке
         await show_request_detail(callback)
+    elif result == ALREADY_CLOSED:
+        await callback.answer("⚠️ Заявка уже закрыта", show_alert=True)
     else:
         await callback.answer("❌ Ошибка при закрытии заявки", show_alert=True)
 
@@ -992,8 +1100,225 @@ async def cancel_broadcast(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_text("❌ Рассылка отменена.")
     await state.clear()
 
+@admin_router.message(Command("api_stats"))
+async def show_api_stats(message: Message):
+    """Статистика вызовов Telegram Bot API (p50/p95/p99 по методам)"""
+    if not await db.is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    await message.answer(
+        format_api_stats(),
+        parse_mode="HTML",
+        reply_markup=get_api_stats_keyboard()
+    )
+
+@admin_router.callback_query(F.data == "api_stats_refresh")
+async def api_stats_refresh_callback(callback: CallbackQuery):
+    """Обновить статистику Bot API"""
+    if not await db.is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав для выполнения этой команды.", show_alert=True)
+        return
+    
+    try:
+        await callback.message.edit_text(
+            format_api_stats(),
+            parse_mode="HTML",
+            reply_markup=get_api_stats_keyboard()
+        )
+    except Exception as e:
+        if "message is not modified" not in str(e):
+            raise e
+    await callback.answer()
+
+@admin_router.callback_query(F.data == "api_stats_export")
+async def api_stats_export_callback(callback: CallbackQuery):
+    """Выгрузить все метрики в текстовом формате Prometheus"""
+    if not await db.is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав для выполнения этой команды.", show_alert=True)
+        return
+    
+    from aiogram.types import BufferedInputFile
+    from metrics import registry
+    
+    document = BufferedInputFile(registry.render().encode("utf-8"), filename="metrics.txt")
+    await callback.message.answer_document(document, caption="📤 Метрики бота (формат Prometheus)")
+    await callback.answer()
+
+@admin_router.message(Command("handler_stats"))
+async def show_handler_stats(message: Message):
+    """Время работы хендлеров за последние минуты (p50/p95/p99)"""
+    if not await db.is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+    
+    await message.answer(
+        format_handler_stats(),
+        parse_mode="HTML",
+        reply_markup=get_handler_stats_keyboard()
+    )
+
+@admin_router.callback_query(F.data == "handler_stats_refresh")
+async def handler_stats_refresh_callback(callback: CallbackQuery):
+    """Обновить статистику хендлеров"""
+    if not await db.is_admin(callback.from_user.id):
+        await callback.answer("❌ У вас нет прав для выполнения этой команды.", show_alert=True)
+        return
+    
+    try:
+        await callback.message.edit_text(
+            format_handler_stats(),
+            parse_mode="HTML",
+            reply_markup=get_handler_stats_keyboard()
+        )
+    except Exception as e:
+        if "message is not modified" not in str(e):
+            raise e
+    await callback.answer()
+
+@admin_router.message(Command("rebuild_stats"))
+async def rebuild_stats_command(message: Message):
+    """Пересчитать счётчики и сводки статистики заявок с нуля"""
+    if not await db.is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    try:
+        await db.rebuild_request_counters()
+        await db.rebuild_request_rollups()
+        await db.rebuild_response_times()
+        analytics.invalidate()
+        counters = await db.get_request_counters()
+        await message.answer(
+            f"✅ Счётчики статистики пересчитаны\n\n"
+            f"🎫 Всего заявок: {counters.total('total')}\n"
+            f"🟢 Активных: {counters.total('active')}\n"
+            f"🔒 Закрытых: {counters.total('closed')}"
+        )
+    except Exception as e:
+        await message.answer(f"❌ Ошибка пересчёта счётчиков: {str(e)}")
+
+# Названия выгрузок и форматов в команде /export
+EXPORT_KINDS = {"requests": "requests", "заявки": "requests", "users": "users", "пользователи": "users"}
+
+@admin_router.message(Command("export"))
+async def export_command(message: Message):
+    """Выгрузить заявки или пользователей файлом: /export [заявки|пользователи] [xlsx|csv] [архив]"""
+    if not await db.is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    kind, fmt, include_archive = "requests", "xlsx", False
+    for part in message.text.split()[1:]:
+        part = part.lower()
+        if part in EXPORT_KINDS:
+            kind = EXPORT_KINDS[part]
+        elif part in EXPORT_FORMATS:
+            fmt = part
+        elif part in ("архив", "archive"):
+            include_archive = True
+        else:
+            await message.answer(
+                "❌ Неверный формат команды.\n"
+                "Используйте: `/export [заявки|пользователи] [xlsx|csv] [архив]`\n"
+                "Например: `/export заявки csv архив`",
+                parse_mode="Markdown"
+            )
+            return
+
+    status_message = await message.answer("⏳ Готовлю выгрузку...")
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            archive_path = db.archive_path if include_archive else None
+            path, count = await export_table(db.db_path, kind, fmt, temp_dir, archive_path)
+            caption = f"📤 {'Заявки' if kind == 'requests' else 'Пользователи'}: {count} строк"
+            await message.answer_document(FSInputFile(path), caption=caption)
+        await status_message.delete()
+    except Exception as e:
+        await status_message.edit_text(f"❌ Ошибка выгрузки: {str(e)}")
+
+@admin_router.message(Command("backup"))
+async def backup_command(message: Message):
+    """Снять резервную копию базы данных (и архива заявок) без остановки бота"""
+    if not await db.is_admin(message.from_user.id):
+        await message.answer("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    status_message = await message.answer("⏳ Создаю резервную копию...")
+    try:
+        backups = await backup_database(db)
+    except Exception as e:
+        await status_message.edit_text(f"❌ Ошибка резервного копирования: {str(e)}")
+        return
+
+    text = "💾 <b>Резервная копия создана</b>\n\n"
+    for backup in backups:
+        text += f"• <code>{os.path.basename(backup.path)}</code> - {backup.size / 1024:.0f} КБ за {backup.duration:.1f} с\n"
+    text += f"\nВсего копий в хранилище: {len(list_backups())}"
+    await status_message.edit_text(text, parse_mode="HTML")
+
 # Вспомогательные функции
 
+def get_handler_stats_keyboard():
+    """Клавиатура экрана статистики хендлеров"""
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="🔄 Обновить", callback_data="handler_stats_refresh"))
+    builder.add(InlineKeyboardButton(text="📤 Экспорт метрик", callback_data="api_stats_export"))
+    builder.adjust(2)
+    return builder.as_markup()
+
+def format_handler_stats() -> str:
+    """Сформировать текст статистики времени работы хендлеров"""
+    from handler_timing_middleware import get_handler_stats_summary, HANDLER_STATS_WINDOW_SECONDS
+    
+    summary = get_handler_stats_summary()
+    minutes = HANDLER_STATS_WINDOW_SECONDS // 60
+    if not summary:
+        return f"⏱ <b>Хендлеры</b>\n\nЗа последние {minutes} мин. вызовов не было."
+    
+    def ms(value):
+        return f"{value * 1000:.0f}" if value is not None else "-"
+    
+    text = f"⏱ <b>Хендлеры за {minutes} мин.</b>\n"
+    text += "<i>p50 / p95 / p99, мс</i>\n\n"
+    for router_name, handler_name, count, p50, p95, p99 in summary:
+        text += f"<b>{escape_html(router_name)}.{escape_html(handler_name)}</b>: {count} выз.\n"
+        text += f"   ⏱ {ms(p50)} / {ms(p95)} / {ms(p99)}\n"
+    
+    return text
+
+def get_api_stats_keyboard():
+    """Клавиатура экрана статистики Bot API"""
+    builder = InlineKeyboardBuilder()
+    builder.add(InlineKeyboardButton(text="🔄 Обновить", callback_data="api_stats_refresh"))
+    builder.add(InlineKeyboardButton(text="📤 Экспорт метрик", callback_data="api_stats_export"))
+    builder.adjust(2)
+    return builder.as_markup()
+
+def format_api_stats() -> str:
+    """Сформировать текст статистики вызовов Bot API"""
+    from api_metrics_middleware import get_api_methods_summary, get_api_error_codes
+    
+    summary = get_api_methods_summary()
+    if not summary:
+        return "📡 <b>Telegram Bot API</b>\n\nВызовов пока не было."
+    
+    def ms(value):
+        return f"{value * 1000:.0f}" if value is not None else "-"
+    
+    text = "📡 <b>Telegram Bot API</b>\n"
+    text += "<i>задержки p50 / p95 / p99, мс</i>\n\n"
+    for api_method, total, errors, retries, p50, p95, p99 in summary:
+        text += f"<b>{escape_html(api_method)}</b>: {total} выз.\n"
+        text += f"   ⏱ {ms(p50)} / {ms(p95)} / {ms(p99)}\n"
+        if errors:
+            codes = ", ".join(f"{code}×{count}" for code, count in get_api_error_codes(api_method))
+            text += f"   ❌ Ошибок: {errors} ({codes})\n"
+        if retries:
+            text += f"   ⏳ Retry-after: {retries}\n"
+    
+    return text
+
 def escape_markdown(text: str) -> str:
     """Экранировать специальные символы markdown"""
     if not text:
@@ -1021,189 +1346,159 @@ def escape_html(text: str) -> str:
     
     return text
 
-async def get_active_requests_detailed():
-    """Получить детальную информацию об активных заявках"""
-    try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            cursor = await conn.execute('''
-                SELECT fm.id, fm.user_id, fm.username, fm.first_name, 
-                       fm.message_text, fm.created_at, d.name as direction_name
-                FROM feedback_messages fm
-                LEFT JOIN directions d ON fm.direction_id = d.id
-                WHERE fm.status = 'active'
-                ORDER BY fm.created_at DESC
-            ''')
-            return await cursor.fetchall()
-    except Exception:
-        return []
-
 async def get_closed_requests_summary():
     """Получить сводку закрытых заявок"""
     try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            cursor = await conn.execute('''
-                SELECT COUNT(*) as total,
-                       COUNT(CASE WHEN answered_at > datetime('now', '-1 day') THEN 1 END) as today,
-                       COUNT(CASE WHEN answered_at > datetime('now', '-7 days') THEN 1 END) as week
-                FROM feedback_messages 
-                WHERE status = 'closed'
-            ''')
-            stats = await cursor.fetchone()
-            
-            if not stats:
-                return "📊 Закрытых заявок нет"
-            
-            total, today, week = stats
-            
-            text = f"📊 Всего закрыто: {total}\n"
-            text += f"📅 За сегодня: {today}\n"
-            text += f"📅 За неделю: {week}"
-            
-            return text
-            
+        counters = await db.get_request_counters()
+        total = counters.total('closed')
+        if not total:
+            return "📊 Закрытых заявок нет"
+        
+        today = await db.count_requests_since('-1 day', metric='closed')
+        week = await db.count_requests_since('-7 days', metric='closed')
+        
+        text = f"📊 Всего закрыто: {total}\n"
+        text += f"📅 За сегодня: {today}\n"
+        text += f"📅 За неделю: {week}"
+        
+        return text
+        
     except Exception as e:
         return f"❌ Ошибка получения данных: {str(e)}"
 
-async def get_requests_by_username(username: str):
-    """Получить заявки по username"""
-    try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            cursor = await conn.execute('''
-                SELECT fm.id, fm.message_text, fm.created_at, fm.status, d.name as direction_name
-                FROM feedback_messages fm
-                LEFT JOIN directions d ON fm.direction_id = d.id
-                WHERE fm.username = ?
-                ORDER BY fm.created_at DESC
-            ''', (username,))
-            return await cursor.fetchall()
-    except Exception:
-        return []
-
-async def get_requests_by_user_id(user_id: int):
-    """Получить заявки по user_id"""
-    try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            cursor = await conn.execute('''
-                SELECT fm.id, fm.message_text, fm.created_at, fm.status, d.name as direction_name
-                FROM feedback_messages fm
-                LEFT JOIN directions d ON fm.direction_id = d.id
-                WHERE fm.user_id = ?
-                ORDER BY fm.created_at DESC
-            ''', (user_id,))
-            return await cursor.fetchall()
-    except Exception:
-        return []
-
 async def get_general_statistics():
     """Получить общую статистику"""
     try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            # Статистика заявок
-            cursor = await conn.execute('''
-                SELECT 
-                    COUNT(*) as total_requests,
-                    COUNT(CASE WHEN status = 'active' THEN 1 END) as active_requests,
-                    COUNT(CASE WHEN created_at > datetime('now', '-1 day') THEN 1 END) as today_requests,
-                    COUNT(CASE WHEN created_at > datetime('now', '-7 days') THEN 1 END) as week_requests
-                FROM feedback_messages
-            ''')
-            request_stats = await cursor.fetchone()
-            
-            # Статистика пользователей
-            cursor = await conn.execute('''
-                SELECT 
-                    COUNT(DISTINCT user_id) as total_users,
-                    COUNT(DISTINCT CASE WHEN created_at > datetime('now', '-30 days') THEN user_id END) as active_users
-                FROM feedback_messages
-            ''')
-            user_stats = await cursor.fetchone()
-            
-            # Статистика админов и преподавателей
+        # Итоги - из счётчиков, окна за сутки/неделю/месяц - из почасовых и посуточных сводок
+        counters = await db.get_request_counters()
+        total_req = counters.total('total')
+        active_req = counters.total('active')
+        today_req = await db.count_requests_since('-1 day')
+        week_req = await db.count_requests_since('-7 days')
+        
+        # Статистика пользователей
+        total_users = counters.total('users')
+        active_users = await db.count_users_since('-30 days')
+        
+        # Статистика админов и преподавателей
+        async with db.read() as conn:
             cursor = await conn.execute('SELECT COUNT(*) FROM admins')
             admin_count = (await cursor.fetchone())[0]
             
             cursor = await conn.execute('SELECT COUNT(*) FROM teachers WHERE is_active = TRUE')
             teacher_count = (await cursor.fetchone())[0]
-            
-            if not request_stats:
-                return "❌ Не удалось получить статистику"
-            
-            total_req, active_req, today_req, week_req = request_stats
-            total_users, active_users = user_stats if user_stats else (0, 0)
-            
-            text = "📊 *Общая статистика IT-Cube Bot*\n\n"
-            
-            text += "🎫 *Заявки:*\n"
-            text += f"• Всего: {total_req}\n"
-            text += f"• Активных: {active_req}\n"
-            text += f"• За сегодня: {today_req}\n"
-            text += f"• За неделю: {week_req}\n\n"
-            
-            text += "👥 *Пользователи:*\n"
-            text += f"• Всего: {total_users}\n"
-            text += f"• Активных за месяц: {active_users}\n\n"
-            
-            text += "👑 *Персонал:*\n"
-            text += f"• Администраторов: {admin_count}\n"
-            text += f"• Преподавателей: {teacher_count}\n\n"
-            
-            if total_req > 0:
-                response_rate = round(((total_req - active_req) / total_req) * 100, 1)
-                text += f"📈 *Процент обработки заявок:* {response_rate}%"
-            
-            return text
-            
+        
+        text = "📊 *Общая статистика IT-Cube Bot*\n\n"
+        
+        text += "🎫 *Заявки:*\n"
+        text += f"• Всего: {total_req}\n"
+        text += f"• Активных: {active_req}\n"
+        text += f"• За сегодня: {today_req}\n"
+        text += f"• За неделю: {week_req}\n\n"
+        
+        text += "👥 *Пользователи:*\n"
+        text += f"• Всего: {total_users}\n"
+        text += f"• Активных за месяц: {active_users}\n\n"
+        
+        text += "👑 *Персонал:*\n"
+        text += f"• Администраторов: {admin_count}\n"
+        text += f"• Преподавателей: {teacher_count}\n\n"
+        
+        if total_req > 0:
+            response_rate = round(((total_req - active_req) / total_req) * 100, 1)
+            text += f"📈 *Процент обработки заявок:* {response_rate}%"
+        
+        return text
+        
     except Exception as e:
         # Экранируем специальные символы Markdown в сообщении об ошибке
         error_msg = escape_markdown(str(e))
         return f"❌ Ошибка получения статистики: {error_msg}"
 
 async def get_requests_statistics():
-    """Статистика заявок"""
-    # Здесь будет детальная статистика заявок
-    return "🎫 *Подробная статистика заявок будет добавлена*"
+    """Статистика заявок: тепловая карта, динамика направлений, возраст активных заявок"""
+    try:
+        report = await analytics.get(db.db_path, db.archive_path)
+        return format_requests_report(report, escape_markdown)
+    except Exception as e:
+        error_msg = escape_markdown(str(e))
+        return f"❌ Ошибка получения статистики: {error_msg}"
 
 async def get_users_statistics():
-    """Статистика пользователей"""
-    # Здесь будет статистика пользователей
-    return "👥 *Подробная статистика пользователей будет добавлена*"
+    """Статистика пользователей: активность, повторные обращения, когорты"""
+    try:
+        report = await analytics.get(db.db_path, db.archive_path)
+        return format_users_report(report)
+    except Exception as e:
+        error_msg = escape_markdown(str(e))
+        return f"❌ Ошибка получения статистики: {error_msg}"
 
 async def get_directions_statistics():
     """Статистика по направлениям"""
     try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            cursor = await conn.execute('''
-                SELECT d.name, COUNT(fm.id) as request_count,
-                       COUNT(CASE WHEN fm.status = 'active' THEN 1 END) as active_count
-                FROM directions d
-                LEFT JOIN feedback_messages fm ON d.id = fm.direction_id
-                GROUP BY d.id, d.name
-                ORDER BY request_count DESC
-            ''')
-            direction_stats = await cursor.fetchall()
-            
-            if not direction_stats:
-                return "📚 *Статистика по направлениям*\n\n❌ Данные не найдены"
-            
-            text = "📚 *Статистика по направлениям*\n\n"
-            
-            for direction_name, total, active in direction_stats:
-                text += f"📖 *{direction_name}*\n"
-                text += f"• Всего заявок: {total}\n"
-                text += f"• Активных: {active}\n\n"
-            
-            return text
-            
+        counters = await db.get_request_counters()
+        direction_stats = sorted(
+            ((name, counters.direction(direction_id, 'total'), counters.direction(direction_id, 'active'))
+             for direction_id, name in await db.get_all_directions()),
+            key=lambda item: item[1], reverse=True
+        )
+        
+        if not direction_stats:
+            return "📚 *Статистика по направлениям*\n\n❌ Данные не найдены"
+        
+        text = "📚 *Статистика по направлениям*\n\n"
+        
+        for direction_name, total, active in direction_stats:
+            text += f"📖 *{direction_name}*\n"
+            text += f"• Всего заявок: {total}\n"
+            text += f"• Активных: {active}\n\n"
+        
+        return text
+        
+    except Exception as e:
+        # Экранируем специальные символы Markdown в сообщении об ошибке
+        error_msg = escape_markdown(str(e))
+        return f"❌ Ошибка получения статистики: {error_msg}"
+
+async def get_response_times_statistics():
+    """Время ответа на заявки: общее, по направлениям и по сотрудникам"""
+    try:
+        sketches = await db.get_response_time_sketches()
+        overall = sketches.get(('all', 0))
+        if overall is None or overall.count <= 0:
+            return "⏱ *Время ответа*\n\n❌ Пока нет заявок, закрытых с ответом"
+
+        text = "⏱ *Время ответа*\n\n"
+        text += f"📊 *Все заявки* ({overall.count}):\n{format_percentiles(overall)}\n\n"
+
+        directions = dict(await db.get_all_directions())
+        text += "📚 *По направлениям:*\n"
+        for (dimension, direction_id), sketch in sorted(sketches.items(), key=lambda item: -item[1].count):
+            if dimension == 'direction' and sketch.count > 0:
+                name = escape_markdown(directions.get(direction_id, "Без направления"))
+                text += f"• {name} ({sketch.count}): {format_percentiles(sketch)}\n"
+
+        text += "\n👥 *По сотрудникам:*\n"
+        for (dimension, user_id), sketch in sorted(sketches.items(), key=lambda item: -item[1].count):
+            if dimension == 'responder' and sketch.count > 0:
+                name = escape_markdown(metadata.display_name(user_id))
+                text += f"• {name} ({sketch.count}): {format_percentiles(sketch)}\n"
+
+        return text
+
     except Exception as e:
         # Экранируем специальные символы Markdown в сообщении об ошибке
         error_msg = escape_markdown(str(e))
         return f"❌ Ошибка получения статистики: {error_msg}"
 
 async def get_all_bot_users():
-    """Получить всех пользователей бота"""
+    """Получить всех пользователей бота (авторов заявок, в том числе перенесённых в архив)"""
     try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            cursor = await conn.execute('SELECT DISTINCT user_id FROM feedback_messages')
+        async with db.read() as conn:
+            source = 'feedback_messages'
+            if await archive.attach(conn, db.archive_path):
+                source = archive.feedback_source()
+            cursor = await conn.execute(f'SELECT DISTINCT user_id FROM {source}')
             users = await cursor.fetchall()
             return [user[0] for user in users]
     except Exception:
@@ -1214,7 +1509,7 @@ async def get_all_bot_users():
 async def get_request_detailed_info(request_id: int):
     """Получить подробную информацию о конкретной заявке"""
     try:
-        async with aiosqlite.connect(db.db_path) as conn:
+        async with db.connect() as conn:
             cursor = await conn.execute('''
                 SELECT fm.id, fm.user_id, fm.username, fm.first_name, fm.message_text, 
                        fm.created_at, d.name as direction_name, fm.status
@@ -1228,27 +1523,22 @@ async def get_request_detailed_info(request_id: int):
         return None
 
 async def get_requests_by_directions():
-    """Получить статистику заявок по направлениям"""
+    """Получить статистику заявок по направлениям (из счётчиков, вместе с архивом)"""
     try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            cursor = await conn.execute('''
-                SELECT 
-                    COALESCE(d.name, 'Без направления') as direction_name,
-                    COUNT(CASE WHEN fm.status = 'active' THEN 1 END) as active_count,
-                    COUNT(*) as total_count
-                FROM feedback_messages fm
-                LEFT JOIN directions d ON fm.direction_id = d.id
-                GROUP BY d.name
-                ORDER BY total_count DESC
-            ''')
-            return await cursor.fetchall()
+        counters = await db.get_request_counters()
+        directions = [(0, 'Без направления')] + list(await db.get_all_directions())
+        stats = [
+            (name, counters.direction(direction_id, 'active'), counters.direction(direction_id, 'total'))
+            for direction_id, name in directions
+        ]
+        return sorted((item for item in stats if item[2]), key=lambda item: item[2], reverse=True)
     except Exception:
         return []
 
 async def get_recent_requests():
     """Получить недавние заявки (за последние 24 часа)"""
     try:
-        async with aiosqlite.connect(db.db_path) as conn:
+        async with db.read() as conn:
             cursor = await conn.execute('''
                 SELECT fm.id, fm.user_id, fm.username, fm.first_name, fm.message_text, 
                        fm.created_at, d.name as direction_name
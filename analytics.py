@@ -0,0 +1,288 @@
+"""
+Аналитика по истории заявок и пользователей для экранов статистики.
+Заявки и users_log читаются из SQLite порциями по ANALYTICS_CHUNK_SIZE строк в pandas;
+каждая порция сворачивается векторными операциями в небольшие промежуточные итоги
+(матрица день недели × час, недельные счётчики направлений, пары пользователь-месяц),
+поэтому память не растёт вместе с историей; заявки из архива (archive.py) тоже учитываются.
+Отчёт строится в отдельном потоке на соединении полосы чтения (read_lane.py), чтобы
+не блокировать цикл событий и запись заявок, и кэшируется до конца суток.
+"""
+import asyncio
+import os
+from datetime import date, datetime
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+
+import archive
+import read_lane
+
+# Строк в одной порции чтения из БД
+ANALYTICS_CHUNK_SIZE = 5000
+# Сколько недель показывать в динамике по направлениям
+TREND_WEEKS = 8
+# Сколько последних месячных когорт показывать
+COHORT_MONTHS = 6
+
+WEEKDAYS = ("Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс")
+HEATMAP_SHADES = " ·░▒▓█"
+# Часов в одной колонке тепловой карты (24 часа не помещаются в ширину сообщения)
+HEATMAP_HOURS_PER_COLUMN = 3
+
+# Возраст активных заявок, часы
+BACKLOG_BINS = [0, 1, 24, 72, 168, np.inf]
+BACKLOG_LABELS = ["до 1 ч", "1–24 ч", "1–3 дн", "3–7 дн", "больше недели"]
+
+# Число сообщений пользователя боту
+MESSAGES_BINS = [0, 1, 5, 20, np.inf]
+MESSAGES_LABELS = ["1", "2–5", "6–20", "больше 20"]
+
+
+class AnalyticsReport(NamedTuple):
+    """Готовый отчёт (время - местное время сервера)"""
+    day: str
+    built_at: datetime
+    total_requests: int
+    heatmap: np.ndarray                 # 7 × 24: заявки по дню недели и часу создания
+    direction_weeks: pd.DataFrame       # направление × неделя (начало недели): число заявок
+    direction_names: Dict[int, str]
+    backlog: pd.Series                  # возрастная группа -> число активных заявок
+    backlog_median_hours: Optional[float]
+    cohorts: pd.DataFrame               # месяц первой заявки × месяцев спустя: уникальные авторы
+    users: Dict[str, int]               # итоги по users_log
+    messages: pd.Series                 # группа по числу сообщений -> число пользователей
+
+
+def _local_offset() -> pd.Timedelta:
+    """Смещение местного времени сервера от UTC (в БД хранится CURRENT_TIMESTAMP, т.е. UTC)"""
+    return pd.Timedelta(datetime.now().astimezone().utcoffset())
+
+
+def _month_index(moments: pd.Series) -> pd.Series:
+    """Номер месяца (год * 12 + месяц) - для векторного вычитания месяцев"""
+    return moments.dt.year * 12 + moments.dt.month - 1
+
+
+def _read_requests(conn, now: pd.Timestamp, offset: pd.Timedelta, source: str = "feedback_messages"):
+    """Порционный проход по заявкам source: тепловая карта, недели направлений, возраст, когорты"""
+    heatmap = np.zeros((7, 24), dtype=np.int64)
+    weekly: Optional[pd.Series] = None
+    ages: List[np.ndarray] = []
+    user_months: List[pd.DataFrame] = []
+    total = 0
+    trend_start = (now + offset).normalize() - pd.Timedelta(weeks=TREND_WEEKS)
+    trend_start -= pd.Timedelta(days=trend_start.weekday())
+
+    chunks = pd.read_sql_query(
+        f"SELECT user_id, created_at, status, IFNULL(direction_id, 0) AS direction_id FROM {source}",
+        conn, chunksize=ANALYTICS_CHUNK_SIZE, parse_dates=["created_at"],
+    )
+    for chunk in chunks:
+        chunk = chunk.dropna(subset=["created_at"])
+        if chunk.empty:
+            # Пустая таблица даёт одну пустую порцию без типов дат
+            continue
+        total += len(chunk)
+        local = chunk["created_at"] + offset
+        np.add.at(heatmap, (local.dt.weekday.to_numpy(), local.dt.hour.to_numpy()), 1)
+
+        recent = local >= trend_start
+        counts = pd.DataFrame({
+            "direction_id": chunk.loc[recent, "direction_id"],
+            "week": (local[recent] - trend_start) // pd.Timedelta(weeks=1),
+        }).groupby(["direction_id", "week"]).size()
+        weekly = counts if weekly is None else weekly.add(counts, fill_value=0)
+
+        active = chunk["status"].fillna("active") == "active"
+        ages.append(((now - chunk.loc[active, "created_at"]) / pd.Timedelta(hours=1)).to_numpy())
+
+        user_months.append(
+            pd.DataFrame({"user_id": chunk["user_id"], "month": _month_index(local)}).drop_duplicates()
+        )
+
+    week_starts = [(trend_start + pd.Timedelta(weeks=i)).date() for i in range(TREND_WEEKS + 1)]
+    if weekly is not None and len(weekly):
+        direction_weeks = weekly.astype("int64").unstack(fill_value=0)
+        direction_weeks = direction_weeks.reindex(columns=range(len(week_starts)), fill_value=0)
+        direction_weeks.columns = week_starts
+    else:
+        direction_weeks = pd.DataFrame(columns=week_starts, dtype="int64")
+
+    ages_array = np.concatenate(ages) if ages else np.array([])
+    backlog = pd.cut(pd.Series(ages_array, dtype="float64"), BACKLOG_BINS, labels=BACKLOG_LABELS, right=False)
+    backlog = backlog.value_counts().reindex(BACKLOG_LABELS, fill_value=0)
+    median = float(np.median(ages_array)) if len(ages_array) else None
+
+    return total, heatmap, direction_weeks, backlog, median, _cohorts(user_months)
+
+
+def _cohorts(user_months: List[pd.DataFrame]) -> pd.DataFrame:
+    """Когорты по месяцу первой заявки: сколько авторов написали снова через 0, 1, 2... месяцев"""
+    if not user_months:
+        return pd.DataFrame()
+    pairs = pd.concat(user_months, ignore_index=True).drop_duplicates()
+    if pairs.empty:
+        return pd.DataFrame()
+    pairs["cohort"] = pairs.groupby("user_id")["month"].transform("min")
+    pairs["age"] = pairs["month"] - pairs["cohort"]
+    table = pairs.groupby(["cohort", "age"])["user_id"].nunique().unstack(fill_value=0)
+    table = table.sort_index().tail(COHORT_MONTHS)
+    table.index = [f"{month // 12}-{month % 12 + 1:02d}" for month in table.index]
+    return table
+
+
+def _read_users(conn, now: pd.Timestamp):
+    """Порционный проход по users_log: новые, активные и вернувшиеся пользователи"""
+    users = {"total": 0, "new_30": 0, "active_7": 0, "active_30": 0, "returning": 0}
+    messages = pd.Series(0, index=MESSAGES_LABELS, dtype="int64")
+    chunks = pd.read_sql_query(
+        "SELECT first_interaction, last_interaction, total_messages FROM users_log",
+        conn, chunksize=ANALYTICS_CHUNK_SIZE, parse_dates=["first_interaction", "last_interaction"],
+    )
+    for chunk in chunks:
+        if chunk.empty:
+            continue
+        first, last = chunk["first_interaction"], chunk["last_interaction"]
+        users["total"] += len(chunk)
+        users["new_30"] += int((first >= now - pd.Timedelta(days=30)).sum())
+        users["active_7"] += int((last >= now - pd.Timedelta(days=7)).sum())
+        users["active_30"] += int((last >= now - pd.Timedelta(days=30)).sum())
+        # Вернувшийся - писал боту не только в день первого обращения
+        users["returning"] += int((last.dt.normalize() > first.dt.normalize()).sum())
+        groups = pd.cut(chunk["total_messages"].fillna(1), MESSAGES_BINS, labels=MESSAGES_LABELS)
+        messages = messages.add(groups.value_counts(), fill_value=0).astype("int64")
+    return users, messages.reindex(MESSAGES_LABELS, fill_value=0)
+
+
+def build_report(db_path: str, now: datetime = None, archive_path: str = None) -> AnalyticsReport:
+    """
+    Построить отчёт (синхронно; вызывается в отдельном потоке). now - текущее время UTC,
+    archive_path - файл архива заявок (если он есть, архивные заявки тоже учитываются)
+    """
+    now = pd.Timestamp(now) if now is not None else pd.Timestamp.now(tz="UTC").tz_localize(None)
+    offset = _local_offset()
+    conn = read_lane.open_readonly(db_path)
+    try:
+        source = "feedback_messages"
+        if archive_path and os.path.exists(archive_path):
+            conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+            source = archive.feedback_source()
+        total, heatmap, direction_weeks, backlog, median, cohorts = _read_requests(conn, now, offset, source)
+        users, messages = _read_users(conn, now)
+        direction_names = dict(conn.execute('SELECT id, name FROM directions').fetchall())
+    finally:
+        conn.close()
+    local_now = (now + offset).to_pydatetime()
+    return AnalyticsReport(
+        day=local_now.date().isoformat(), built_at=local_now, total_requests=total, heatmap=heatmap,
+        direction_weeks=direction_weeks, direction_names=direction_names, backlog=backlog,
+        backlog_median_hours=median, cohorts=cohorts, users=users, messages=messages,
+    )
+
+
+class AnalyticsCache:
+    """Отчёт, построенный не раньше начала текущих суток; строится один раз при одновременных запросах"""
+
+    def __init__(self):
+        self._report: Optional[AnalyticsReport] = None
+        self._lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        return self._report is not None and self._report.day == date.today().isoformat()
+
+    async def get(self, db_path: str, archive_path: str = None) -> AnalyticsReport:
+        if not self._fresh():
+            async with self._lock:
+                if not self._fresh():
+                    async with read_lane.slots:
+                        self._report = await asyncio.to_thread(build_report, db_path, archive_path=archive_path)
+        return self._report
+
+    def invalidate(self):
+        self._report = None
+
+
+analytics = AnalyticsCache()
+
+
+def _hours(value: float) -> str:
+    if value < 24:
+        return f"{value:.1f} ч"
+    return f"{value / 24:.1f} дн"
+
+
+def format_heatmap(heatmap: np.ndarray) -> str:
+    """Тепловая карта день недели × время суток моноширинным блоком"""
+    step = HEATMAP_HOURS_PER_COLUMN
+    blocks = heatmap.reshape(7, 24 // step, step).sum(axis=2)
+    peak = blocks.max()
+    levels = np.zeros_like(blocks) if peak == 0 else np.ceil(blocks / peak * (len(HEATMAP_SHADES) - 1))
+    header = "   " + "".join(f"{hour:<{step}}"[:step] for hour in range(0, 24, step))
+    rows = [header]
+    for weekday, row in zip(WEEKDAYS, levels.astype(int)):
+        rows.append(f"{weekday} " + "".join(HEATMAP_SHADES[level] * step for level in row))
+    return "\n".join(rows)
+
+
+def format_requests_report(report: AnalyticsReport, escape: Callable[[str], str]) -> str:
+    """Экран «Статистика заявок» (Markdown); escape - функция экранирования Markdown"""
+    text = "🎫 *Статистика заявок*\n\n"
+    if not report.total_requests:
+        return text + "❌ Заявок пока нет"
+
+    weekday, hour = np.unravel_index(report.heatmap.argmax(), report.heatmap.shape)
+    text += f"🕒 *Когда пишут* (всего {report.total_requests}, пик - {WEEKDAYS[weekday]} {hour:02d}:00–{hour + 1:02d}:00):\n"
+    text += f"```\n{format_heatmap(report.heatmap)}\n```\n"
+
+    text += f"📈 *По направлениям за {TREND_WEEKS} нед.* (прошлая → текущая неделя):\n"
+    weeks = report.direction_weeks
+    if weeks.empty:
+        text += "• Заявок за этот период нет\n"
+    else:
+        order = weeks.sum(axis=1).sort_values(ascending=False).index
+        for direction_id in order:
+            counts = weeks.loc[direction_id].to_numpy()
+            name = escape(report.direction_names.get(direction_id, "Без направления"))
+            trend = "↗️" if counts[-2] > counts[-3] else "↘️" if counts[-2] < counts[-3] else "➡️"
+            text += f"• {name}: {int(counts.sum())} {trend} {counts[-2]} → {counts[-1]}\n"
+
+    text += "\n⏳ *Возраст активных заявок:*\n"
+    if report.backlog_median_hours is None:
+        text += "• Активных заявок нет\n"
+    else:
+        for label, count in report.backlog.items():
+            text += f"• {label}: {count}\n"
+        text += f"• Медиана: {_hours(report.backlog_median_hours)}\n"
+
+    text += f"\n_Данные на {report.built_at:%d.%m.%Y %H:%M}, обновляются раз в сутки_"
+    return text
+
+
+def format_users_report(report: AnalyticsReport) -> str:
+    """Экран «Активность пользователей» (Markdown)"""
+    users = report.users
+    text = "👥 *Активность пользователей*\n\n"
+    text += f"• Всего писали боту: {users['total']}\n"
+    text += f"• Новых за 30 дней: {users['new_30']}\n"
+    text += f"• Активных за 7 дней: {users['active_7']}\n"
+    text += f"• Активных за 30 дней: {users['active_30']}\n"
+    if users["total"]:
+        share = round(users["returning"] / users["total"] * 100, 1)
+        text += f"• Вернулись повторно: {users['returning']} ({share}%)\n"
+
+    text += "\n💬 *Сообщений от пользователя:*\n"
+    for label, count in report.messages.items():
+        text += f"• {label}: {count}\n"
+
+    cohorts = report.cohorts
+    if not cohorts.empty:
+        ages = [age for age in cohorts.columns if age <= 3]
+        text += "\n🔁 *Когорты авторов заявок* (месяц первой заявки: авторов, из них писали через 1/2/3 мес.):\n"
+        for month, row in cohorts.iterrows():
+            size = int(row.get(0, 0))
+            later = " / ".join(str(int(row.get(age, 0))) for age in ages if age > 0) or "—"
+            text += f"• {month}: {size}, {later}\n"
+
+    text += f"\n_Данные на {report.built_at:%d.%m.%Y %H:%M}, обновляются раз в сутки_"
+    return text
@@ -0,0 +1,114 @@
+"""
+Middleware сессии бота для учёта вызовов Telegram Bot API:
+количество вызовов, задержки, коды ошибок и события retry-after по каждому методу
+"""
+import time
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramBadRequest, TelegramConflictError, TelegramEntityTooLarge,
+    TelegramForbiddenError, TelegramMigrateToChat, TelegramNetworkError, TelegramNotFound,
+    TelegramRetryAfter, TelegramServerError, TelegramUnauthorizedError
+)
+
+from metrics import registry
+from update_trace import add_api_time
+
+api_requests = registry.counter(
+    "telegram_api_requests_total", "Вызовы Telegram Bot API", ("method", "result")
+)
+api_latency = registry.histogram(
+    "telegram_api_request_duration_seconds", "Длительность вызовов Telegram Bot API", ("method",)
+)
+api_errors = registry.counter(
+    "telegram_api_errors_total", "Ошибки Telegram Bot API по кодам", ("method", "code")
+)
+api_retry_after = registry.counter(
+    "telegram_api_retry_after_total", "Ответы 429 (retry-after) от Telegram Bot API", ("method",)
+)
+api_retry_after_seconds = registry.counter(
+    "telegram_api_retry_after_seconds_total", "Суммарное время ожидания retry-after", ("method",)
+)
+
+# Время (time.monotonic) последнего успешного вызова по методу; getUpdates - признак живого polling
+last_success_at = {}
+
+# Соответствие исключений aiogram кодам ответа Bot API (порядок важен: подклассы раньше)
+_ERROR_CODES = (
+    (TelegramRetryAfter, "429"),
+    (TelegramMigrateToChat, "400"),
+    (TelegramBadRequest, "400"),
+    (TelegramUnauthorizedError, "401"),
+    (TelegramForbiddenError, "403"),
+    (TelegramNotFound, "404"),
+    (TelegramConflictError, "409"),
+    (TelegramEntityTooLarge, "413"),
+    (TelegramServerError, "5xx"),
+    (TelegramNetworkError, "network"),
+)
+
+
+def error_code(error: Exception) -> str:
+    """Получить код ошибки Bot API по исключению aiogram"""
+    for error_class, code in _ERROR_CODES:
+        if isinstance(error, error_class):
+            return code
+    if isinstance(error, TelegramAPIError):
+        return "api"
+    return "exception"
+
+
+class TelegramApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware для сбора метрик по вызовам Bot API"""
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot, method):
+        api_method = method.__api_method__
+        started = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+        except Exception as e:
+            duration = time.perf_counter() - started
+            api_latency.observe(duration, api_method)
+            add_api_time(duration)
+            code = error_code(e)
+            api_requests.inc(api_method, "error")
+            api_errors.inc(api_method, code)
+            if isinstance(e, TelegramRetryAfter):
+                api_retry_after.inc(api_method)
+                api_retry_after_seconds.inc(api_method, amount=e.retry_after)
+            raise
+        duration = time.perf_counter() - started
+        api_latency.observe(duration, api_method)
+        add_api_time(duration)
+        api_requests.inc(api_method, "ok")
+        last_success_at[api_method] = time.monotonic()
+        return response
+
+
+def get_api_methods_summary():
+    """
+    Сводка по методам Bot API: список кортежей
+    (метод, вызовов, ошибок, retry-after, p50, p95, p99) с задержками в секундах
+    """
+    summary = []
+    for (api_method,) in api_latency.label_sets():
+        total = api_latency.count(api_method)
+        errors = api_requests.get(api_method, "error")
+        retries = api_retry_after.get(api_method)
+        summary.append((
+            api_method,
+            total,
+            int(errors),
+            int(retries),
+            api_latency.percentile(0.50, api_method),
+            api_latency.percentile(0.95, api_method),
+            api_latency.percentile(0.99, api_method),
+        ))
+    summary.sort(key=lambda row: row[1], reverse=True)
+    return summary
+
+
+def get_api_error_codes(api_method: str):
+    """Разбивка ошибок метода по кодам"""
+    return sorted(
+        (labels[1], int(value)) for labels, value in api_errors.items() if labels[0] == api_method
+    )
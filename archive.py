@@ -0,0 +1,160 @@
+"""
+Архив старых закрытых заявок.
+Закрытые заявки старше ARCHIVE_AFTER_DAYS вместе с их уведомлениями и вложениями переносятся
+в отдельный файл ARCHIVE_DATABASE_PATH (подключается к соединению через ATTACH как схема archive)
+порциями по ARCHIVE_BATCH_SIZE заявок - каждая порция в своей транзакции, чтобы не держать
+блокировку записи. Рабочая база остаётся небольшой и помещается в кэш страниц.
+
+Статистика переноса не замечает: сводки и гистограммы времени ответа - история событий
+и при удалении не меняются, а пересчёт с нуля читает заявки рабочей базы вместе с архивом
+(feedback_source); вклад заявок в счётчики сохраняется (request_counters.keep_archived).
+Полнотекстовый поиск работает только по рабочей базе.
+
+В режиме WAL транзакция с подключённой базой атомарна для каждого файла отдельно, поэтому
+копирование идёт через INSERT OR REPLACE: если процесс упадёт между фиксациями, повторный
+перенос той же порции просто перезапишет уже скопированные строки.
+"""
+import asyncio
+import logging
+import os
+from typing import List
+
+import request_counters
+from config import ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, ARCHIVE_INTERVAL_HOURS
+
+logger = logging.getLogger(__name__)
+
+# Колонки переносимых таблиц (явно: порядок колонок в старых базах отличается из-за ALTER TABLE)
+FEEDBACK_COLUMNS = (
+    "id, user_id, username, first_name, message_text, created_at, status, is_answered, "
+    "answered_by, answer_text, answered_at, direction_id"
+)
+NOTIFICATION_COLUMNS = "id, feedback_message_id, chat_id, message_id, created_at, kind"
+ATTACHMENT_COLUMNS = "id, feedback_message_id, file_id, file_type, file_name, file_size, mime_type, created_at"
+
+ARCHIVE_SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS archive.feedback_messages (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        username TEXT,
+        first_name TEXT,
+        message_text TEXT NOT NULL,
+        created_at TIMESTAMP,
+        status TEXT,
+        is_answered BOOLEAN,
+        answered_by INTEGER,
+        answer_text TEXT,
+        answered_at TIMESTAMP,
+        direction_id INTEGER,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_archive_feedback_user ON feedback_messages(user_id, created_at)',
+    'CREATE INDEX IF NOT EXISTS archive.idx_archive_feedback_answered_by ON feedback_messages(answered_by, direction_id)',
+    '''
+    CREATE TABLE IF NOT EXISTS archive.notification_messages (
+        id INTEGER PRIMARY KEY,
+        feedback_message_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        message_id INTEGER NOT NULL,
+        created_at TIMESTAMP,
+        kind TEXT
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_archive_notifications_request ON notification_messages(feedback_message_id)',
+    '''
+    CREATE TABLE IF NOT EXISTS archive.attachments (
+        id INTEGER PRIMARY KEY,
+        feedback_message_id INTEGER NOT NULL,
+        file_id TEXT NOT NULL,
+        file_type TEXT NOT NULL,
+        file_name TEXT,
+        file_size INTEGER,
+        mime_type TEXT,
+        created_at TIMESTAMP
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS archive.idx_archive_attachments_request ON attachments(feedback_message_id)',
+]
+
+
+def feedback_source() -> str:
+    """Подзапрос со всеми заявками рабочей базы и подключённого архива (для пересчёта статистики)"""
+    return (
+        f"(SELECT {FEEDBACK_COLUMNS} FROM main.feedback_messages "
+        f"UNION ALL SELECT {FEEDBACK_COLUMNS} FROM archive.feedback_messages)"
+    )
+
+
+async def attach(conn, archive_path: str, create: bool = False) -> bool:
+    """
+    Подключить архив к соединению как схему archive (до начала транзакции).
+    Без create отсутствующий архив не создаётся; возвращает, подключён ли архив.
+    """
+    if not create and not os.path.exists(archive_path):
+        return False
+    await conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+    if create:
+        for statement in ARCHIVE_SCHEMA:
+            await conn.execute(statement)
+        await conn.commit()
+    return True
+
+
+async def _select_batch(conn, older_than_days: float, batch_size: int) -> List[int]:
+    cursor = await conn.execute('''
+        SELECT id FROM main.feedback_messages
+        WHERE status = 'closed' AND created_at < datetime('now', ?)
+        ORDER BY created_at, id
+        LIMIT ?
+    ''', (f'-{older_than_days} days', batch_size))
+    return [row[0] for row in await cursor.fetchall()]
+
+
+async def archive_batch(conn, older_than_days: float = ARCHIVE_AFTER_DAYS,
+                        batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Перенести одну порцию заявок в подключённый архив; возвращает число перенесённых заявок"""
+    await conn.execute('BEGIN IMMEDIATE')
+    try:
+        ids = await _select_batch(conn, older_than_days, batch_size)
+        if not ids:
+            await conn.rollback()
+            return 0
+        # id - целые числа из самой базы, поэтому список подставляется в текст запроса
+        id_list = ",".join(str(request_id) for request_id in ids)
+        await conn.execute(f'''
+            INSERT OR REPLACE INTO archive.feedback_messages ({FEEDBACK_COLUMNS})
+            SELECT {FEEDBACK_COLUMNS} FROM main.feedback_messages WHERE id IN ({id_list})
+        ''')
+        await conn.execute(f'''
+            INSERT OR REPLACE INTO archive.notification_messages ({NOTIFICATION_COLUMNS})
+            SELECT {NOTIFICATION_COLUMNS} FROM main.notification_messages WHERE feedback_message_id IN ({id_list})
+        ''')
+        await conn.execute(f'''
+            INSERT OR REPLACE INTO archive.attachments ({ATTACHMENT_COLUMNS})
+            SELECT {ATTACHMENT_COLUMNS} FROM main.attachments WHERE feedback_message_id IN ({id_list})
+        ''')
+        await request_counters.keep_archived(conn, f"id IN ({id_list})")
+        await conn.execute(f'DELETE FROM main.notification_messages WHERE feedback_message_id IN ({id_list})')
+        await conn.execute(f'DELETE FROM main.attachments WHERE feedback_message_id IN ({id_list})')
+        await conn.execute(f'DELETE FROM main.feedback_messages WHERE id IN ({id_list})')
+        await conn.commit()
+        return len(ids)
+    except Exception:
+        await conn.rollback()
+        raise
+
+
+async def run_archiver(database, interval_hours: float = ARCHIVE_INTERVAL_HOURS):
+    """Фоновая задача: периодически переносить старые закрытые заявки в архив"""
+    while True:
+        try:
+            moved = await database.archive_old_requests()
+            if moved:
+                logger.info(f"В архив перенесено заявок: {moved}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка переноса заявок в архив: {e}")
+        await asyncio.sleep(interval_hours * 3600)
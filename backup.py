@@ -0,0 +1,140 @@
+"""
+Резервные копии базы данных без остановки бота.
+Снимок делается через online backup API SQLite (sqlite3.Connection.backup) порциями по
+BACKUP_PAGES_PER_STEP страниц с паузой между порциями, в отдельном потоке - цикл событий
+не ждёт копирования. В режиме WAL копирование только читает базу и не мешает записи;
+если базу изменили между порциями, SQLite начинает копирование заново, поэтому снимок
+всегда согласован.
+
+Снимок проверяется (PRAGMA quick_check), сжимается gzip в файл
+<имя БД>_ГГГГММДД_ЧЧММСС.db.gz в BACKUP_DIR; хранятся BACKUP_KEEP последних копий
+каждого файла. Вместе с рабочей базой копируется архив заявок (archive.py), если он есть.
+"""
+import asyncio
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from typing import List, NamedTuple
+
+from config import BACKUP_DIR, BACKUP_KEEP, BACKUP_PAGES_PER_STEP, BACKUP_INTERVAL_HOURS
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+backup_duration = registry.gauge(
+    "db_backup_duration_seconds", "Длительность последнего резервного копирования", ("database",)
+)
+backup_size = registry.gauge(
+    "db_backup_size_bytes", "Размер последней сжатой резервной копии", ("database",)
+)
+backup_last_success = registry.gauge(
+    "db_backup_last_success_timestamp_seconds", "Время последней успешной резервной копии (unix)", ("database",)
+)
+
+# Пауза между порциями страниц, секунды
+STEP_SLEEP = 0.005
+
+# Одновременно выполняется одно копирование (команда и расписание)
+_lock = asyncio.Lock()
+
+
+class Backup(NamedTuple):
+    """Готовая резервная копия"""
+    path: str
+    size: int
+    duration: float
+
+
+def _prefix(source_path: str) -> str:
+    return os.path.splitext(os.path.basename(source_path))[0]
+
+
+def create_snapshot(source_path: str, directory: str, pages_per_step: int = BACKUP_PAGES_PER_STEP) -> str:
+    """Снять согласованную копию source_path и сжать её в directory (синхронно); возвращает путь к .db.gz"""
+    os.makedirs(directory, exist_ok=True)
+    name = f"{_prefix(source_path)}_{datetime.now():%Y%m%d_%H%M%S}.db"
+    snapshot_path = os.path.join(directory, f".{name}.tmp")
+    target_path = os.path.join(directory, name + ".gz")
+    try:
+        source = sqlite3.connect(source_path)
+        target = sqlite3.connect(snapshot_path)
+        try:
+            source.backup(target, pages=pages_per_step, sleep=STEP_SLEEP)
+            result = target.execute('PRAGMA quick_check').fetchone()[0]
+            if result != 'ok':
+                raise sqlite3.DatabaseError(f"Копия {source_path} не прошла проверку: {result}")
+        finally:
+            target.close()
+            source.close()
+        with open(snapshot_path, 'rb') as raw, gzip.open(target_path + ".tmp", 'wb', compresslevel=6) as packed:
+            shutil.copyfileobj(raw, packed)
+        # Файл с итоговым именем появляется только целиком
+        os.replace(target_path + ".tmp", target_path)
+        return target_path
+    finally:
+        for path in (snapshot_path, target_path + ".tmp"):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def rotate(directory: str, source_path: str, keep: int = BACKUP_KEEP) -> List[str]:
+    """Удалить старые копии source_path, оставив keep последних; возвращает удалённые пути"""
+    # Точное имя: копии bot_database_archive.db не должны считаться копиями bot_database.db
+    pattern = re.compile(re.escape(_prefix(source_path)) + r"_\d{8}_\d{6}\.db\.gz$")
+    backups = sorted(name for name in os.listdir(directory) if pattern.match(name))
+    removed = []
+    for name in backups[:max(0, len(backups) - keep)]:
+        path = os.path.join(directory, name)
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+
+def list_backups(directory: str = BACKUP_DIR) -> List[Backup]:
+    """Имеющиеся копии (новые в конце), длительность неизвестна и равна 0"""
+    if not os.path.isdir(directory):
+        return []
+    return [
+        Backup(os.path.join(directory, name), os.path.getsize(os.path.join(directory, name)), 0.0)
+        for name in sorted(os.listdir(directory), key=lambda name: os.path.getmtime(os.path.join(directory, name)))
+        if name.endswith(".db.gz")
+    ]
+
+
+async def backup_database(database, directory: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> List[Backup]:
+    """Снять копии рабочей базы и архива (если он есть) и удалить устаревшие"""
+    sources = [database.db_path]
+    if os.path.exists(database.archive_path):
+        sources.append(database.archive_path)
+    backups = []
+    async with _lock:
+        for source_path in sources:
+            label = _prefix(source_path)
+            started = time.perf_counter()
+            path = await asyncio.to_thread(create_snapshot, source_path, directory)
+            duration = time.perf_counter() - started
+            size = os.path.getsize(path)
+            await asyncio.to_thread(rotate, directory, source_path, keep)
+            backup_duration.set(duration, label)
+            backup_size.set(size, label)
+            backup_last_success.set(time.time(), label)
+            backups.append(Backup(path, size, duration))
+    return backups
+
+
+async def run_backups(database, interval_hours: float = BACKUP_INTERVAL_HOURS):
+    """Фоновая задача: резервная копия раз в interval_hours часов"""
+    while True:
+        await asyncio.sleep(interval_hours * 3600)
+        try:
+            for backup in await backup_database(database):
+                logger.info(f"Резервная копия {backup.path}: {backup.size} байт за {backup.duration:.1f} с")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка резервного копирования: {e}")
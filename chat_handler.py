@@ -1,6 +1,7 @@
 """
 Модуль для обработки разных типов чатов и определения поведения бота
 """
+import functools
 from enum import Enum
 from typing import Optional, Dict, Any
 from aiogram.types import Message, CallbackQuery
@@ -240,6 +241,7 @@ class ChatBehavior:
 def require_chat_type(*allowed_types: ChatType):
     """Декоратор для ограничения доступа к хендлерам по типу чата"""
     def decorator(handler):
+        @functools.wraps(handler)
         async def wrapper(message: Message, *args, **kwargs):
             chat_type = await ChatBehavior.determine_chat_type(message)
             if chat_type not in allowed_types:
@@ -253,6 +255,7 @@ def require_chat_type(*allowed_types: ChatType):
 def require_permission(command: str):
     """Декоратор для проверки разрешения на выполнение команды"""
     def decorator(handler):
+        @functools.wraps(handler)
         async def wrapper(message: Message, *args, **kwargs):
             print(f"[DEBUG] require_permission проверяет команду '{command}' для пользователя {message.from_user.id}")
             
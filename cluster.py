@@ -0,0 +1,239 @@
+"""
+Режим нескольких процессов-обработчиков: главный процесс принимает апдейты
+(polling или webhook) и раздаёт их через локальные очереди N процессам.
+Апдейты одного пользователя всегда попадают в один и тот же процесс.
+Каждые METRICS_PUSH_INTERVAL секунд обработчик присылает снимок своих метрик через общую
+очередь, и главный процесс отдаёт их в /metrics с меткой worker.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+from typing import Callable, Dict, Any, Awaitable, List
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import Update
+
+from config import HANDLER_CONCURRENCY, LOOP_WATCHDOG_ENABLED, ARCHIVE_AFTER_DAYS
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Как часто проверять, живы ли процессы-обработчики и не изменилось ли расписание, секунды
+SUPERVISE_INTERVAL = 5
+SCHEDULE_CHECK_INTERVAL = 10
+# Как часто обработчик присылает снимок своих метрик, секунды
+METRICS_PUSH_INTERVAL = 5
+
+forwarded_updates = registry.counter(
+    "cluster_forwarded_updates_total", "Апдейты, переданные процессам-обработчикам", ("worker",)
+)
+worker_restarts = registry.counter(
+    "cluster_worker_restarts_total", "Перезапуски упавших процессов-обработчиков", ("worker",)
+)
+lost_updates = registry.counter(
+    "cluster_lost_updates_total",
+    "Апдейты, которые обрабатывал упавший процесс-обработчик (по его последнему снимку метрик)", ("worker",)
+)
+# Заполняется в процессах-обработчиках
+worker_in_flight = registry.gauge(
+    "cluster_worker_updates_in_flight", "Апдейты, взятые обработчиком из очереди и ещё не обработанные"
+)
+
+
+def route_key(update: Update) -> int:
+    """Ключ распределения апдейта: пользователь, иначе чат, иначе сам апдейт"""
+    event = update.event
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id
+    return update.update_id
+
+
+class ForwardToWorkerMiddleware(BaseMiddleware):
+    """Внешний middleware главного процесса: вместо обработки кладёт апдейт в очередь обработчика"""
+
+    def __init__(self, queues: List[multiprocessing.Queue]):
+        self.queues = queues
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        index = route_key(event) % len(self.queues)
+        self.queues[index].put(event.model_dump(mode="json", exclude_none=True, by_alias=True))
+        forwarded_updates.inc(str(index))
+
+
+class WorkerPool:
+    """Процессы-обработчики и их очереди"""
+
+    def __init__(self, count: int):
+        self.count = count
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue() for _ in range(count)]
+        self.metrics_queue = self._context.Queue()
+        self.processes: List[multiprocessing.Process] = [None] * count
+        # Незавершённые апдейты каждого обработчика по его последнему снимку метрик
+        self.in_flight = [0] * count
+        self._supervisor = None
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=worker_process, args=(index, self.queues[index], self.metrics_queue),
+            name=f"bot-worker-{index}", daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+        logger.info(f"Запущен обработчик #{index} (pid {process.pid})")
+
+    def start(self):
+        """Запустить процессы и задачу надзора за ними"""
+        for index in range(self.count):
+            self._spawn(index)
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def _supervise(self):
+        """Собирать метрики обработчиков и перезапускать упавшие процессы"""
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            self.check_workers()
+
+    def collect_metrics(self):
+        """Принять присланные обработчиками снимки метрик"""
+        while True:
+            try:
+                index, snapshot = self.metrics_queue.get_nowait()
+            except queue.Empty:
+                return
+            registry.merge_snapshot(str(index), snapshot)
+            entry = snapshot.get(worker_in_flight.name)
+            self.in_flight[index] = int(entry[4].get((), 0)) if entry else 0
+
+    def check_workers(self):
+        """
+        Один проход надзора: собрать метрики и перезапустить упавшие процессы.
+        Очередь упавшего процесса сохраняется, но апдейты, которые он уже взял, потеряны
+        """
+        self.collect_metrics()
+        for index, process in enumerate(self.processes):
+            if not process.is_alive():
+                lost = self.in_flight[index]
+                logger.error(
+                    f"Обработчик #{index} завершился с кодом {process.exitcode}, перезапуск; "
+                    f"потеряно апдейтов в обработке: {lost} (по последнему снимку метрик)"
+                )
+                worker_restarts.inc(str(index))
+                lost_updates.inc(str(index), amount=lost)
+                self.in_flight[index] = 0
+                self._spawn(index)
+
+    def build_ingress_dispatcher(self) -> Dispatcher:
+        """Диспетчер главного процесса: только раздаёт апдейты по очередям"""
+        dp = Dispatcher()
+        dp.update.outer_middleware(ForwardToWorkerMiddleware(self.queues))
+        return dp
+
+    async def stop(self, timeout: float = 30):
+        """Дать обработчикам доделать очередь и остановить их"""
+        if self._supervisor:
+            self._supervisor.cancel()
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                process.terminate()
+
+
+def worker_process(index: int, updates: multiprocessing.Queue, metrics_queue: multiprocessing.Queue):
+    """Точка входа процесса-обработчика"""
+    try:
+        asyncio.run(_worker_main(index, updates, metrics_queue))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _refresh_schedule():
+    """Перечитывать расписание, если другой процесс загрузил новый файл"""
+    from schedule_parser import schedule_parser
+
+    while True:
+        await asyncio.sleep(SCHEDULE_CHECK_INTERVAL)
+        schedule_parser.reload_if_changed()
+
+
+async def _push_metrics(index: int, metrics_queue: multiprocessing.Queue):
+    """Отправлять главному процессу снимок метрик обработчика"""
+    # Недоставленный при остановке снимок не должен задерживать завершение процесса
+    metrics_queue.cancel_join_thread()
+    while True:
+        await asyncio.sleep(METRICS_PUSH_INTERVAL)
+        metrics_queue.put((index, registry.snapshot()))
+
+
+async def _worker_main(index: int, updates: multiprocessing.Queue, metrics_queue: multiprocessing.Queue):
+    """Цикл процесса-обработчика: читать апдейты из очереди и передавать диспетчеру"""
+    # main импортирует этот модуль, поэтому импортируем его только внутри процесса-обработчика
+    from main import create_bot, build_dispatcher
+    from sqlite_storage import SQLiteStorage
+    from loop_watchdog import LoopWatchdog
+    from metadata_cache import metadata
+    from request_rollups import run_compactor
+    from archive import run_archiver
+    from database import db
+
+    logger.info(f"Обработчик #{index} запущен (pid {os.getpid()})")
+    bot = create_bot()
+    storage = SQLiteStorage()
+    dp = build_dispatcher(storage)
+
+    await metadata.load()
+    background = [asyncio.create_task(_refresh_schedule()), asyncio.create_task(_push_metrics(index, metrics_queue))]
+    if index == 0:
+        # Очистку общих состояний FSM, обновление метаданных из Telegram, сжатие сводок
+        # статистики и перенос заявок в архив выполняет один процесс
+        background.append(asyncio.create_task(storage.run_sweeper()))
+        background.append(asyncio.create_task(metadata.run_refresher(bot)))
+        background.append(asyncio.create_task(run_compactor(db)))
+        if ARCHIVE_AFTER_DAYS > 0:
+            background.append(asyncio.create_task(run_archiver(db)))
+    if LOOP_WATCHDOG_ENABLED:
+        background.append(asyncio.create_task(LoopWatchdog().run()))
+
+    slots = asyncio.Semaphore(HANDLER_CONCURRENCY)
+    tasks = set()
+
+    async def process(update: Dict[str, Any]):
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logger.exception(f"Ошибка обработки апдейта {update.get('update_id')}: {e}")
+        finally:
+            worker_in_flight.dec()
+            slots.release()
+
+    try:
+        while True:
+            update = await asyncio.to_thread(updates.get)
+            if update is None:
+                break
+            worker_in_flight.inc()
+            await slots.acquire()
+            task = asyncio.create_task(process(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        for task in background:
+            task.cancel()
+        await dp.emit_shutdown(bot=bot)
+        await storage.close()
+        await bot.session.close()
+        logger.info(f"Обработчик #{index} остановлен")
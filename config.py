@@ -22,3 +22,92 @@ DATABASE_PATH = 'bot_database.db'
 
 # Настройки файлов
 SCHEDULE_FILE = 'rasp.csv'
+
+# Мониторинг: порог (мс), выше которого обработка апдейта логируется как медленная
+SLOW_UPDATE_THRESHOLD_MS = int(os.getenv('SLOW_UPDATE_THRESHOLD_MS', '1000'))
+
+# Мониторинг: HTTP-сервер с /metrics, /healthz и /readyz
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+# Сколько секунд без успешного getUpdates считать polling зависшим
+POLLING_STALE_SECONDS = int(os.getenv('POLLING_STALE_SECONDS', '120'))
+
+# Сторож цикла событий: порог блокировки (мс), после которого снимается стек
+LOOP_WATCHDOG_ENABLED = os.getenv('LOOP_WATCHDOG_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LOOP_STALL_THRESHOLD_MS = int(os.getenv('LOOP_STALL_THRESHOLD_MS', '250'))
+
+# Режим получения апдейтов: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling').lower()
+
+# Webhook: публичный адрес (за reverse proxy), путь, секрет и адрес прослушивания
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+
+if BOT_MODE not in ('polling', 'webhook'):
+    raise ValueError(f"Неизвестный BOT_MODE: {BOT_MODE}. Допустимо: polling или webhook")
+
+if BOT_MODE == 'webhook' and (not WEBHOOK_URL or not WEBHOOK_SECRET):
+    raise ValueError(
+        "Для BOT_MODE=webhook нужно задать WEBHOOK_URL и WEBHOOK_SECRET "
+        "(секрет: 1-256 символов A-Z, a-z, 0-9, _ и -)"
+    )
+
+# Обработка апдейтов: максимум одновременно работающих хендлеров и длина очереди ожидания
+HANDLER_CONCURRENCY = int(os.getenv('HANDLER_CONCURRENCY', '20'))
+HANDLER_BACKLOG = int(os.getenv('HANDLER_BACKLOG', '200'))
+
+# Хранилище FSM: через сколько часов без изменений удалять брошенные состояния и как часто проверять
+FSM_STATE_TTL_HOURS = float(os.getenv('FSM_STATE_TTL_HOURS', '72'))
+FSM_SWEEP_INTERVAL_MINUTES = float(os.getenv('FSM_SWEEP_INTERVAL_MINUTES', '30'))
+
+# Число процессов-обработчиков. При WORKERS > 1 главный процесс только принимает апдейты
+# (polling или webhook) и раздаёт их обработчикам по user_id; состояние FSM общее (в БД),
+# а внутрипроцессные кэши должны отключаться и читать данные из БД
+WORKERS = int(os.getenv('WORKERS', '1'))
+MULTI_WORKER = WORKERS > 1
+
+# Антифлуд: класс=токенов_в_секунду:ёмкость для каждого класса действий пользователя
+THROTTLE_RATES = os.getenv(
+    'THROTTLE_RATES',
+    'heavy=0.2:3,schedule=0.5:3,command=1:5,callback=2:10,message=2:20'
+)
+
+# Защита от повторной доставки апдейтов: сколько часов помнить обработанные update_id
+UPDATE_DEDUP_RETENTION_HOURS = float(os.getenv('UPDATE_DEDUP_RETENTION_HOURS', '48'))
+
+# Кэш метаданных (профиль бота, названия чатов уведомлений, имена сотрудников): период фонового обновления
+METADATA_REFRESH_MINUTES = float(os.getenv('METADATA_REFRESH_MINUTES', '60'))
+
+# Сводки заявок для статистики за период: сколько часов держать часовые корзины
+# и как часто сворачивать более старые в суточные
+ROLLUP_HOURLY_RETENTION_HOURS = float(os.getenv('ROLLUP_HOURLY_RETENTION_HOURS', '48'))
+ROLLUP_COMPACT_MINUTES = float(os.getenv('ROLLUP_COMPACT_MINUTES', '60'))
+
+# Архив: закрытые заявки старше ARCHIVE_AFTER_DAYS дней (0 - не архивировать) переносятся
+# в отдельный файл порциями по ARCHIVE_BATCH_SIZE раз в ARCHIVE_INTERVAL_HOURS часов
+ARCHIVE_DATABASE_PATH = os.getenv('ARCHIVE_DATABASE_PATH', 'archive.db')
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '180'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_INTERVAL_HOURS = float(os.getenv('ARCHIVE_INTERVAL_HOURS', '24'))
+
+# Обслуживание БД (ANALYZE, vacuum, контрольная точка WAL): окно тихих часов 'ЧЧ:ММ-ЧЧ:ММ'
+# (пусто - не обслуживать), период проверки и сколько строк индекса просматривать в ANALYZE
+MAINTENANCE_QUIET_HOURS = os.getenv('MAINTENANCE_QUIET_HOURS', '02:00-05:00')
+MAINTENANCE_CHECK_MINUTES = float(os.getenv('MAINTENANCE_CHECK_MINUTES', '15'))
+MAINTENANCE_ANALYSIS_LIMIT = int(os.getenv('MAINTENANCE_ANALYSIS_LIMIT', '1000'))
+
+# Резервные копии БД: каталог, сколько копий хранить, период (часы, 0 - только командой /backup)
+# и страниц за один шаг online backup API
+BACKUP_DIR = os.getenv('BACKUP_DIR', 'backups')
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+BACKUP_INTERVAL_HOURS = float(os.getenv('BACKUP_INTERVAL_HOURS', '24'))
+BACKUP_PAGES_PER_STEP = int(os.getenv('BACKUP_PAGES_PER_STEP', '256'))
+
+# Полоса чтения для статистики и отчётов: одновременных соединений только для чтения
+# и предельное время одного запроса в секундах
+READ_LANE_CONCURRENCY = int(os.getenv('READ_LANE_CONCURRENCY', '2'))
+READ_QUERY_TIMEOUT = float(os.getenv('READ_QUERY_TIMEOUT', '10'))
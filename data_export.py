@@ -0,0 +1,151 @@
+"""
+Выгрузка заявок и пользователей в CSV или XLSX.
+Строки читаются курсором SQLite порциями по EXPORT_BATCH_SIZE и сразу дописываются в файл
+(для XLSX - openpyxl в режиме write-only), поэтому память не зависит от числа строк.
+Запись идёт в отдельном потоке на соединении полосы чтения (read_lane.py),
+в цикле событий только отправка готового файла.
+С include_archive заявки из архива (archive.py) выгружаются перед заявками рабочей базы.
+"""
+import asyncio
+import csv
+import os
+import sqlite3
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+import read_lane
+
+# Строк, читаемых из БД за один раз
+EXPORT_BATCH_SIZE = 1000
+
+FORMATS = ("csv", "xlsx")
+
+# Текст пользователя, начинающийся с этих символов, табличный редактор прочитал бы как формулу
+FORMULA_PREFIXES = ("=", "+", "@")
+
+
+class ExportTable(NamedTuple):
+    """Выгружаемая таблица: запрос, заголовки колонок, название листа и запрос к архиву (если есть)"""
+    query: str
+    headers: Tuple[str, ...]
+    title: str
+    archive_query: Optional[str] = None
+
+
+TABLES: Dict[str, ExportTable] = {
+    "requests": ExportTable(
+        '''
+        SELECT fm.id, fm.created_at, fm.status, d.name, fm.user_id, fm.username, fm.first_name,
+               fm.message_text, fm.answer_text, fm.answered_by, fm.answered_at
+        FROM main.feedback_messages fm
+        LEFT JOIN directions d ON fm.direction_id = d.id
+        ORDER BY fm.id
+        ''',
+        ("ID", "Создана (UTC)", "Статус", "Направление", "ID пользователя", "Username", "Имя",
+         "Текст заявки", "Ответ", "Ответил (ID)", "Ответ дан (UTC)"),
+        "Заявки",
+        '''
+        SELECT fm.id, fm.created_at, fm.status, d.name, fm.user_id, fm.username, fm.first_name,
+               fm.message_text, fm.answer_text, fm.answered_by, fm.answered_at
+        FROM archive.feedback_messages fm
+        LEFT JOIN directions d ON fm.direction_id = d.id
+        ORDER BY fm.id
+        ''',
+    ),
+    "users": ExportTable(
+        '''
+        SELECT user_id, username, first_name, last_name, first_interaction, last_interaction, total_messages
+        FROM users_log
+        ORDER BY user_id
+        ''',
+        ("ID пользователя", "Username", "Имя", "Фамилия", "Первое обращение (UTC)",
+         "Последнее обращение (UTC)", "Сообщений"),
+        "Пользователи",
+    ),
+}
+
+
+def _rows(conn: sqlite3.Connection, queries: List[str]):
+    """Строки запросов по очереди, порциями по EXPORT_BATCH_SIZE"""
+    for query in queries:
+        cursor = conn.execute(query)
+        try:
+            while True:
+                batch = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not batch:
+                    break
+                yield from batch
+        finally:
+            cursor.close()
+
+
+def _csv_value(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def _write_csv(conn: sqlite3.Connection, table: ExportTable, queries: List[str], path: str) -> int:
+    # utf-8-sig: Excel распознаёт кодировку по BOM
+    with open(path, "w", encoding="utf-8-sig", newline="") as file:
+        writer = csv.writer(file, delimiter=";")
+        writer.writerow(table.headers)
+        count = 0
+        for row in _rows(conn, queries):
+            writer.writerow([_csv_value(value) for value in row])
+            count += 1
+    return count
+
+
+def _xlsx_value(sheet, value):
+    if not isinstance(value, str):
+        return value
+    # Управляющие символы недопустимы в XML листа
+    cell = WriteOnlyCell(sheet, ILLEGAL_CHARACTERS_RE.sub("", value))
+    # Строка с «=» стала бы формулой - записываем её как текст
+    cell.data_type = "s"
+    return cell
+
+
+def _write_xlsx(conn: sqlite3.Connection, table: ExportTable, queries: List[str], path: str) -> int:
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(table.title)
+    sheet.append(table.headers)
+    count = 0
+    for row in _rows(conn, queries):
+        sheet.append([_xlsx_value(sheet, value) for value in row])
+        count += 1
+    workbook.save(path)
+    return count
+
+
+def write_export(db_path: str, kind: str, fmt: str, directory: str, archive_path: str = None) -> Tuple[str, int]:
+    """
+    Записать выгрузку kind ('requests' или 'users') в формате fmt в directory (синхронно).
+    archive_path - файл архива, если нужно выгрузить и архивные заявки.
+    Возвращает путь к файлу и число строк.
+    """
+    table = TABLES[kind]
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат {fmt}")
+    path = os.path.join(directory, f"{kind}_{datetime.now():%Y%m%d_%H%M}.{fmt}")
+    conn = read_lane.open_readonly(db_path)
+    try:
+        queries = [table.query]
+        if archive_path and table.archive_query and os.path.exists(archive_path):
+            conn.execute('ATTACH DATABASE ? AS archive', (archive_path,))
+            queries.insert(0, table.archive_query)
+        writer = _write_csv if fmt == "csv" else _write_xlsx
+        return path, writer(conn, table, queries, path)
+    finally:
+        conn.close()
+
+
+async def export_table(db_path: str, kind: str, fmt: str, directory: str, archive_path: str = None) -> Tuple[str, int]:
+    """Выгрузка в отдельном потоке (см. write_export)"""
+    async with read_lane.slots:
+        return await asyncio.to_thread(write_export, db_path, kind, fmt, directory, archive_path)
@@ -1,18 +1,145 @@
 import asyncio
+import math
+import sqlite3
+import time
 import aiosqlite
-from config import DATABASE_PATH, FIRST_ADMIN_ID
+from config import (
+    DATABASE_PATH, ARCHIVE_DATABASE_PATH, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE, FIRST_ADMIN_ID, MULTI_WORKER,
+    READ_QUERY_TIMEOUT,
+)
+from active_requests import ActiveRequest, ActiveRequestRegistry
+from pagination import OLDER, Page, build_page, page_in_memory
+from migrations import apply_migrations
+import archive
+import maintenance
+import read_lane
+import request_counters
+import request_rollups
+import response_times
+from request_counters import RequestCounters
+from response_times import sketches_from_rows
+from request_search import build_match_query, MATCH_START, MATCH_END
+from metrics import registry
+from update_trace import add_db_time
+
+db_query_latency = registry.histogram(
+    "db_query_duration_seconds", "Длительность операций с базой данных"
+)
+db_connections_open = registry.gauge(
+    "db_connections_open", "Открытые соединения с базой данных"
+)
+
+
+class InstrumentedConnection(aiosqlite.Connection):
+    """
+    Соединение aiosqlite, учитывающее время запросов в метриках и трассе текущего апдейта.
+    _execute и _connect - внутренние методы aiosqlite (через _execute проходят и запросы,
+    и чтение курсоров), поэтому версия aiosqlite ограничена сверху в requirements.txt
+    """
+
+    async def _execute(self, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super()._execute(fn, *args, **kwargs)
+        finally:
+            duration = time.perf_counter() - started
+            db_query_latency.observe(duration)
+            add_db_time(duration)
+
+    async def _connect(self):
+        opening = self._connection is None
+        await super()._connect()
+        if opening:
+            db_connections_open.inc()
+        return self
+
+    async def close(self) -> None:
+        was_open = self._connection is not None
+        try:
+            await super().close()
+        finally:
+            if was_open:
+                db_connections_open.dec()
+
+
+class ReadOnlyConnection(InstrumentedConnection):
+    """
+    Соединение полосы чтения (read_lane.py): занимает место в полосе на время async with,
+    каждая операция с базой ограничена READ_QUERY_TIMEOUT секундами
+    """
+
+    def __init__(self, db_path: str, timeout: float = READ_QUERY_TIMEOUT):
+        self._timeout = timeout
+        self._deadline = math.inf
+        super().__init__(lambda: read_lane.open_readonly(db_path, self._expired), iter_chunk_size=64)
+
+    def _expired(self) -> bool:
+        # Вызывается обработчиком прогресса в потоке соединения
+        return time.monotonic() > self._deadline
+
+    async def _execute(self, fn, *args, **kwargs):
+        self._deadline = time.monotonic() + self._timeout
+        try:
+            return await super()._execute(fn, *args, **kwargs)
+        finally:
+            self._deadline = math.inf
+
+    async def __aenter__(self):
+        await read_lane.slots.acquire()
+        try:
+            return await super().__aenter__()
+        except BaseException:
+            read_lane.slots.release()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        try:
+            await super().__aexit__(*exc_info)
+        finally:
+            read_lane.slots.release()
+
 
 class Database:
     def __init__(self):
         self.db_path = DATABASE_PATH
+        # Файл архива старых закрытых заявок (см. archive.py)
+        self.archive_path = ARCHIVE_DATABASE_PATH
+        # Активные заявки в памяти; при нескольких процессах читаются из БД
+        self.active = ActiveRequestRegistry(enabled=not MULTI_WORKER)
+        self._active_lock = asyncio.Lock()
+        # Есть ли полнотекстовый индекс FTS5: None - ещё не проверяли (процессы-обработчики
+        # не вызывают init_db, поэтому проверка выполняется при первом поиске)
+        self.fts_available = None
+    
+    def connect(self) -> InstrumentedConnection:
+        """Открыть соединение с базой данных (использовать как async with db.connect() as conn)"""
+        db_path = self.db_path
+        
+        def connector() -> sqlite3.Connection:
+            return sqlite3.connect(db_path)
+        
+        return InstrumentedConnection(connector, iter_chunk_size=64)
+    
+    def read(self) -> ReadOnlyConnection:
+        """
+        Соединение только для чтения для статистики и отчётов (async with db.read() as conn).
+        Не мешает записи заявок; число таких соединений и время запроса ограничены
+        """
+        return ReadOnlyConnection(self.db_path)
     
     async def _get_connection(self):
         """Получить соединение с базой данных"""
-        return aiosqlite.connect(self.db_path)
+        return self.connect()
     
     async def init_db(self):
         """Инициализация базы данных"""
-        async with aiosqlite.connect(self.db_path) as db:
+        self.active.invalidate()
+        async with self.connect() as db:
+            # Новая база сразу создаётся с incremental auto_vacuum (существующую переводит maintenance.py)
+            await db.execute(f'PRAGMA auto_vacuum = {maintenance.AUTO_VACUUM_INCREMENTAL}')
+            # Журнал WAL: читатели не блокируют запись и наоборот (настройка сохраняется в файле БД)
+            await db.execute('PRAGMA journal_mode=WAL')
+            
             # Таблица администраторов
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS admins (
@@ -130,6 +257,20 @@ class Database:
                 )
             ''')
             
+            # Тип уведомления: staff - админский чат/ЛС админа (статус редактируется), teacher - ЛС преподавателя
+            try:
+                await db.execute("ALTER TABLE notification_messages ADD COLUMN kind TEXT DEFAULT 'staff'")
+                await db.commit()
+            except:
+                # Колонка уже существует
+                pass
+            
+            # Поиск заявки по сообщению, на которое ответил сотрудник
+            await db.execute('''
+                CREATE INDEX IF NOT EXISTS idx_notification_messages_chat_message
+                ON notification_messages(chat_id, message_id)
+            ''')
+            
             # Таблица для хранения прикрепленных файлов к заявкам
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS attachments (
@@ -159,14 +300,54 @@ class Database:
                 )
             ''')
             
+            # Таблица состояний FSM (черновики заявок, мастера админки), см. sqlite_storage.py
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}',
+                    updated_at INTEGER NOT NULL -- unix time последней записи
+                )
+            ''')
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at)')
+            
+            # Журнал обработанных апдейтов для отбрасывания повторной доставки, см. update_ledger.py
+            await db.execute('''
+                CREATE TABLE IF NOT EXISTS processed_updates (
+                    update_id INTEGER PRIMARY KEY,
+                    processed_at INTEGER NOT NULL -- unix time
+                )
+            ''')
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_processed_updates_at ON processed_updates(processed_at)')
+            
+            # Индексы для постраничного вывода заявок по ключу (created_at, id), см. get_requests_page
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_feedback_status_created ON feedback_messages(status, created_at, id)')
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_feedback_user_created ON feedback_messages(user_id, created_at, id)')
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_feedback_username_created ON feedback_messages(username, created_at, id)')
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_feedback_direction_created ON feedback_messages(direction_id, status, created_at, id)')
+            # Счёт заявок за последние сутки/неделю - диапазон по индексу, а не проход по всей таблице
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_feedback_created ON feedback_messages(created_at)')
+            # Ответы сотрудника по направлениям (статистика преподавателя)
+            await db.execute('CREATE INDEX IF NOT EXISTS idx_feedback_answered_by ON feedback_messages(answered_by, direction_id)')
+            
             await db.commit()
             
+            # Изменения схемы, требующие переноса данных, выполняются миграциями (migrations.py)
+            await apply_migrations(db)
+            self.fts_available = await self._detect_fts(db)
+            
             # Добавляем первого администратора
             await self.add_admin(FIRST_ADMIN_ID, None, "Первый админ", None)
     
+    @staticmethod
+    async def _detect_fts(conn) -> bool:
+        """Есть ли в базе таблица полнотекстового индекса feedback_fts"""
+        cursor = await conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'feedback_fts'")
+        return await cursor.fetchone() is not None
+
     async def add_admin(self, user_id: int, username: str = None, first_name: str = None, added_by: int = None):
         """Добавить администратора"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute('''
                 INSERT OR REPLACE INTO admins (user_id, username, first_name, added_by)
                 VALUES (?, ?, ?, ?)
@@ -175,7 +356,7 @@ class Database:
     
     async def update_admin_info(self, user_id: int, username: str = None, first_name: str = None):
         """Обновить информацию об администраторе"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute('''
                 UPDATE admins 
                 SET username = ?, first_name = ?
@@ -185,66 +366,157 @@ class Database:
     
     async def remove_admin(self, user_id: int):
         """Удалить администратора"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute('DELETE FROM admins WHERE user_id = ?', (user_id,))
             await db.commit()
     
     async def is_admin(self, user_id: int) -> bool:
         """Проверить, является ли пользователь администратором"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('SELECT user_id FROM admins WHERE user_id = ?', (user_id,))
             result = await cursor.fetchone()
             return result is not None
     
     async def get_all_admins(self):
         """Получить всех администраторов"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('SELECT user_id, username, first_name FROM admins')
             return await cursor.fetchall()
     
     async def save_feedback_message(self, user_id: int, username: str, first_name: str, message_text: str, direction_id: int = None):
         """Сохранить сообщение обратной связи"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('''
                 INSERT INTO feedback_messages (user_id, username, first_name, message_text, direction_id)
                 VALUES (?, ?, ?, ?, ?)
+                RETURNING id, created_at
             ''', (user_id, username, first_name, message_text, direction_id))
+            request_id, created_at = await cursor.fetchone()
             await db.commit()
-            return cursor.lastrowid
+        self.active.add(ActiveRequest(request_id, user_id, username, first_name, message_text, created_at, direction_id))
+        return request_id
     
-    async def mark_message_answered(self, message_id: int, answered_by: int, answer_text: str):
-        """Отметить сообщение как отвеченное и закрыть заявку"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute('''
+    async def try_close_request(self, message_id: int, answered_by: int, answer_text: str = None) -> bool:
+        """
+        Атомарно закрыть заявку, если она ещё активна.
+        Возвращает True только для того, кто действительно её закрыл.
+        """
+        async with self.connect() as db:
+            cursor = await db.execute('''
                 UPDATE feedback_messages 
-                SET is_answered = TRUE, answered_by = ?, answer_text = ?, answered_at = CURRENT_TIMESTAMP, status = 'closed'
-                WHERE id = ?
-            ''', (answered_by, answer_text, message_id))
+                SET status = 'closed', is_answered = ?, answered_by = ?, answer_text = ?, answered_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND status = 'active'
+            ''', (answer_text is not None, answered_by, answer_text, message_id))
             await db.commit()
+            closed = cursor.rowcount == 1
+        if closed:
+            self.active.remove(message_id)
+        return closed
+    
+    async def reopen_request(self, message_id: int, answered_by: int):
+        """Вернуть в активные заявку, закрытую указанным сотрудником (ответ не доставлен)"""
+        async with self.connect() as db:
+            cursor = await db.execute('''
+                UPDATE feedback_messages 
+                SET status = 'active', is_answered = FALSE, answered_by = NULL, answer_text = NULL, answered_at = NULL
+                WHERE id = ? AND status = 'closed' AND answered_by = ?
+                RETURNING id, user_id, username, first_name, message_text, created_at, direction_id
+            ''', (message_id, answered_by))
+            row = await cursor.fetchone()
+            await db.commit()
+        if row:
+            self.active.add(ActiveRequest(*row))
     
     async def get_feedback_message(self, message_id: int):
         """Получить сообщение обратной связи по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT id, user_id, username, first_name, message_text, created_at, is_answered, status, direction_id
                 FROM feedback_messages WHERE id = ?
             ''', (message_id,))
             return await cursor.fetchone()
     
-    async def get_user_conversation(self, user_id: int):
-        """Получить всю переписку с пользователем"""
-        async with aiosqlite.connect(self.db_path) as db:
+    async def get_user_conversation(self, user_id: int, include_archive: bool = False):
+        """Получить всю переписку с пользователем (с include_archive - вместе с архивом)"""
+        columns = 'id, message_text, created_at, is_answered, answer_text, answered_at, answered_by, status'
+        async with self.read() as db:
+            if include_archive and await archive.attach(db, self.archive_path):
+                cursor = await db.execute(f'''
+                    SELECT {columns} FROM archive.feedback_messages WHERE user_id = ?
+                    UNION ALL
+                    SELECT {columns} FROM main.feedback_messages WHERE user_id = ?
+                    ORDER BY created_at ASC
+                ''', (user_id, user_id))
+            else:
+                cursor = await db.execute(f'''
+                    SELECT {columns}
+                    FROM feedback_messages 
+                    WHERE user_id = ? 
+                    ORDER BY created_at ASC
+                ''', (user_id,))
+            return await cursor.fetchall()
+    
+    async def archive_old_requests(self, older_than_days: float = ARCHIVE_AFTER_DAYS,
+                                   batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+        """Перенести закрытые заявки старше older_than_days дней в архив; возвращает их число"""
+        moved = 0
+        async with self.connect() as db:
+            await archive.attach(db, self.archive_path, create=True)
+            while True:
+                count = await archive.archive_batch(db, older_than_days, batch_size)
+                moved += count
+                if count < batch_size:
+                    return moved
+                # Между порциями даём выполниться другим запросам
+                await asyncio.sleep(0)
+    
+    async def run_maintenance(self):
+        """ANALYZE, incremental_vacuum и контрольная точка WAL (см. maintenance.py)"""
+        async with self.connect() as db:
+            return await maintenance.run_maintenance(db, self.db_path)
+    
+    async def _active_registry(self):
+        """Реестр активных заявок (при первом обращении загружается из БД) или None, если он отключён"""
+        if not self.active.enabled:
+            return None
+        if not self.active.loaded:
+            async with self._active_lock:
+                if not self.active.loaded:
+                    await self.load_active_requests()
+        if self.active.direction_names is None:
+            await self._load_directions_index()
+        return self.active
+    
+    async def load_active_requests(self):
+        """Загрузить активные заявки в реестр"""
+        self.active.begin_load()
+        async with self.connect() as db:
             cursor = await db.execute('''
-                SELECT id, message_text, created_at, is_answered, answer_text, answered_at, answered_by, status
+                SELECT id, user_id, username, first_name, message_text, created_at, direction_id
                 FROM feedback_messages 
-                WHERE user_id = ? 
-                ORDER BY created_at ASC
-            ''', (user_id,))
-            return await cursor.fetchall()
+                WHERE status = 'active'
+            ''')
+            rows = await cursor.fetchall()
+        self.active.finish_load(ActiveRequest(*row) for row in rows)
+    
+    async def _load_directions_index(self):
+        """Загрузить в реестр названия направлений и привязки преподавателей"""
+        version = self.active.directions_version
+        async with self.connect() as db:
+            cursor = await db.execute('SELECT id, name FROM directions')
+            names = dict(await cursor.fetchall())
+            cursor = await db.execute('SELECT teacher_id, direction_id FROM teacher_directions')
+            teacher_directions = {}
+            for teacher_id, direction_id in await cursor.fetchall():
+                teacher_directions.setdefault(teacher_id, set()).add(direction_id)
+        self.active.set_directions(names, teacher_directions, version)
     
     async def has_active_request(self, user_id: int) -> bool:
         """Проверить, есть ли у пользователя активная заявка"""
-        async with aiosqlite.connect(self.db_path) as db:
+        active = await self._active_registry()
+        if active is not None:
+            return active.latest_for_user(user_id) is not None
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT id FROM feedback_messages 
                 WHERE user_id = ? AND status = 'active'
@@ -255,36 +527,24 @@ class Database:
     
     async def get_active_request(self, user_id: int):
         """Получить активную заявку пользователя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        active = await self._active_registry()
+        if active is not None:
+            request = active.latest_for_user(user_id)
+            return (request.id, request.message_text, request.created_at) if request else None
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT id, message_text, created_at
                 FROM feedback_messages 
                 WHERE user_id = ? AND status = 'active'
-                ORDER BY created_at DESC
+                ORDER BY created_at DESC, id DESC
                 LIMIT 1
             ''', (user_id,))
             return await cursor.fetchone()
     
-    async def close_request(self, message_id: int):
-        """Закрыть заявку"""
-        try:
-            async with aiosqlite.connect(self.db_path) as db:
-                cursor = await db.execute('''
-                    UPDATE feedback_messages 
-                    SET status = 'closed'
-                    WHERE id = ?
-                ''', (message_id,))
-                await db.commit()
-                # Проверяем, была ли обновлена хотя бы одна строка
-                return cursor.rowcount > 0
-        except Exception as e:
-            print(f"Error closing request {message_id}: {e}")
-            return False
-    
     # Методы для работы с чатами уведомлений
     async def add_notification_chat(self, chat_id: int, chat_title: str, chat_type: str, added_by: int):
         """Добавить чат для уведомлений"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute('''
                 INSERT OR REPLACE INTO notification_chats (chat_id, chat_title, chat_type, added_by)
                 VALUES (?, ?, ?, ?)
@@ -293,13 +553,13 @@ class Database:
     
     async def remove_notification_chat(self, chat_id: int):
         """Удалить чат из уведомлений"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute('DELETE FROM notification_chats WHERE chat_id = ?', (chat_id,))
             await db.commit()
     
     async def get_notification_chats(self):
         """Получить все активные чаты для уведомлений"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT chat_id, chat_title, chat_type 
                 FROM notification_chats 
@@ -310,7 +570,7 @@ class Database:
     
     async def toggle_notification_chat(self, chat_id: int, is_active: bool):
         """Включить/отключить уведомления для чата"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute('''
                 UPDATE notification_chats 
                 SET is_active = ? 
@@ -318,9 +578,19 @@ class Database:
             ''', (is_active, chat_id))
             await db.commit()
     
+    async def update_notification_chat_info(self, chat_id: int, chat_title: str, chat_type: str):
+        """Обновить название и тип чата уведомлений"""
+        async with self.connect() as db:
+            await db.execute('''
+                UPDATE notification_chats
+                SET chat_title = ?, chat_type = ?
+                WHERE chat_id = ?
+            ''', (chat_title, chat_type, chat_id))
+            await db.commit()
+
     async def is_notification_chat(self, chat_id: int) -> bool:
         """Проверить, является ли чат активным для уведомлений"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT chat_id FROM notification_chats 
                 WHERE chat_id = ? AND is_active = TRUE
@@ -329,25 +599,39 @@ class Database:
             return result is not None
     
     # Методы для работы с сообщениями уведомлений
-    async def save_notification_message(self, feedback_message_id: int, chat_id: int, message_id: int):
-        """Сохранить ID сообщения уведомления в админском чате"""
-        async with aiosqlite.connect(self.db_path) as db:
+    async def save_notification_message(self, feedback_message_id: int, chat_id: int, message_id: int, kind: str = 'staff'):
+        """
+        Сохранить ID сообщения уведомления (kind: staff - админский чат, teacher - ЛС преподавателя).
+        Ключ - заявка, чат и тип: уведомления staff и teacher в одном чате не заменяют друг друга
+        """
+        async with self.connect() as db:
             await db.execute('''
-                INSERT OR REPLACE INTO notification_messages (feedback_message_id, chat_id, message_id)
-                VALUES (?, ?, ?)
-            ''', (feedback_message_id, chat_id, message_id))
+                INSERT OR REPLACE INTO notification_messages (feedback_message_id, chat_id, message_id, kind)
+                VALUES (?, ?, ?, ?)
+            ''', (feedback_message_id, chat_id, message_id, kind))
             await db.commit()
     
     async def get_notification_messages(self, feedback_message_id: int):
-        """Получить все сообщения уведомлений для заявки"""
-        async with aiosqlite.connect(self.db_path) as db:
+        """Получить все сообщения уведомлений для заявки в админских чатах"""
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT chat_id, message_id 
                 FROM notification_messages 
-                WHERE feedback_message_id = ?
+                WHERE feedback_message_id = ? AND kind = 'staff'
             ''', (feedback_message_id,))
             return await cursor.fetchall()
     
+    async def get_request_id_by_notification(self, chat_id: int, message_id: int):
+        """Найти заявку по сообщению уведомления в чате"""
+        async with self.connect() as db:
+            cursor = await db.execute('''
+                SELECT feedback_message_id 
+                FROM notification_messages 
+                WHERE chat_id = ? AND message_id = ?
+            ''', (chat_id, message_id))
+            row = await cursor.fetchone()
+            return row[0] if row else None
+    
     async def update_notification_status(self, bot, feedback_message_id: int, new_status_text: str, answer_text: str = None):
         """Обновить статус заявки во всех уведомлениях в админских чатах"""
         try:
@@ -470,7 +754,7 @@ class Database:
     async def save_attachment(self, feedback_message_id: int, file_id: str, file_type: str, 
                              file_name: str = None, file_size: int = None, mime_type: str = None):
         """Сохранить информацию о прикрепленном файле"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute('''
                 INSERT INTO attachments (feedback_message_id, file_id, file_type, file_name, file_size, mime_type)
                 VALUES (?, ?, ?, ?, ?, ?)
@@ -479,7 +763,7 @@ class Database:
     
     async def get_attachments(self, feedback_message_id: int):
         """Получить все прикрепления для заявки"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT file_id, file_type, file_name, file_size, mime_type
                 FROM attachments 
@@ -491,39 +775,50 @@ class Database:
     # Методы для работы с преподавателями
     async def add_teacher(self, user_id: int, username: str = None, first_name: str = None, added_by: int = None):
         """Добавить преподавателя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute('''
                 INSERT OR REPLACE INTO teachers (user_id, username, first_name, added_by)
                 VALUES (?, ?, ?, ?)
             ''', (user_id, username, first_name, added_by))
             await db.commit()
     
+    async def update_teacher_info(self, user_id: int, username: str = None, first_name: str = None):
+        """Обновить информацию о преподавателе"""
+        async with self.connect() as db:
+            await db.execute('''
+                UPDATE teachers
+                SET username = ?, first_name = ?
+                WHERE user_id = ?
+            ''', (username, first_name, user_id))
+            await db.commit()
+
     async def remove_teacher(self, user_id: int):
         """Удалить преподавателя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             # Удаляем связи с направлениями
             await db.execute('DELETE FROM teacher_directions WHERE teacher_id = ?', (user_id,))
             # Удаляем преподавателя
             await db.execute('DELETE FROM teachers WHERE user_id = ?', (user_id,))
             await db.commit()
+        self.active.invalidate_directions()
     
     async def is_teacher(self, user_id: int) -> bool:
         """Проверить, является ли пользователь преподавателем"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('SELECT user_id FROM teachers WHERE user_id = ? AND is_active = TRUE', (user_id,))
             result = await cursor.fetchone()
             return result is not None
     
     async def get_all_teachers(self):
         """Получить всех преподавателей"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('SELECT user_id, username, first_name FROM teachers WHERE is_active = TRUE')
             return await cursor.fetchall()
     
     # Методы для работы с направлениями
     async def sync_directions(self, direction_names: list):
         """Синхронизировать направления из расписания"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             # Добавляем новые направления
             for name in direction_names:
                 await db.execute('''
@@ -547,47 +842,50 @@ class Database:
                 ''', direction_names)
             
             await db.commit()
+        self.active.invalidate_directions()
     
     async def get_all_directions(self):
         """Получить все направления"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('SELECT id, name FROM directions ORDER BY name')
             return await cursor.fetchall()
     
     async def get_direction_by_id(self, direction_id: int):
         """Получить направление по ID"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('SELECT id, name FROM directions WHERE id = ?', (direction_id,))
             return await cursor.fetchone()
     
     async def get_direction_by_name(self, name: str):
         """Получить направление по названию"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('SELECT id, name FROM directions WHERE name = ?', (name,))
             return await cursor.fetchone()
     
     # Методы для работы со связями преподавателей и направлений
     async def assign_teacher_to_direction(self, teacher_id: int, direction_id: int, assigned_by: int):
         """Привязать преподавателя к направлению"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute('''
                 INSERT OR IGNORE INTO teacher_directions (teacher_id, direction_id, assigned_by)
                 VALUES (?, ?, ?)
             ''', (teacher_id, direction_id, assigned_by))
             await db.commit()
+        self.active.invalidate_directions()
     
     async def remove_teacher_from_direction(self, teacher_id: int, direction_id: int):
         """Отвязать преподавателя от направления"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute('''
                 DELETE FROM teacher_directions 
                 WHERE teacher_id = ? AND direction_id = ?
             ''', (teacher_id, direction_id))
             await db.commit()
+        self.active.invalidate_directions()
     
     async def get_teachers_for_direction(self, direction_id: int):
         """Получить всех преподавателей для направления"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT t.user_id, t.username, t.first_name
                 FROM teachers t
@@ -598,7 +896,7 @@ class Database:
     
     async def get_directions_for_teacher(self, teacher_id: int):
         """Получить все направления преподавателя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT d.id, d.name
                 FROM directions d
@@ -609,7 +907,15 @@ class Database:
     
     async def get_teacher_requests(self, teacher_id: int):
         """Получить заявки для конкретного преподавателя"""
-        async with aiosqlite.connect(self.db_path) as db:
+        active = await self._active_registry()
+        if active is not None:
+            names = active.direction_names
+            direction_ids = [d for d in active.teacher_directions.get(teacher_id, ()) if d in names]
+            return [
+                (r.id, r.user_id, r.username, r.first_name, r.message_text, r.created_at, 'active', names[r.direction_id])
+                for r in active.for_directions(direction_ids)
+            ]
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT fm.id, fm.user_id, fm.username, fm.first_name, fm.message_text, 
                        fm.created_at, fm.status, d.name as direction_name
@@ -617,13 +923,250 @@ class Database:
                 JOIN directions d ON fm.direction_id = d.id
                 JOIN teacher_directions td ON d.id = td.direction_id
                 WHERE td.teacher_id = ? AND fm.status = 'active'
-                ORDER BY fm.created_at DESC
+                ORDER BY fm.created_at DESC, fm.id DESC
             ''', (teacher_id,))
             return await cursor.fetchall()
     
+    async def get_active_requests_counts(self):
+        """Число активных заявок: всего, за сутки, за час"""
+        active = await self._active_registry()
+        if active is not None:
+            return active.summary()
+        async with self.connect() as db:
+            cursor = await db.execute('''
+                SELECT COUNT(*) as total,
+                       COUNT(CASE WHEN created_at > datetime('now', '-1 day') THEN 1 END) as today,
+                       COUNT(CASE WHEN created_at > datetime('now', '-1 hour') THEN 1 END) as hour
+                FROM feedback_messages 
+                WHERE status = 'active'
+            ''')
+            return await cursor.fetchone()
+    
+    async def get_request_counters(self) -> RequestCounters:
+        """Итоги по заявкам из таблицы счётчиков (см. request_counters.py)"""
+        async with self.read() as db:
+            cursor = await db.execute('SELECT dimension, dim_key, metric, value FROM request_counters')
+            return RequestCounters(await cursor.fetchall())
+
+    async def rebuild_request_counters(self):
+        """Пересчитать счётчики заявок с нуля"""
+        async with self.connect() as db:
+            await request_counters.rebuild(db)
+            await db.commit()
+
+    async def rebuild_request_rollups(self):
+        """Пересчитать почасовые и посуточные сводки заявок с нуля (вместе с архивом)"""
+        async with self.connect() as db:
+            # Заявки, перенесённые в архив, остаются в истории сводок
+            if await archive.attach(db, self.archive_path):
+                await request_rollups.rebuild(db, archive.feedback_source())
+            else:
+                await request_rollups.rebuild(db)
+            await db.commit()
+
+    async def compact_request_rollups(self) -> int:
+        """Свернуть старые часовые сводки в суточные; возвращает число свёрнутых корзин"""
+        async with self.connect() as db:
+            folded = await request_rollups.compact(db)
+            await db.commit()
+            return folded
+
+    async def count_requests_since(self, modifier: str, metric: str = 'created', direction_ids: list = None) -> int:
+        """
+        Число заявок, созданных (metric='created') или закрытых (metric='closed') после
+        datetime('now', modifier) - сумма по корзинам сводок (см. request_rollups.py)
+        """
+        scope = list(direction_ids) if direction_ids is not None else []
+        query = request_rollups.window_query(metric, len(scope) if direction_ids is not None else None)
+        async with self.read() as db:
+            cursor = await db.execute(query, [modifier, *scope, modifier, *scope])
+            return (await cursor.fetchone())[0]
+
+    async def count_answered_by(self, responder_id: int, direction_ids: list) -> int:
+        """Число заявок по направлениям direction_ids с ответом сотрудника responder_id (вместе с архивом)"""
+        placeholders = ','.join('?' for _ in direction_ids)
+        async with self.read() as db:
+            source = 'feedback_messages'
+            if await archive.attach(db, self.archive_path):
+                source = archive.feedback_source()
+            cursor = await db.execute(f'''
+                SELECT COUNT(*) FROM {source}
+                WHERE answered_by = ? AND is_answered AND direction_id IN ({placeholders})
+            ''', (responder_id, *direction_ids))
+            return (await cursor.fetchone())[0]
+
+    async def count_users_since(self, modifier: str) -> int:
+        """Число разных авторов заявок за период (с точностью до суток)"""
+        async with self.read() as db:
+            cursor = await db.execute('''
+                SELECT COUNT(DISTINCT user_id) FROM request_rollup_users
+                WHERE day >= date('now', ?)
+            ''', (modifier,))
+            return (await cursor.fetchone())[0]
+
+    async def get_response_time_sketches(self, dimension: str = None):
+        """
+        Гистограммы времени ответа {(dimension, dim_key): ResponseTimeSketch}
+        (см. response_times.py); dimension - 'all', 'direction' или 'responder'
+        """
+        query = 'SELECT dimension, dim_key, bucket, count FROM response_time_sketch'
+        params = ()
+        if dimension is not None:
+            query += ' WHERE dimension = ?'
+            params = (dimension,)
+        async with self.read() as db:
+            cursor = await db.execute(query, params)
+            return sketches_from_rows(await cursor.fetchall())
+
+    async def rebuild_response_times(self):
+        """Пересчитать гистограммы времени ответа по закрытым заявкам (вместе с архивом)"""
+        async with self.connect() as db:
+            if await archive.attach(db, self.archive_path):
+                await response_times.rebuild(db, archive.feedback_source())
+            else:
+                await response_times.rebuild(db)
+            await db.commit()
+
+    async def count_active_requests_for_direction(self, direction_id: int) -> int:
+        """Число активных заявок по направлению"""
+        active = await self._active_registry()
+        if active is not None:
+            return active.count_for_direction(direction_id)
+        async with self.connect() as db:
+            cursor = await db.execute('''
+                SELECT COUNT(*) FROM feedback_messages 
+                WHERE direction_id = ? AND status = 'active'
+            ''', (direction_id,))
+            result = await cursor.fetchone()
+            return result[0] if result else 0
+    
+    async def get_requests_page(self, status: str = None, user_id: int = None, username: str = None,
+                                teacher_id: int = None, cursor=None, direction: str = OLDER, limit: int = 10) -> Page:
+        """
+        Страница заявок (новые первыми) по ключу (created_at, id): от курсора читается limit + 1 строк
+        одним диапазонным сканированием индекса. Фильтры: статус, пользователь, username,
+        направления преподавателя. Строки: (id, user_id, username, first_name, message_text,
+        created_at, status, direction_name).
+        """
+        key_index = (5, 0)
+        if status == 'active' and user_id is None and username is None:
+            active = await self._active_registry()
+            if active is not None:
+                names = active.direction_names
+                if teacher_id is None:
+                    requests = active.all()
+                else:
+                    requests = active.for_directions(active.teacher_directions.get(teacher_id, ()))
+                rows = [
+                    (r.id, r.user_id, r.username, r.first_name, r.message_text, r.created_at, 'active',
+                     names.get(r.direction_id))
+                    for r in requests
+                ]
+                return page_in_memory(rows, limit, cursor, direction, key_index)
+        
+        conditions, params = [], []
+        if status is not None:
+            conditions.append('fm.status = ?')
+            params.append(status)
+        if user_id is not None:
+            conditions.append('fm.user_id = ?')
+            params.append(user_id)
+        if username is not None:
+            conditions.append('fm.username = ?')
+            params.append(username)
+        if teacher_id is not None:
+            conditions.append('fm.direction_id IN (SELECT direction_id FROM teacher_directions WHERE teacher_id = ?)')
+            params.append(teacher_id)
+        
+        if cursor is None:
+            direction = OLDER
+        else:
+            conditions.append(f"(fm.created_at, fm.id) {'<' if direction == OLDER else '>'} (?, ?)")
+            params.extend(cursor)
+        order = 'DESC' if direction == OLDER else 'ASC'
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        
+        async with self.connect() as db:
+            result = await db.execute(f'''
+                SELECT fm.id, fm.user_id, fm.username, fm.first_name, fm.message_text,
+                       fm.created_at, fm.status, d.name as direction_name
+                FROM feedback_messages fm
+                LEFT JOIN directions d ON fm.direction_id = d.id
+                {where}
+                ORDER BY fm.created_at {order}, fm.id {order}
+                LIMIT ?
+            ''', (*params, limit + 1))
+            rows = await result.fetchall()
+        return build_page(rows, limit, cursor, direction, key_index)
+    
+    async def search_requests(self, words: list, status: str = None, direction_id: int = None,
+                              date_from: str = None, date_to: str = None,
+                              cursor=None, direction: str = OLDER, limit: int = 10) -> Page:
+        """
+        Полнотекстовый поиск по тексту заявки и ответа. Результаты упорядочены по релевантности (bm25),
+        курсор - (ранг, id) последней показанной строки. Строки: (id, user_id, username, first_name,
+        created_at, status, direction_name, фрагмент с маркерами совпадений, ранг).
+        Без FTS5 ищет через LIKE, упорядочивая по новизне.
+        """
+        conditions, params = [], []
+        if status is not None:
+            conditions.append('fm.status = ?')
+            params.append(status)
+        if direction_id is not None:
+            conditions.append('fm.direction_id = ?')
+            params.append(direction_id)
+        if date_from is not None:
+            conditions.append('fm.created_at >= ?')
+            params.append(date_from)
+        if date_to is not None:
+            conditions.append('fm.created_at < ?')
+            params.append(date_to)
+        
+        if self.fts_available is None:
+            async with self.read() as db:
+                self.fts_available = await self._detect_fts(db)
+        if self.fts_available:
+            source = 'feedback_fts JOIN feedback_messages fm ON fm.id = feedback_fts.rowid'
+            conditions.insert(0, 'feedback_fts MATCH ?')
+            params.insert(0, build_match_query(words))
+            snippet = f"snippet(feedback_fts, -1, '{MATCH_START}', '{MATCH_END}', '…', 12)"
+            score = 'bm25(feedback_fts)'
+        else:
+            source = 'feedback_messages fm'
+            for word in words:
+                conditions.append("(fm.message_text LIKE ? OR IFNULL(fm.answer_text, '') LIKE ?)")
+                params.extend([f'%{word}%', f'%{word}%'])
+            snippet = 'substr(fm.message_text, 1, 120)'
+            score = '-fm.id'
+        
+        if cursor is None:
+            direction = OLDER
+            page_condition = ''
+        else:
+            page_condition = f"WHERE (score, id) {'>' if direction == OLDER else '<'} (?, ?)"
+            params.extend(cursor)
+        order = 'ASC' if direction == OLDER else 'DESC'
+        
+        async with self.read() as db:
+            result = await db.execute(f'''
+                SELECT * FROM (
+                    SELECT fm.id, fm.user_id, fm.username, fm.first_name, fm.created_at, fm.status,
+                           d.name AS direction_name, {snippet} AS snippet, {score} AS score
+                    FROM {source}
+                    LEFT JOIN directions d ON fm.direction_id = d.id
+                    WHERE {' AND '.join(conditions)}
+                )
+                {page_condition}
+                ORDER BY score {order}, id {order}
+                LIMIT ?
+            ''', (*params, limit + 1))
+            rows = await result.fetchall()
+        # «Вперёд» по списку результатов - это OLDER для build_page
+        return build_page(rows, limit, cursor, direction, key_index=(8, 0))
+    
     async def can_teacher_reply_to_request(self, teacher_id: int, request_id: int) -> bool:
         """Проверить, может ли преподаватель ответить на конкретную заявку"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT 1
                 FROM feedback_messages fm
@@ -637,7 +1180,7 @@ class Database:
     # Методы для работы с логами пользователей
     async def log_user_interaction(self, user_id: int, username: str = None, first_name: str = None, last_name: str = None):
         """Записать взаимодействие пользователя с ботом"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             # Проверяем, есть ли уже такой пользователь
             cursor = await db.execute('SELECT user_id, total_messages FROM users_log WHERE user_id = ?', (user_id,))
             existing_user = await cursor.fetchone()
@@ -662,7 +1205,7 @@ class Database:
     
     async def get_all_users_log(self):
         """Получить всех пользователей из лога"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.read() as db:
             cursor = await db.execute('''
                 SELECT user_id, username, first_name, last_name, 
                        first_interaction, last_interaction, total_messages
@@ -673,7 +1216,7 @@ class Database:
     
     async def get_users_stats(self):
         """Получить статистику пользователей"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.read() as db:
             cursor = await db.execute('SELECT COUNT(*) FROM users_log')
             total_users = (await cursor.fetchone())[0]
             
@@ -688,7 +1231,7 @@ class Database:
     # Методы для работы с рабочими часами обратной связи
     async def get_working_hours(self):
         """Получить все рабочие часы"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT day_of_week, start_time, end_time, is_active
                 FROM feedback_working_hours
@@ -698,7 +1241,7 @@ class Database:
     
     async def set_working_hours(self, day_of_week: int, start_time: str, end_time: str, is_active: bool = True):
         """Установить рабочие часы для дня недели"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute('''
                 INSERT OR REPLACE INTO feedback_working_hours 
                 (day_of_week, start_time, end_time, is_active, updated_at)
@@ -708,7 +1251,7 @@ class Database:
     
     async def delete_working_hours(self, day_of_week: int):
         """Удалить рабочие часы для дня недели"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             await db.execute('DELETE FROM feedback_working_hours WHERE day_of_week = ?', (day_of_week,))
             await db.commit()
     
@@ -720,7 +1263,7 @@ class Database:
         day_of_week = now.weekday()  # 0=Понедельник, 6=Воскресенье
         current_time = now.strftime("%H:%M")
         
-        async with aiosqlite.connect(self.db_path) as db:
+        async with self.connect() as db:
             cursor = await db.execute('''
                 SELECT start_time, end_time, is_active
                 FROM feedback_working_hours
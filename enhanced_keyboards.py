@@ -4,6 +4,7 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 from chat_handler import ChatType
+from pagination import NEWER, OLDER, Page, page_callback_data, encode_cursor
 
 def get_keyboard_for_chat_type(chat_type: ChatType, user_id: int = None, bot_username: str = None):
     """Получить клавиатуру в зависимости от типа чата"""
@@ -140,6 +141,15 @@ def get_admin_requests_keyboard():
     builder.adjust(2, 2, 1, 1)
     return builder.as_markup()
 
+def get_page_navigation_buttons(page: Page, prefix: str, encode=encode_cursor, labels=("⬅️ Новее", "Старше ➡️")):
+    """Кнопки листания страницы заявок (пустой список, если страница единственная)"""
+    buttons = []
+    if page.newer:
+        buttons.append(InlineKeyboardButton(text=labels[0], callback_data=page_callback_data(prefix, NEWER, page.newer, encode)))
+    if page.older:
+        buttons.append(InlineKeyboardButton(text=labels[1], callback_data=page_callback_data(prefix, OLDER, page.older, encode)))
+    return buttons
+
 def get_request_detail_keyboard(request_id: int, user_id: int, is_active: bool = True):
     """Клавиатура для детального просмотра заявки"""
     builder = InlineKeyboardBuilder()
@@ -178,13 +188,14 @@ def get_statistics_keyboard(chat_type: ChatType):
         builder.add(InlineKeyboardButton(text="🎫 Статистика заявок", callback_data="stats_requests"))
         builder.add(InlineKeyboardButton(text="👥 Активность пользователей", callback_data="stats_users"))
         builder.add(InlineKeyboardButton(text="📚 По направлениям", callback_data="stats_directions"))
+        builder.add(InlineKeyboardButton(text="⏱ Время ответа", callback_data="stats_response_times"))
         
         # Добавляем кнопку возврата в зависимости от типа чата
         if chat_type == ChatType.ADMIN_GROUP:
             builder.add(InlineKeyboardButton(text="⬅️ Назад в меню", callback_data="back_to_group_menu"))
-            builder.adjust(2, 2, 1)
+            builder.adjust(2, 2, 1, 1)
         else:
-            builder.adjust(2, 2)
+            builder.adjust(2, 2, 1)
     
     elif chat_type == ChatType.PRIVATE_TEACHER:
         builder.add(InlineKeyboardButton(text="🎫 Мои заявки", callback_data="stats_my_requests"))
@@ -12,6 +12,8 @@ from aiogram.types import InlineKeyboardButton
 
 from database import db
 from chat_handler import ChatType, ChatBehavior
+from metadata_cache import metadata
+from request_service import close_request, get_responder_role, resolve_reply_target, CLOSED, ALREADY_CLOSED, FORBIDDEN
 from enhanced_keyboards import (
     get_public_group_keyboard, get_admin_group_keyboard, 
     get_quick_schedule_keyboard, get_admin_requests_keyboard,
@@ -24,7 +26,7 @@ from keyboards import (
 )
 from schedule_parser import schedule_parser
 
-group_router = Router()
+group_router = Router(name="group")
 
 def escape_markdown(text: str) -> str:
     """Экранирует специальные символы Markdown"""
@@ -46,8 +48,7 @@ async def group_start_command(message: Message):
     )
     
     # Получаем username бота для кнопки обратной связи
-    bot_info = await message.bot.get_me()
-    bot_username = bot_info.username
+    bot_username = await metadata.get_bot_username(message.bot)
     
     if chat_type == ChatType.PUBLIC_GROUP:
         keyboard = get_public_group_keyboard(bot_username)
@@ -285,8 +286,7 @@ async def back_to_group_menu(callback: CallbackQuery):
     )
     
     # Получаем username бота для кнопки обратной связи
-    bot_info = await callback.bot.get_me()
-    bot_username = bot_info.username
+    bot_username = await metadata.get_bot_username(callback.bot)
     
     if chat_type == ChatType.PUBLIC_GROUP:
         keyboard = get_public_group_keyboard(bot_username)
@@ -484,6 +484,33 @@ async def group_stats_directions_callback(callback: CallbackQuery):
     )
     await callback.answer()
 
+@group_router.callback_query(F.data == "stats_response_times")
+async def group_stats_response_times_callback(callback: CallbackQuery):
+    """Время ответа на заявки (перцентили) для группы"""
+    is_admin = await db.is_admin(callback.from_user.id)
+    if not is_admin:
+        await callback.answer("❌ Доступно только администраторам", show_alert=True)
+        return
+    
+    chat_type = await ChatBehavior.determine_chat_type(callback.message)
+    
+    from admin_handlers import get_response_times_statistics
+    stats = await get_response_times_statistics()
+    
+    if chat_type == ChatType.ADMIN_GROUP:
+        builder = InlineKeyboardBuilder()
+        builder.add(InlineKeyboardButton(text="⬅️ Назад к статистике", callback_data="group_statistics"))
+        reply_markup = builder.as_markup()
+    else:  # PRIVATE_ADMIN - без кнопки возврата
+        reply_markup = None
+    
+    await callback.message.edit_text(
+        stats,
+        parse_mode="Markdown",
+        reply_markup=reply_markup
+    )
+    await callback.answer()
+
 @group_router.callback_query(F.data == "group_settings")
 async def group_settings_callback(callback: CallbackQuery):
     """Настройки группы"""
@@ -538,33 +565,25 @@ async def get_today_schedule(day: str, day_name: str = "сегодня") -> str:
 async def get_active_requests_summary() -> str:
     """Получить краткую сводку активных заявок"""
     try:
-        # Получаем активные заявки из базы данных
-        async with aiosqlite.connect(db.db_path) as conn:
-            cursor = await conn.execute('''
-                SELECT COUNT(*) as total,
-                       COUNT(CASE WHEN created_at > datetime('now', '-1 day') THEN 1 END) as today,
-                       COUNT(CASE WHEN created_at > datetime('now', '-1 hour') THEN 1 END) as hour
-                FROM feedback_messages 
-                WHERE status = 'active'
-            ''')
-            stats = await cursor.fetchone()
-            
-            if not stats:
-                return "📊 Активных заявок нет"
-            
-            total, today, hour = stats
-            
-            text = f"📊 *Всего активных:* {total}\n"
-            text += f"📅 *За сегодня:* {today}\n"
-            text += f"🕐 *За час:* {hour}\n"
-            
-            if total == 0:
-                text += "\n✅ Все заявки обработаны!"
-            elif hour > 5:
-                text += "\n⚠️ Много новых заявок за последний час!"
-            
-            return text
-            
+        # Счётчики активных заявок (из реестра в памяти)
+        stats = await db.get_active_requests_counts()
+        
+        if not stats:
+            return "📊 Активных заявок нет"
+        
+        total, today, hour = stats
+        
+        text = f"📊 *Всего активных:* {total}\n"
+        text += f"📅 *За сегодня:* {today}\n"
+        text += f"🕐 *За час:* {hour}\n"
+        
+        if total == 0:
+            text += "\n✅ Все заявки обработаны!"
+        elif hour > 5:
+            text += "\n⚠️ Много новых заявок за последний час!"
+        
+        return text
+        
     except Exception as e:
         # Экранируем специальные символы Markdown в сообщении об ошибке
         error_msg = escape_markdown(str(e))
@@ -573,49 +592,31 @@ async def get_active_requests_summary() -> str:
 async def get_group_statistics() -> str:
     """Получить статистику для группы"""
     try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            # Общая статистика заявок
-            cursor = await conn.execute('''
-                SELECT 
-                    COUNT(*) as total_requests,
-                    COUNT(CASE WHEN status = 'active' THEN 1 END) as active_requests,
-                    COUNT(CASE WHEN status = 'closed' THEN 1 END) as closed_requests,
-                    COUNT(CASE WHEN created_at > datetime('now', '-7 days') THEN 1 END) as week_requests
-                FROM feedback_messages
-            ''')
-            request_stats = await cursor.fetchone()
-            
-            # Статистика пользователей
-            cursor = await conn.execute('''
-                SELECT COUNT(DISTINCT user_id) as unique_users
-                FROM feedback_messages
-                WHERE created_at > datetime('now', '-30 days')
-            ''')
-            user_stats = await cursor.fetchone()
-            
-            if not request_stats:
-                return "❌ Не удалось получить статистику"
-            
-            total, active, closed, week = request_stats
-            unique_users = user_stats[0] if user_stats else 0
-            
-            text = "📊 *Статистика IT-Cube Bot*\n\n"
-            text += f"🎫 *Заявки:*\n"
-            text += f"• Всего: {total}\n"
-            text += f"• Активных: {active}\n"
-            text += f"• Закрытых: {closed}\n"
-            text += f"• За неделю: {week}\n\n"
-            text += f"👥 *Пользователи:*\n"
-            text += f"• Уникальных за месяц: {unique_users}\n\n"
-            
-            if active > 0:
-                response_rate = round((closed / total) * 100, 1) if total > 0 else 0
-                text += f"📈 *Процент ответов:* {response_rate}%"
-            else:
-                text += "✅ *Все заявки обработаны!*"
-            
-            return text
-            
+        # Итоги - из счётчиков заявок, окна за неделю/месяц - из почасовых и посуточных сводок
+        counters = await db.get_request_counters()
+        total = counters.total('total')
+        active = counters.total('active')
+        closed = counters.total('closed')
+        week = await db.count_requests_since('-7 days')
+        unique_users = await db.count_users_since('-30 days')
+        
+        text = "📊 *Статистика IT-Cube Bot*\n\n"
+        text += f"🎫 *Заявки:*\n"
+        text += f"• Всего: {total}\n"
+        text += f"• Активных: {active}\n"
+        text += f"• Закрытых: {closed}\n"
+        text += f"• За неделю: {week}\n\n"
+        text += f"👥 *Пользователи:*\n"
+        text += f"• Уникальных за месяц: {unique_users}\n\n"
+        
+        if active > 0:
+            response_rate = round((closed / total) * 100, 1) if total > 0 else 0
+            text += f"📈 *Процент ответов:* {response_rate}%"
+        else:
+            text += "✅ *Все заявки обработаны!*"
+        
+        return text
+        
     except Exception as e:
         # Экранируем специальные символы Markdown в сообщении об ошибке
         error_msg = escape_markdown(str(e))
@@ -640,8 +641,7 @@ async def handle_menu_command(message: Message):
     )
     
     # Получаем username бота для кнопки обратной связи
-    bot_info = await message.bot.get_me()
-    bot_username = bot_info.username
+    bot_username = await metadata.get_bot_username(message.bot)
     
     if chat_type == ChatType.PUBLIC_GROUP:
         keyboard = get_public_group_keyboard(bot_username)
@@ -661,9 +661,6 @@ async def handle_menu_command(message: Message):
 @group_router.message(F.reply_to_message & F.chat.type.in_({"group", "supergroup"}))
 async def handle_admin_reply_in_group(message: Message):
     """Обработка ответов администраторов на заявки в групповых чатах через reply"""
-    import re
-    from enhanced_keyboards import get_admin_keyboard, get_teacher_keyboard
-    
     # Проверяем, что это reply на сообщение бота
     if not message.reply_to_message or message.reply_to_message.from_user.id != message.bot.id:
         return
@@ -680,87 +677,47 @@ async def handle_admin_reply_in_group(message: Message):
     if chat_type != ChatType.ADMIN_GROUP:
         return
     
-    # Ищем номер заявки в тексте сообщения, на которое отвечают
-    reply_text = message.reply_to_message.text or ""
-    match = re.search(r'#(\d+)', reply_text)
-    if not match:
+    # Находим заявку по уведомлению, на которое отвечают
+    message_id = await resolve_reply_target(message.chat.id, message.reply_to_message)
+    if message_id is None:
         await message.reply("❌ Не удалось найти номер заявки для ответа.")
         return
     
-    message_id = int(match.group(1))
-    reply_content = message.text
-    
-    # Получаем исходную заявку
-    feedback_msg = await db.get_feedback_message(message_id)
-    if not feedback_msg:
-        await message.reply(f"❌ Заявка #{message_id} не найдена.")
-        return
-    
-    user_id = feedback_msg[1]
-    original_text = feedback_msg[4]
-    is_answered = feedback_msg[6]
-    status = feedback_msg[7] if len(feedback_msg) > 7 else 'active'
-    
-    # Проверяем, что заявка ещё активна
-    if status == 'closed' or is_answered:
-        await message.reply(f"⚠️ Заявка #{message_id} уже закрыта.")
-        return
-    
-    # Если отвечает преподаватель, проверяем права на данную заявку
-    if is_teacher and not is_admin:
-        can_reply = await db.can_teacher_reply_to_request(message.from_user.id, message_id)
-        if not can_reply:
-            await message.reply(
-                f"❌ У вас нет прав для ответа на заявку #{message_id}.\n"
-                "Вы можете отвечать только на заявки по направлениям, к которым вы привязаны."
-            )
-            return
+    responder_role = get_responder_role(is_admin, is_teacher)
     
     try:
-        # Определяем роль отвечающего
-        if is_admin and not is_teacher:
-            responder_role = "Администратор"
-        elif is_teacher:
-            responder_role = "Преподаватель"
-        else:
-            responder_role = "Администратор"  # по умолчанию
-        
-        user_reply = (
-            f"✅ *Ответ на вашу заявку #{message_id}*\n\n"
-            f"👤 *Ответил:* {responder_role}\n"
-            f"📋 *Статус:* Заявка закрыта\n\n"
-            f"💬 *Ваша заявка:*\n{original_text}\n\n"
-            f"📝 *Ответ:*\n{reply_content}\n\n"
-            f"💡 Теперь вы можете создать новую заявку, если это необходимо."
+        result = await close_request(
+            message.bot, message_id, message.from_user.id, responder_role,
+            answer_text=message.text, teacher_only=is_teacher and not is_admin
         )
-        
-        await message.bot.send_message(user_id, user_reply, parse_mode="Markdown")
-        await db.mark_message_answered(message_id, message.from_user.id, reply_content)
-        
-        # Обновляем статус в админских уведомлениях
-        await db.update_notification_status(message.bot, message_id, f"Закрыта ({responder_role})", reply_content)
-        
-        # Отправляем уведомления преподавателям о закрытии заявки
-        await db.notify_teachers_about_closed_request(message.bot, message_id, responder_role, reply_content)
-        
+    except Exception as e:
+        await message.reply(
+            f"❌ Ошибка отправки ответа: {str(e)}"
+        )
+        return
+    
+    if result == CLOSED:
         await message.reply(
             f"✅ Ответ на заявку #{message_id} отправлен! Заявка закрыта."
         )
-        
-    except Exception as e:
+    elif result == ALREADY_CLOSED:
+        await message.reply(f"⚠️ Заявка #{message_id} уже закрыта.")
+    elif result == FORBIDDEN:
         await message.reply(
-            f"❌ Ошибка отправки ответа: {str(e)}"
+            f"❌ У вас нет прав для ответа на заявку #{message_id}.\n"
+            "Вы можете отвечать только на заявки по направлениям, к которым вы привязаны."
         )
+    else:
+        await message.reply(f"❌ Заявка #{message_id} не найдена.")
 
 # Обработка упоминаний бота в группах
 @group_router.message(F.text.contains("@") & F.chat.type.in_({"group", "supergroup"}))
 async def handle_bot_mention(message: Message):
     """Обработка упоминания бота в группах"""
     # Проверяем, упомянут ли бот
-    bot_info = await message.bot.get_me()
-    bot_username = bot_info.username
+    bot_username = await metadata.get_bot_username(message.bot)
     
-    if f"@{bot_username}" in message.text.lower():
+    if f"@{bot_username.lower()}" in message.text.lower():
         chat_type = await ChatBehavior.determine_chat_type(message)
         
         # message.reply() автоматически использует message_thread_id
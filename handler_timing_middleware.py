@@ -0,0 +1,130 @@
+"""
+Middleware для замера времени обработки апдейтов по роутерам и хендлерам
+и журналирования медленных апдейтов
+"""
+import json
+import logging
+import time
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import SLOW_UPDATE_THRESHOLD_MS
+from metrics import registry
+from update_trace import UpdateTrace, current_trace
+
+logger = logging.getLogger(__name__)
+
+# Окно скользящих перцентилей для экрана /handler_stats
+HANDLER_STATS_WINDOW_SECONDS = 600
+
+updates_total = registry.counter(
+    "bot_updates_total", "Обработанные апдейты", ("update_type",)
+)
+update_latency = registry.histogram(
+    "bot_update_duration_seconds", "Полное время обработки апдейта", ("update_type",)
+)
+handler_latency = registry.histogram(
+    "bot_handler_duration_seconds", "Время работы хендлера", ("router", "handler"),
+    window_seconds=HANDLER_STATS_WINDOW_SECONDS
+)
+slow_updates = registry.counter(
+    "bot_slow_updates_total", "Апдейты дольше порога", ("router", "handler")
+)
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware диспетчера: открывает трассу апдейта, замеряет полное
+    время обработки и пишет структурированную запись о медленном апдейте
+    """
+
+    def __init__(self, threshold_ms: float = SLOW_UPDATE_THRESHOLD_MS):
+        self.threshold = threshold_ms / 1000
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        trace = UpdateTrace(event.update_id, event.event_type)
+        token = current_trace.set(trace)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            duration = time.perf_counter() - started
+            current_trace.reset(token)
+            updates_total.inc(trace.update_type)
+            update_latency.observe(duration, trace.update_type)
+            if duration >= self.threshold:
+                self._log_slow_update(trace, duration)
+
+    @staticmethod
+    def _log_slow_update(trace: UpdateTrace, duration: float):
+        """Записать медленный апдейт одной JSON-строкой"""
+        slow_updates.inc(trace.router or "-", trace.handler or "-")
+        logger.warning("slow_update %s", json.dumps({
+            "update_id": trace.update_id,
+            "update_type": trace.update_type,
+            "router": trace.router,
+            "handler": trace.handler,
+            "duration_ms": round(duration * 1000, 1),
+            "handler_ms": round(trace.handler_time * 1000, 1),
+            "db_ms": round(trace.db_time * 1000, 1),
+            "db_calls": trace.db_calls,
+            "api_ms": round(trace.api_time * 1000, 1),
+            "api_calls": trace.api_calls,
+        }, ensure_ascii=False))
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware наблюдателей событий: определяет роутер и хендлер,
+    выбранные для апдейта, и замеряет время работы хендлера
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        router = data.get("event_router")
+        handler_object = data.get("handler")
+        router_name = router.name if router is not None else "-"
+        handler_name = handler_object.callback.__name__ if handler_object is not None else "-"
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            duration = time.perf_counter() - started
+            handler_latency.observe(duration, router_name, handler_name)
+            trace = current_trace.get()
+            if trace is not None:
+                trace.router = router_name
+                trace.handler = handler_name
+                trace.handler_time = duration
+
+
+def get_handler_stats_summary(limit: int = 15):
+    """
+    Сводка по хендлерам за скользящее окно: список кортежей
+    (роутер, хендлер, вызовов, p50, p95, p99), отсортированный по p95
+    """
+    summary = []
+    for router_name, handler_name in handler_latency.label_sets():
+        _, count = handler_latency.recent_counts(router_name, handler_name)
+        if not count:
+            continue
+        summary.append((
+            router_name,
+            handler_name,
+            count,
+            handler_latency.recent_percentile(0.50, router_name, handler_name),
+            handler_latency.recent_percentile(0.95, router_name, handler_name),
+            handler_latency.recent_percentile(0.99, router_name, handler_name),
+        ))
+    summary.sort(key=lambda row: row[4], reverse=True)
+    return summary[:limit]
@@ -1,4 +1,3 @@
-import re
 from aiogram import Router, F
 from aiogram.filters import Command, StateFilter, ChatMemberUpdatedFilter, IS_MEMBER, IS_NOT_MEMBER
 from aiogram.types import Message, CallbackQuery, ChatMemberUpdated
@@ -17,9 +16,11 @@ from keyboards import (
 )
 from schedule_parser import schedule_parser
 from chat_handler import ChatType, ChatBehavior
+from request_service import close_request, get_responder_role, resolve_reply_target, CLOSED, ALREADY_CLOSED, FORBIDDEN
+from metadata_cache import metadata
 from enhanced_keyboards import get_keyboard_for_chat_type, get_admin_keyboard, get_teacher_keyboard
 
-router = Router()
+router = Router(name="main")
 
 # Вспомогательная функция для безопасного редактирования сообщений
 async def safe_edit_message(message, text, **kwargs):
@@ -957,12 +958,11 @@ async def add_admin_process(message: Message, state: FSMContext):
     try:
         user_id = int(message.text.strip())
         
-        # Получаем информацию о пользователе через Telegram API
-        try:
-            user_info = await message.bot.get_chat(user_id)
-            username = user_info.username
-            first_name = user_info.first_name
-        except Exception:
+        # Получаем информацию о пользователе из кэша или через Telegram API
+        profile = await metadata.get_user_profile(message.bot, user_id)
+        if profile:
+            username, first_name = profile
+        else:
             # Если не удалось получить информацию о пользователе
             username = None
             first_name = "Новый админ"
@@ -1021,13 +1021,8 @@ async def remove_admin_process(message: Message, state: FSMContext):
             await message.answer("❌ Пользователь не является администратором.")
             return
         
-        # Получаем информацию о пользователе для красивого сообщения
-        try:
-            user_info = await message.bot.get_chat(user_id)
-            username = user_info.username
-            display_name = f"@{username}" if username else str(user_id)
-        except Exception:
-            display_name = str(user_id)
+        # Имя пользователя для красивого сообщения
+        display_name = metadata.display_name(user_id)
         
         # Удаляем администратора
         await db.remove_admin(user_id)
@@ -1059,10 +1054,7 @@ async def list_admins(callback: CallbackQuery):
         text = "👥 *Список администраторов:*\n\n"
         for user_id, username, first_name in admins:
             # Формируем отображаемое имя - приоритет username, если нет то ID
-            if username:
-                display_name = f"@{username}"
-            else:
-                display_name = f"{user_id}"
+            display_name = metadata.display_name(user_id, username)
             
             text += f"• {display_name} - `{user_id}`\n"
     
@@ -1088,24 +1080,9 @@ async def update_admins_info(callback: CallbackQuery):
     
     await callback.answer("🔄 Обновляю информацию об администраторах...")
     
-    admins = await db.get_all_admins()
-    updated_count = 0
-    
-    for user_id, old_username, old_first_name in admins:
-        try:
-            # Получаем актуальную информацию о пользователе
-            user_info = await callback.bot.get_chat(user_id)
-            new_username = user_info.username
-            new_first_name = user_info.first_name
-            
-            # Обновляем только если информация изменилась
-            if new_username != old_username or new_first_name != old_first_name:
-                await db.update_admin_info(user_id, new_username, new_first_name)
-                updated_count += 1
-                
-        except Exception:
-            # Пропускаем пользователей, информацию о которых не удалось получить
-            continue
+    # Актуальные имена берутся из кэша метаданных; в Telegram запрашиваются
+    # только отсутствующие в нём сотрудники, и параллельно
+    updated_count = await metadata.sync_staff_profiles(callback.bot)
     
     if updated_count > 0:
         await callback.message.answer(
@@ -1200,11 +1177,10 @@ async def add_notification_chat_process(message: Message, state: FSMContext):
         chat_id = int(message.text.strip())
         
         # Пытаемся получить информацию о чате
-        try:
-            chat_info = await message.bot.get_chat(chat_id)
-            chat_title = chat_info.title or f"Личный чат {chat_info.first_name}"
-            chat_type = chat_info.type
-        except Exception:
+        chat_info = await metadata.get_chat_info(message.bot, chat_id)
+        if chat_info:
+            chat_title, chat_type = chat_info
+        else:
             # Если не удалось получить информацию о чате
             chat_title = f"Чат {chat_id}"
             chat_type = "unknown"
@@ -1220,6 +1196,7 @@ async def add_notification_chat_process(message: Message, state: FSMContext):
             return
         
         await db.add_notification_chat(chat_id, chat_title, chat_type, message.from_user.id)
+        metadata.invalidate_chats()
         
         await message.answer(
             f"✅ Чат добавлен!\n\n"
@@ -1251,7 +1228,7 @@ async def list_notification_chats(callback: CallbackQuery):
         await callback.answer("❌ У вас нет прав для выполнения этой команды.", show_alert=True)
         return
     
-    chats = await db.get_notification_chats()
+    chats = await metadata.get_notification_chats()
     
     if not chats:
         text = (
@@ -1303,7 +1280,7 @@ async def manage_notification_chat(callback: CallbackQuery):
     chat_id = int(callback.data.split(":", 1)[1])
     
     # Получаем информацию о чате из БД
-    chats = await db.get_notification_chats()
+    chats = await metadata.get_notification_chats()
     chat_info = None
     for c_id, c_title, c_type in chats:
         if c_id == chat_id:
@@ -1346,6 +1323,7 @@ async def toggle_notification_chat(callback: CallbackQuery):
     is_active = bool(int(parts[2]))
     
     await db.toggle_notification_chat(chat_id, is_active)
+    metadata.invalidate_chats()
     
     action = "включен" if is_active else "отключен"
     await callback.answer(f"✅ Чат {action}!")
@@ -1363,6 +1341,7 @@ async def remove_notification_chat(callback: CallbackQuery):
     chat_id = int(callback.data.split(":", 1)[1])
     
     await db.remove_notification_chat(chat_id)
+    metadata.invalidate_chats()
     
     await callback.answer("✅ Чат удален из списка уведомлений!")
     
@@ -1376,13 +1355,14 @@ async def show_user_conversation(message: Message):
         await message.answer("❌ У вас нет прав для выполнения этой команды.")
         return
     
-    # Парсим команду: /msg 123456789
+    # Парсим команду: /msg 123456789 [архив]
     parts = message.text.split()
-    if len(parts) != 2:
+    include_archive = len(parts) == 3 and parts[2].lower() in ("архив", "archive")
+    if len(parts) != 2 and not include_archive:
         await message.answer(
             "❌ Неверный формат команды.\n"
-            "Используйте: `/msg ID_пользователя`\n"
-            "Например: `/msg 123456789`",
+            "Используйте: `/msg ID_пользователя [архив]`\n"
+            "Например: `/msg 123456789` или `/msg 123456789 архив` (вместе с архивными заявками)",
             parse_mode="Markdown"
         )
         return
@@ -1394,7 +1374,7 @@ async def show_user_conversation(message: Message):
         return
     
     # Получаем переписку
-    conversation = await db.get_user_conversation(user_id)
+    conversation = await db.get_user_conversation(user_id, include_archive=include_archive)
     
     if not conversation:
         await message.answer(f"❌ Переписка с пользователем `{user_id}` не найдена.", parse_mode="Markdown")
@@ -1509,12 +1489,11 @@ async def add_teacher_process(message: Message, state: FSMContext):
     try:
         user_id = int(message.text.strip())
         
-        # Получаем информацию о пользователе через Telegram API
-        try:
-            user_info = await message.bot.get_chat(user_id)
-            username = user_info.username
-            first_name = user_info.first_name
-        except Exception:
+        # Получаем информацию о пользователе из кэша или через Telegram API
+        profile = await metadata.get_user_profile(message.bot, user_id)
+        if profile:
+            username, first_name = profile
+        else:
             username = None
             first_name = "Новый преподаватель"
         
@@ -1565,12 +1544,7 @@ async def remove_teacher_process(message: Message, state: FSMContext):
             await message.answer("❌ Пользователь не является преподавателем.")
             return
         
-        try:
-            user_info = await message.bot.get_chat(user_id)
-            username = user_info.username
-            display_name = f"@{username}" if username else str(user_id)
-        except Exception:
-            display_name = str(user_id)
+        display_name = metadata.display_name(user_id)
         
         await db.remove_teacher(user_id)
         
@@ -1600,10 +1574,7 @@ async def list_teachers(callback: CallbackQuery):
     else:
         text = "👨‍🏫 *Список преподавателей:*\n\n"
         for user_id, username, first_name in teachers:
-            if username:
-                display_name = f"@{username}"
-            else:
-                display_name = f"{user_id}"
+            display_name = metadata.display_name(user_id, username)
             
             # Получаем направления преподавателя
             directions = await db.get_directions_for_teacher(user_id)
@@ -1750,117 +1721,51 @@ async def handle_text_messages(message: Message):
         is_teacher = await db.is_teacher(message.from_user.id)
         
         if is_admin or is_teacher:
-            # Ищем номер сообщения в тексте
-            reply_text = message.reply_to_message.text or ""
-            match = re.search(r'#(\d+)', reply_text)
-            if match:
-                message_id = int(match.group(1))
-                reply_content = message.text
+            # Клавиатура для отвечающего
+            if is_admin:
+                response_keyboard = get_admin_keyboard()
+            elif is_teacher:
+                response_keyboard = get_teacher_keyboard()
+            else:
+                response_keyboard = get_admin_keyboard()  # по умолчанию
+            
+            # Находим заявку по уведомлению, на которое ответили
+            message_id = await resolve_reply_target(message.chat.id, message.reply_to_message)
+            if message_id is not None:
+                responder_role = get_responder_role(is_admin, is_teacher)
                 
-                # Получаем исходную заявку
-                feedback_msg = await db.get_feedback_message(message_id)
-                if feedback_msg:
-                    user_id = feedback_msg[1]
-                    original_text = feedback_msg[4]
-                    is_answered = feedback_msg[6]
-                    status = feedback_msg[7] if len(feedback_msg) > 7 else 'active'
-                    
-                    # Проверяем, что заявка ещё активна
-                    if status == 'closed' or is_answered:
-                        # Определяем правильную клавиатуру для отвечающего
-                        if is_admin:
-                            closed_keyboard = get_admin_keyboard()
-                        elif is_teacher:
-                            closed_keyboard = get_teacher_keyboard()
-                        else:
-                            closed_keyboard = get_admin_keyboard()  # по умолчанию
-                        
-                        await message.answer(
-                            f"⚠️ Заявка #{message_id} уже закрыта.",
-                            reply_markup=closed_keyboard
-                        )
-                        return
-                    
-                    # Если отвечает преподаватель, проверяем права на данную заявку
-                    if is_teacher and not is_admin:
-                        can_reply = await db.can_teacher_reply_to_request(message.from_user.id, message_id)
-                        if not can_reply:
-                            # Показываем клавиатуру преподавателя
-                            teacher_no_rights_keyboard = get_teacher_keyboard()
-                            
-                            await message.answer(
-                                f"❌ У вас нет прав для ответа на заявку #{message_id}.\n"
-                                "Вы можете отвечать только на заявки по направлениям, к которым вы привязаны.",
-                                reply_markup=teacher_no_rights_keyboard
-                            )
-                            return
-                    
-                    try:
-                        # Определяем роль отвечающего (переменные уже определены выше)
-                        
-                        if is_admin and not is_teacher:
-                            responder_role = "Администратор"
-                        elif is_teacher:
-                            responder_role = "Преподаватель"
-                        else:
-                            responder_role = "Администратор"  # по умолчанию
-                        
-                        user_reply = (
-                            f"✅ *Ответ на вашу заявку #{message_id}*\n\n"
-                            f"👤 *Ответил:* {responder_role}\n"
-                            f"📋 *Статус:* Заявка закрыта\n\n"
-                            f"💬 *Ваша заявка:*\n{original_text}\n\n"
-                            f"📝 *Ответ:*\n{reply_content}\n\n"
-                            f"💡 Теперь вы можете создать новую заявку, если это необходимо."
-                        )
-                        
-                        await message.bot.send_message(user_id, user_reply, parse_mode="Markdown")
-                        await db.mark_message_answered(message_id, message.from_user.id, reply_content)
-                        
-                        # Обновляем статус в админских уведомлениях
-                        await db.update_notification_status(message.bot, message_id, f"Закрыта ({responder_role})", reply_content)
-                        
-                        # Отправляем уведомления преподавателям о закрытии заявки
-                        await db.notify_teachers_about_closed_request(message.bot, message_id, responder_role, reply_content)
-                        
-                        # Определяем правильную клавиатуру для отвечающего
-                        if is_admin:
-                            response_keyboard = get_admin_keyboard()
-                        elif is_teacher:
-                            response_keyboard = get_teacher_keyboard()
-                        else:
-                            response_keyboard = get_admin_keyboard()  # по умолчанию
-                        
-                        await message.answer(
-                            f"✅ Ответ на заявку #{message_id} отправлен! Заявка закрыта.",
-                            reply_markup=response_keyboard
-                        )
-                        
-                    except Exception as e:
-                        # Определяем правильную клавиатуру для отвечающего
-                        if is_admin:
-                            error_keyboard = get_admin_keyboard()
-                        elif is_teacher:
-                            error_keyboard = get_teacher_keyboard()
-                        else:
-                            error_keyboard = get_admin_keyboard()  # по умолчанию
-                        
-                        await message.answer(
-                            f"❌ Ошибка отправки ответа: {str(e)}",
-                            reply_markup=error_keyboard
-                        )
+                try:
+                    result = await close_request(
+                        message.bot, message_id, message.from_user.id, responder_role,
+                        answer_text=message.text, teacher_only=is_teacher and not is_admin
+                    )
+                except Exception as e:
+                    await message.answer(
+                        f"❌ Ошибка отправки ответа: {str(e)}",
+                        reply_markup=response_keyboard
+                    )
+                    return
+                
+                if result == CLOSED:
+                    await message.answer(
+                        f"✅ Ответ на заявку #{message_id} отправлен! Заявка закрыта.",
+                        reply_markup=response_keyboard
+                    )
+                elif result == ALREADY_CLOSED:
+                    await message.answer(
+                        f"⚠️ Заявка #{message_id} уже закрыта.",
+                        reply_markup=response_keyboard
+                    )
+                elif result == FORBIDDEN:
+                    await message.answer(
+                        f"❌ У вас нет прав для ответа на заявку #{message_id}.\n"
+                        "Вы можете отвечать только на заявки по направлениям, к которым вы привязаны.",
+                        reply_markup=response_keyboard
+                    )
                 else:
-                    # Определяем правильную клавиатуру для отвечающего
-                    if is_admin:
-                        not_found_keyboard = get_admin_keyboard()
-                    elif is_teacher:
-                        not_found_keyboard = get_teacher_keyboard()
-                    else:
-                        not_found_keyboard = get_admin_keyboard()  # по умолчанию
-                    
                     await message.answer(
                         f"❌ Заявка #{message_id} не найдена.",
-                        reply_markup=not_found_keyboard
+                        reply_markup=response_keyboard
                     )
 
 def escape_markdown(text):
@@ -1915,7 +1820,9 @@ async def send_notifications_with_attachments(bot, message_id, direction_id, dir
             for teacher_id, teacher_username, teacher_first_name in teachers:
                 try:
                     # Отправляем текст уведомления
-                    await bot.send_message(teacher_id, teacher_text, parse_mode="Markdown")
+                    sent_message = await bot.send_message(teacher_id, teacher_text, parse_mode="Markdown")
+                    # Сохраняем message_id, чтобы ответ преподавателя reply находил заявку
+                    await db.save_notification_message(message_id, teacher_id, sent_message.message_id, kind='teacher')
                     
                     # Отправляем прикрепления
                     await send_attachments_group(bot, teacher_id, attachments)
@@ -1930,7 +1837,7 @@ async def send_notifications_with_attachments(bot, message_id, direction_id, dir
         admin_text = f"👑 *Заявка для администрации* (дубликат)\n\n" + base_notification
     
     # Отправляем в настроенные чаты для админов
-    notification_chats = await db.get_notification_chats()
+    notification_chats = await metadata.get_notification_chats()
     if notification_chats:
         for chat_id, chat_title, chat_type in notification_chats:
             try:
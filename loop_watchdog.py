@@ -0,0 +1,108 @@
+"""
+Сторожевой таймер цикла событий: непрерывно замеряет задержку цикла и,
+если цикл заблокирован дольше порога, снимает стек блокирующего кода
+из вспомогательного потока
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from config import LOOP_STALL_THRESHOLD_MS
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Интервал тиков сторожевой задачи, секунды
+WATCHDOG_INTERVAL = 0.1
+# Максимум различных мест блокировки в метках метрики
+MAX_STALL_LOCATIONS = 50
+
+_PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+loop_lag = registry.gauge(
+    "event_loop_lag_seconds", "Последняя измеренная задержка цикла событий"
+)
+loop_lag_histogram = registry.histogram(
+    "event_loop_lag_duration_seconds", "Распределение задержки цикла событий"
+)
+loop_stalls = registry.counter(
+    "event_loop_stalls_total", "Блокировки цикла событий дольше порога", ("location",)
+)
+
+
+def find_blocking_location(stack: traceback.StackSummary) -> str:
+    """Место блокировки: самый глубокий кадр из кода бота, иначе самый глубокий кадр вообще"""
+    for frame in reversed(stack):
+        if os.path.abspath(frame.filename).startswith(_PROJECT_DIR + os.sep):
+            return f"{os.path.basename(frame.filename)}:{frame.name}"
+    if stack:
+        frame = stack[-1]
+        return f"{os.path.basename(frame.filename)}:{frame.name}"
+    return "unknown"
+
+
+class LoopWatchdog:
+    """Сторож цикла событий: тики в цикле + проверяющий поток"""
+
+    def __init__(self, threshold_ms: float = LOOP_STALL_THRESHOLD_MS, interval: float = WATCHDOG_INTERVAL):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self._heartbeat = time.monotonic()
+        self._loop = None
+        self._loop_thread_id = None
+        self._stopped = threading.Event()
+        self._locations = set()
+
+    async def run(self):
+        """Сторожевая задача: отмечает пульс цикла и замеряет его задержку"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        thread.start()
+        try:
+            while True:
+                scheduled = self._loop.time()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, self._loop.time() - scheduled - self.interval)
+                self._heartbeat = time.monotonic()
+                loop_lag.set(lag)
+                loop_lag_histogram.observe(lag)
+        finally:
+            self._stopped.set()
+
+    def _watch(self):
+        """Поток-наблюдатель: при устаревшем пульсе снимает стек потока цикла событий"""
+        reported = False
+        while not self._stopped.wait(self.interval):
+            stalled_for = time.monotonic() - self._heartbeat - self.interval
+            if stalled_for < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = traceback.extract_stack(frame) if frame is not None else traceback.StackSummary()
+            del frame
+            # Метрики и лог пишем из самого цикла, когда он освободится
+            self._loop.call_soon_threadsafe(self._report, stack, stalled_for)
+
+    def _report(self, stack: traceback.StackSummary, stalled_for: float):
+        """Записать блокировку в лог и метрики"""
+        location = find_blocking_location(stack)
+        if location not in self._locations:
+            if len(self._locations) >= MAX_STALL_LOCATIONS:
+                location = "other"
+            else:
+                self._locations.add(location)
+        loop_stalls.inc(location)
+        logger.warning(
+            "Цикл событий заблокирован дольше %.0f мс в %s, стек:\n%s",
+            stalled_for * 1000, location, "".join(stack.format())
+        )
@@ -0,0 +1,55 @@
+"""
+Небольшой LRU-кэш в памяти процесса с учётом попаданий и промахов в метриках
+"""
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from metrics import registry
+
+cache_requests = registry.counter(
+    "cache_requests_total", "Обращения к внутрипроцессным кэшам", ("cache", "result")
+)
+cache_size = registry.gauge(
+    "cache_entries", "Число записей во внутрипроцессных кэшах", ("cache",)
+)
+
+
+class LRUCache:
+    """Кэш на OrderedDict: при переполнении вытесняется давно не использованная запись"""
+
+    def __init__(self, name: str, maxsize: int = 1024):
+        self.name = name
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Значение по ключу или None"""
+        try:
+            value = self._data[key]
+        except KeyError:
+            cache_requests.inc(self.name, "miss")
+            return None
+        self._data.move_to_end(key)
+        cache_requests.inc(self.name, "hit")
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        """Сохранить значение"""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+        cache_size.set(len(self._data), self.name)
+
+    def pop(self, key: Hashable):
+        """Удалить значение, если есть"""
+        self._data.pop(key, None)
+        cache_size.set(len(self._data), self.name)
+
+    def clear(self):
+        """Очистить кэш"""
+        self._data.clear()
+        cache_size.set(0, self.name)
@@ -4,7 +4,7 @@ from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 
-from config import BOT_TOKEN
+from config import BOT_TOKEN, BOT_MODE, HANDLER_CONCURRENCY, METRICS_ENABLED, LOOP_WATCHDOG_ENABLED, WORKERS, ARCHIVE_AFTER_DAYS, BACKUP_INTERVAL_HOURS
 from database import db
 from handlers import router
 from group_handlers import group_router
@@ -13,6 +13,21 @@ from teacher_handlers import teacher_router
 from schedule_handlers import schedule_router
 from schedule_parser import schedule_parser
 from user_logging_middleware import UserLoggingMiddleware
+from api_metrics_middleware import TelegramApiMetricsMiddleware
+from handler_timing_middleware import UpdateTimingMiddleware, HandlerTimingMiddleware
+from sequencer_middleware import UpdateSequencerMiddleware
+from update_ledger import UpdateLedger, UpdateDeduplicationMiddleware
+from throttling_middleware import ThrottlingMiddleware
+from monitoring_server import start_monitoring_server
+from loop_watchdog import LoopWatchdog
+from webhook_server import run_webhook
+from sqlite_storage import SQLiteStorage
+from cluster import WorkerPool
+from metadata_cache import metadata
+from request_rollups import run_compactor
+from archive import run_archiver
+import maintenance
+from backup import run_backups
 
 # Настройка логирования
 logging.basicConfig(
@@ -21,12 +36,76 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Включаем обработку обновлений об изменениях участников чата
+ALLOWED_UPDATES = ['message', 'callback_query', 'my_chat_member']
+
+def create_bot() -> Bot:
+    """Создать бота с middleware сессии для метрик вызовов Bot API"""
+    bot = Bot(
+        token=BOT_TOKEN,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+    bot.session.middleware(TelegramApiMetricsMiddleware())
+    return bot
+
+def build_dispatcher(storage) -> Dispatcher:
+    """Создать диспетчер с middleware и роутерами бота"""
+    dp = Dispatcher(storage=storage)
+    
+    # Подключаем middleware для логирования пользователей
+    dp.message.middleware(UserLoggingMiddleware())
+    dp.callback_query.middleware(UserLoggingMiddleware())
+    
+    # Подключаем middleware замера времени обработки апдейтов и хендлеров
+    dp.update.outer_middleware(UpdateTimingMiddleware())
+    dp.message.middleware(HandlerTimingMiddleware())
+    dp.callback_query.middleware(HandlerTimingMiddleware())
+    dp.my_chat_member.middleware(HandlerTimingMiddleware())
+    
+    # Антифлуд: лишние нажатия и сообщения отклоняются до журнала и очереди пользователя,
+    # не дожидаясь предыдущих апдейтов этого пользователя
+    dp.update.outer_middleware(ThrottlingMiddleware())
+    
+    # Повторно доставленные апдейты (после падения или перезапуска) отбрасываются до хендлеров
+    ledger = UpdateLedger()
+    dp.update.outer_middleware(UpdateDeduplicationMiddleware(ledger))
+    dp.shutdown.register(ledger.close)
+    
+    # Апдейты одного пользователя в одном чате обрабатываются строго по очереди
+    dp.update.outer_middleware(UpdateSequencerMiddleware())
+    
+    # Подключаем роутеры в порядке приоритета
+    dp.include_router(group_router)      # Групповые чаты (высокий приоритет)
+    dp.include_router(admin_router)      # Админские функции
+    dp.include_router(teacher_router)    # Преподавательские функции
+    dp.include_router(schedule_router)   # Обработчики расписания
+    dp.include_router(router)            # Основные хендлеры (низкий приоритет)
+    return dp
+
+async def receive_updates(dp: Dispatcher, bot: Bot):
+    """Получать апдейты в выбранном режиме (polling или webhook) и передавать диспетчеру"""
+    if BOT_MODE == 'webhook':
+        await run_webhook(dp, bot, ALLOWED_UPDATES)
+    else:
+        # getUpdates не работает, пока установлен webhook
+        await bot.delete_webhook()
+        await dp.start_polling(
+            bot, 
+            allowed_updates=ALLOWED_UPDATES,
+            tasks_concurrency_limit=HANDLER_CONCURRENCY
+        )
+
 async def main():
     """Основная функция запуска бота"""
     # Инициализация базы данных
     await db.init_db()
     logger.info("База данных инициализирована")
     
+    # Реестр активных заявок в памяти (только в однопроцессном режиме)
+    if db.active.enabled:
+        await db.load_active_requests()
+        logger.info(f"Загружено активных заявок: {len(db.active)}")
+    
     # Загрузка расписания
     schedule_parser.load_schedule()
     logger.info("Расписание загружено")
@@ -38,35 +117,76 @@ async def main():
         logger.info(f"Синхронизировано {len(directions)} направлений")
     
     # Создание бота и диспетчера
-    bot = Bot(
-        token=BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-    )
+    bot = create_bot()
     
-    dp = Dispatcher()
+    storage = None
+    sweeper_task = None
+    metadata_task = None
+    rollups_task = None
+    archive_task = None
+    worker_pool = None
+    if WORKERS > 1:
+        # Главный процесс только принимает апдейты и раздаёт их процессам-обработчикам
+        worker_pool = WorkerPool(WORKERS)
+        worker_pool.start()
+        dp = worker_pool.build_ingress_dispatcher()
+    else:
+        # Состояния FSM хранятся в базе данных и переживают перезапуск
+        storage = SQLiteStorage()
+        dp = build_dispatcher(storage)
+        sweeper_task = asyncio.create_task(storage.run_sweeper())
+        # Профиль бота, чаты уведомлений и имена сотрудников: из БД сразу, из Telegram в фоне
+        await metadata.load()
+        metadata_task = asyncio.create_task(metadata.run_refresher(bot))
+        # Сжатие почасовых сводок статистики в суточные
+        rollups_task = asyncio.create_task(run_compactor(db))
+        # Перенос старых закрытых заявок в архив
+        if ARCHIVE_AFTER_DAYS > 0:
+            archive_task = asyncio.create_task(run_archiver(db))
     
-    # Подключаем middleware для логирования пользователей
-    dp.message.middleware(UserLoggingMiddleware())
-    dp.callback_query.middleware(UserLoggingMiddleware())
+    # Обслуживание БД в тихие часы (в главном процессе: его метрики отдаёт сервер мониторинга)
+    maintenance_task = asyncio.create_task(maintenance.run_scheduler(db))
+    # Резервные копии по расписанию
+    backup_task = None
+    if BACKUP_INTERVAL_HOURS > 0:
+        backup_task = asyncio.create_task(run_backups(db))
     
-    # Подключаем роутеры в порядке приоритета
-    dp.include_router(group_router)      # Групповые чаты (высокий приоритет)
-    dp.include_router(admin_router)      # Админские функции
-    dp.include_router(teacher_router)    # Преподавательские функции
-    dp.include_router(schedule_router)   # Обработчики расписания
-    dp.include_router(router)            # Основные хендлеры (низкий приоритет)
+    # Сервер мониторинга (/metrics, /healthz, /readyz)
+    monitoring_runner = None
+    if METRICS_ENABLED:
+        monitoring_runner = await start_monitoring_server()
+    
+    # Сторож цикла событий: задержка цикла и стеки блокирующего кода
+    watchdog_task = None
+    if LOOP_WATCHDOG_ENABLED:
+        watchdog_task = asyncio.create_task(LoopWatchdog().run())
     
     # Запуск бота
-    logger.info("Бот запускается...")
+    logger.info(f"Бот запускается (режим {BOT_MODE}, обработчиков: {WORKERS})...")
     try:
-        # Включаем обработку обновлений об изменениях участников чата
-        await dp.start_polling(
-            bot, 
-            allowed_updates=['message', 'callback_query', 'my_chat_member']
-        )
+        await receive_updates(dp, bot)
     except KeyboardInterrupt:
         logger.info("Бот остановлен")
     finally:
+        if sweeper_task:
+            sweeper_task.cancel()
+        if metadata_task:
+            metadata_task.cancel()
+        if rollups_task:
+            rollups_task.cancel()
+        if archive_task:
+            archive_task.cancel()
+        maintenance_task.cancel()
+        if backup_task:
+            backup_task.cancel()
+        if watchdog_task:
+            watchdog_task.cancel()
+        if monitoring_runner:
+            await monitoring_runner.cleanup()
+        if worker_pool:
+            await worker_pool.stop()
+        if storage:
+            await storage.close()
         await bot.session.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,142 @@
+"""
+Обслуживание базы данных в тихие часы.
+За один запуск: ANALYZE и PRAGMA optimize (статистика для планировщика запросов),
+incremental_vacuum (возврат свободных страниц файлу, например после переноса заявок в архив)
+и контрольная точка WAL с усечением журнала.
+
+Планировщик запускает обслуживание не чаще раза в сутки, когда время попадает в окно
+MAINTENANCE_QUIET_HOURS и обратная связь закрыта по рабочим часам из feedback_working_hours -
+сотрудники в это время не отвечают на заявки. Длительность и освобождённое место
+публикуются в метриках.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from config import MAINTENANCE_QUIET_HOURS, MAINTENANCE_CHECK_MINUTES, MAINTENANCE_ANALYSIS_LIMIT
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+maintenance_runs = registry.counter(
+    "db_maintenance_runs_total", "Запуски обслуживания базы данных"
+)
+maintenance_duration = registry.gauge(
+    "db_maintenance_duration_seconds", "Длительность последнего обслуживания БД по шагам", ("step",)
+)
+maintenance_reclaimed = registry.counter(
+    "db_maintenance_reclaimed_bytes_total", "Место на диске, освобождённое обслуживанием БД"
+)
+maintenance_last_run = registry.gauge(
+    "db_maintenance_last_run_timestamp_seconds", "Время последнего обслуживания БД (unix)"
+)
+
+# PRAGMA auto_vacuum: 2 - INCREMENTAL
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class MaintenanceReport(NamedTuple):
+    """Итог обслуживания: длительность (всего и по шагам) и освобождённое место"""
+    duration: float
+    steps: Dict[str, float]
+    reclaimed_bytes: int
+
+
+def parse_quiet_hours(value: str) -> Optional[Tuple[str, str]]:
+    """Окно 'ЧЧ:ММ-ЧЧ:ММ' в пару строк (может переходить через полночь); пустое значение - None"""
+    value = value.strip()
+    if not value:
+        return None
+    start, end = (part.strip() for part in value.split("-"))
+    for part in (start, end):
+        datetime.strptime(part, "%H:%M")
+    return start, end
+
+
+def in_window(current: str, window: Tuple[str, str]) -> bool:
+    """Попадает ли время 'ЧЧ:ММ' в окно [начало, конец)"""
+    start, end = window
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+
+def _files_size(db_path: str) -> int:
+    """Размер файла БД вместе с журналом WAL"""
+    size = 0
+    for path in (db_path, db_path + "-wal"):
+        if os.path.exists(path):
+            size += os.path.getsize(path)
+    return size
+
+
+async def run_maintenance(conn, db_path: str, analysis_limit: int = MAINTENANCE_ANALYSIS_LIMIT) -> MaintenanceReport:
+    """Обслужить базу (соединение conn вне транзакции) и записать итоги в метрики"""
+    size_before = _files_size(db_path)
+    steps = {}
+    started = time.perf_counter()
+
+    step_started = time.perf_counter()
+    # analysis_limit ограничивает число строк, просматриваемых в каждом индексе
+    await conn.execute(f'PRAGMA analysis_limit = {int(analysis_limit)}')
+    await conn.execute('ANALYZE')
+    await conn.execute('PRAGMA optimize')
+    steps["analyze"] = time.perf_counter() - step_started
+
+    step_started = time.perf_counter()
+    cursor = await conn.execute('PRAGMA auto_vacuum')
+    if (await cursor.fetchone())[0] != AUTO_VACUUM_INCREMENTAL:
+        # Режим auto_vacuum меняется только полной перестройкой файла - один раз, тоже в тихие часы
+        await conn.execute(f'PRAGMA auto_vacuum = {AUTO_VACUUM_INCREMENTAL}')
+        await conn.execute('VACUUM')
+    else:
+        # Прагма освобождает по странице на каждом шаге, поэтому результат читается до конца
+        cursor = await conn.execute('PRAGMA incremental_vacuum')
+        await cursor.fetchall()
+    steps["vacuum"] = time.perf_counter() - step_started
+
+    step_started = time.perf_counter()
+    cursor = await conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    busy, _, _ = await cursor.fetchone()
+    if busy:
+        logger.warning("Контрольная точка WAL не завершена: база занята другим соединением")
+    steps["checkpoint"] = time.perf_counter() - step_started
+
+    duration = time.perf_counter() - started
+    reclaimed = max(0, size_before - _files_size(db_path))
+
+    maintenance_runs.inc()
+    maintenance_reclaimed.inc(amount=reclaimed)
+    maintenance_last_run.set(time.time())
+    maintenance_duration.set(duration, "total")
+    for step, step_duration in steps.items():
+        maintenance_duration.set(step_duration, step)
+    return MaintenanceReport(duration, steps, reclaimed)
+
+
+async def run_scheduler(database, check_minutes: float = MAINTENANCE_CHECK_MINUTES):
+    """Фоновая задача: раз в сутки обслуживать базу в тихие часы вне рабочих часов обратной связи"""
+    window = parse_quiet_hours(MAINTENANCE_QUIET_HOURS)
+    if window is None:
+        logger.info("Обслуживание БД отключено (MAINTENANCE_QUIET_HOURS не задан)")
+        return
+    last_day = None
+    while True:
+        try:
+            now = datetime.now()
+            if now.date() != last_day and in_window(now.strftime("%H:%M"), window):
+                available, _ = await database.is_feedback_available_now()
+                if not available:
+                    report = await database.run_maintenance()
+                    last_day = now.date()
+                    logger.info(
+                        f"Обслуживание БД за {report.duration:.1f} с, освобождено {report.reclaimed_bytes} байт"
+                    )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания БД: {e}")
+        await asyncio.sleep(check_minutes * 60)
@@ -0,0 +1,183 @@
+"""
+Кэш метаданных Telegram: профиль бота, названия и типы чатов уведомлений, имена пользователей.
+Заполняется при запуске из базы данных и обновляется в фоне, поэтому хендлеры
+и рассылка уведомлений не обращаются за этими данными к Bot API.
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiogram.types import User
+
+from config import MULTI_WORKER, METADATA_REFRESH_MINUTES
+from database import db
+from lru import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Сколько запросов getChat выполнять одновременно при обновлении
+FETCH_CONCURRENCY = 5
+
+# (username, first_name)
+Profile = Tuple[Optional[str], Optional[str]]
+
+
+class MetadataCache:
+    """Метаданные бота, чатов и пользователей в памяти процесса"""
+
+    def __init__(self, database=None):
+        self.db = database or db
+        self.bot_user: Optional[User] = None
+        self._chats: Optional[List[Tuple[int, str, str]]] = None
+        self.users = LRUCache("user_profiles", maxsize=4096)
+
+    # Профиль бота
+    async def get_bot_user(self, bot) -> User:
+        """Профиль бота; getMe вызывается один раз за время работы процесса"""
+        if self.bot_user is None:
+            self.bot_user = await bot.get_me()
+        return self.bot_user
+
+    async def get_bot_username(self, bot) -> str:
+        """Username бота без @"""
+        return (await self.get_bot_user(bot)).username
+
+    # Чаты уведомлений
+    async def get_notification_chats(self) -> List[Tuple[int, str, str]]:
+        """
+        Активные чаты уведомлений (chat_id, chat_title, chat_type).
+        При WORKERS > 1 список меняют другие процессы, поэтому он читается из БД.
+        """
+        if MULTI_WORKER:
+            return await self.db.get_notification_chats()
+        if self._chats is None:
+            self._chats = list(await self.db.get_notification_chats())
+        return self._chats
+
+    def invalidate_chats(self):
+        """Сбросить список чатов после добавления, удаления или отключения чата"""
+        self._chats = None
+
+    async def get_chat_info(self, bot, chat_id: int) -> Optional[Tuple[str, str]]:
+        """Название и тип чата: из кэша, иначе через getChat; None, если чат недоступен"""
+        for cached_id, title, chat_type in await self.get_notification_chats():
+            if cached_id == chat_id:
+                return title, chat_type
+        try:
+            chat = await bot.get_chat(chat_id)
+        except Exception:
+            return None
+        if chat.first_name:
+            self.users.put(chat_id, (chat.username, chat.first_name))
+        return chat.title or f"Личный чат {chat.first_name}", chat.type
+
+    # Пользователи
+    def remember_user(self, user_id: int, username: Optional[str], first_name: Optional[str]):
+        """Запомнить имя пользователя из входящего апдейта"""
+        self.users.put(user_id, (username, first_name))
+
+    def display_name(self, user_id: int, username: Optional[str] = None) -> str:
+        """@username по свежим данным кэша, иначе по переданным, иначе ID"""
+        profile = self.users.get(user_id)
+        if profile and profile[0]:
+            username = profile[0]
+        return f"@{username}" if username else str(user_id)
+
+    async def get_user_profile(self, bot, user_id: int) -> Optional[Profile]:
+        """Имя пользователя: из кэша, иначе через getChat; None, если пользователь недоступен"""
+        profile = self.users.get(user_id)
+        if profile is None:
+            profile = (await self.fetch_users(bot, [user_id])).get(user_id)
+        return profile
+
+    async def fetch_users(self, bot, user_ids: Iterable[int]) -> Dict[int, Profile]:
+        """Запросить профили пользователей параллельно (не больше FETCH_CONCURRENCY запросов) и обновить кэш"""
+        slots = asyncio.Semaphore(FETCH_CONCURRENCY)
+        profiles: Dict[int, Profile] = {}
+
+        async def fetch(user_id: int):
+            async with slots:
+                try:
+                    chat = await bot.get_chat(user_id)
+                except Exception:
+                    return
+            profiles[user_id] = (chat.username, chat.first_name)
+            self.users.put(user_id, profiles[user_id])
+
+        await asyncio.gather(*(fetch(user_id) for user_id in set(user_ids)))
+        return profiles
+
+    async def sync_staff_profiles(self, bot=None) -> int:
+        """
+        Записать в таблицы admins и teachers актуальные имена из кэша.
+        Если передан bot, сотрудники, которых нет в кэше, запрашиваются через getChat.
+        Возвращает число обновлённых администраторов.
+        """
+        admins = await self.db.get_all_admins()
+        teachers = await self.db.get_all_teachers()
+        if bot is not None:
+            missing = [row[0] for row in list(admins) + list(teachers) if self.users.get(row[0]) is None]
+            if missing:
+                await self.fetch_users(bot, missing)
+
+        updated_admins = 0
+        for rows, update in ((admins, self.db.update_admin_info), (teachers, self.db.update_teacher_info)):
+            for user_id, username, first_name in rows:
+                profile = self.users.get(user_id)
+                if profile and profile != (username, first_name):
+                    await update(user_id, *profile)
+                    if rows is admins:
+                        updated_admins += 1
+        return updated_admins
+
+    # Загрузка и фоновое обновление
+    async def load(self):
+        """Заполнить кэш из базы данных при запуске"""
+        self._chats = None
+        for rows in (await self.db.get_all_admins(), await self.db.get_all_teachers()):
+            for user_id, username, first_name in rows:
+                # Сотрудников, добавленных без имени, обновление запросит в Telegram
+                if username or first_name:
+                    self.users.put(user_id, (username, first_name))
+        if not MULTI_WORKER:
+            await self.get_notification_chats()
+
+    async def refresh(self, bot):
+        """Обновить профиль бота, названия чатов уведомлений и имена сотрудников через Bot API"""
+        self.bot_user = await bot.get_me()
+
+        slots = asyncio.Semaphore(FETCH_CONCURRENCY)
+
+        async def refresh_chat(chat_id: int, title: str, chat_type: str):
+            async with slots:
+                try:
+                    chat = await bot.get_chat(chat_id)
+                except Exception as e:
+                    logger.warning(f"Не удалось обновить данные чата {chat_id}: {e}")
+                    return
+            new_title = chat.title or f"Личный чат {chat.first_name}"
+            if (new_title, chat.type) != (title, chat_type):
+                await self.db.update_notification_chat_info(chat_id, new_title, chat.type)
+
+        chats = await self.db.get_notification_chats()
+        await asyncio.gather(*(refresh_chat(*chat) for chat in chats))
+        self.invalidate_chats()
+
+        admins = await self.db.get_all_admins()
+        teachers = await self.db.get_all_teachers()
+        await self.fetch_users(bot, [row[0] for row in list(admins) + list(teachers)])
+        await self.sync_staff_profiles()
+
+    async def run_refresher(self, bot, interval_minutes: float = METADATA_REFRESH_MINUTES):
+        """Фоновая задача: обновлять метаданные сразу после запуска и затем периодически"""
+        while True:
+            try:
+                await self.refresh(bot)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка обновления метаданных: {e}")
+            await asyncio.sleep(interval_minutes * 60)
+
+
+metadata = MetadataCache()
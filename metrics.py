@@ -0,0 +1,340 @@
+"""
+Внутрипроцессный реестр метрик: счётчики, gauge и гистограммы с экспортом
+в текстовый формат Prometheus. Процессы-обработчики (cluster.py) присылают снимки
+своих реестров, и главный процесс отдаёт их вместе со своими метриками с меткой worker.
+"""
+import bisect
+import time
+from typing import Dict, List, Optional, Tuple
+
+# Границы корзин гистограммы задержек (в секундах), примерно логарифмическая шкала
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.35, 0.5,
+    0.75, 1.0, 1.5, 2.5, 5.0, 10.0, 30.0, 60.0
+)
+
+
+def _escape_label_value(value) -> str:
+    """Экранировать значение метки для текстового формата Prometheus"""
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    """Сформировать блок меток вида {a="1",b="2"}"""
+    parts = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _join_labels(*parts: str) -> str:
+    """Склеить непустые блоки дополнительных меток"""
+    return ",".join(part for part in parts if part)
+
+
+def _format_value(value: float) -> str:
+    """Сформировать числовое значение без лишних нулей"""
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Базовый класс метрики с набором меток"""
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def render(self, remote: List[Tuple[str, Dict]] = ()) -> List[str]:
+        """Строки экспозиции метрики; remote - пары (дополнительные метки, снимок значений)"""
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self._render_samples(self.samples()))
+        for extra, samples in remote:
+            lines.extend(self._render_samples(samples, extra))
+        return lines
+
+    def samples(self) -> Dict:
+        """Снимок значений по наборам меток (можно передать в другой процесс)"""
+        raise NotImplementedError
+
+    def _render_samples(self, samples: Dict, extra: str = "") -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1.0):
+        """Увеличить счётчик для набора меток"""
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def get(self, *label_values) -> float:
+        """Текущее значение счётчика"""
+        return self._values.get(label_values, 0.0)
+
+    def items(self):
+        """Пары (метки, значение)"""
+        return list(self._values.items())
+
+    def samples(self) -> Dict:
+        return dict(self._values)
+
+    def _render_samples(self, samples: Dict, extra: str = "") -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}"
+            for labels, value in sorted(samples.items())
+        ]
+
+
+class Gauge(_Metric):
+    """Произвольно меняющееся значение"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+
+    def set(self, value: float, *label_values):
+        """Установить значение"""
+        self._values[label_values] = value
+
+    def inc(self, *label_values, amount: float = 1.0):
+        """Увеличить значение"""
+        self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def dec(self, *label_values, amount: float = 1.0):
+        """Уменьшить значение"""
+        self._values[label_values] = self._values.get(label_values, 0.0) - amount
+
+    def get(self, *label_values) -> float:
+        """Текущее значение"""
+        return self._values.get(label_values, 0.0)
+
+    def items(self):
+        """Пары (метки, значение)"""
+        return list(self._values.items())
+
+    def samples(self) -> Dict:
+        return dict(self._values)
+
+    def _render_samples(self, samples: Dict, extra: str = "") -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels, extra)} {_format_value(value)}"
+            for labels, value in sorted(samples.items())
+        ]
+
+
+class _HistogramSeries:
+    """Данные гистограммы для одного набора меток"""
+    __slots__ = ("counts", "total", "count", "slices", "slice_ids")
+
+    def __init__(self, size: int, window_slices: int = 0):
+        self.counts = [0] * size
+        self.total = 0.0
+        self.count = 0
+        # Кольцо временных срезов для скользящего окна
+        self.slices = [[0] * size for _ in range(window_slices)]
+        self.slice_ids = [-1] * window_slices
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами и оценкой перцентилей"""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS, window_seconds: float = 0,
+                 window_slices: int = 5):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, _HistogramSeries] = {}
+        # Скользящее окно: window_seconds разбивается на window_slices срезов
+        self._window_slices = window_slices if window_seconds else 0
+        self._slice_seconds = window_seconds / window_slices if window_seconds else 0
+
+    def observe(self, value: float, *label_values):
+        """Зарегистрировать наблюдение"""
+        series = self._series.get(label_values)
+        if series is None:
+            # Последняя корзина - переполнение (+Inf)
+            series = self._series[label_values] = _HistogramSeries(len(self.buckets) + 1, self._window_slices)
+        index = bisect.bisect_left(self.buckets, value)
+        series.counts[index] += 1
+        series.total += value
+        series.count += 1
+        if self._window_slices:
+            slice_id = int(time.monotonic() // self._slice_seconds)
+            position = slice_id % self._window_slices
+            if series.slice_ids[position] != slice_id:
+                series.slice_ids[position] = slice_id
+                series.slices[position] = [0] * len(series.counts)
+            series.slices[position][index] += 1
+
+    def label_sets(self) -> List[Tuple]:
+        """Все наборы меток, по которым есть наблюдения"""
+        return sorted(self._series.keys())
+
+    def count(self, *label_values) -> int:
+        """Количество наблюдений"""
+        series = self._series.get(label_values)
+        return series.count if series else 0
+
+    def total(self, *label_values) -> float:
+        """Сумма наблюдений"""
+        series = self._series.get(label_values)
+        return series.total if series else 0.0
+
+    def percentile(self, q: float, *label_values) -> Optional[float]:
+        """
+        Оценить перцентиль q (0..1) линейной интерполяцией внутри корзины.
+        Для значений в корзине переполнения возвращается верхняя конечная граница.
+        """
+        series = self._series.get(label_values)
+        if not series or not series.count:
+            return None
+        return _bucket_percentile(self.buckets, series.counts, series.count, q)
+
+    def recent_counts(self, *label_values) -> Tuple[List[int], int]:
+        """Счётчики корзин и число наблюдений за скользящее окно"""
+        series = self._series.get(label_values)
+        if series is None or not self._window_slices:
+            return [], 0
+        oldest = int(time.monotonic() // self._slice_seconds) - self._window_slices + 1
+        counts = [0] * len(series.counts)
+        for slice_id, slice_counts in zip(series.slice_ids, series.slices):
+            if slice_id >= oldest:
+                for index, bucket_count in enumerate(slice_counts):
+                    counts[index] += bucket_count
+        return counts, sum(counts)
+
+    def recent_percentile(self, q: float, *label_values) -> Optional[float]:
+        """Оценить перцентиль q только по наблюдениям из скользящего окна"""
+        counts, total = self.recent_counts(*label_values)
+        if not total:
+            return None
+        return _bucket_percentile(self.buckets, counts, total, q)
+
+    def samples(self) -> Dict:
+        """Снимок: наборы меток -> (счётчики корзин, сумма, количество)"""
+        return {
+            labels: (list(series.counts), series.total, series.count)
+            for labels, series in self._series.items()
+        }
+
+    def _render_samples(self, samples: Dict, extra: str = "") -> List[str]:
+        lines = []
+        for labels in sorted(samples.keys()):
+            counts, total, count = samples[labels]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, labels, _join_labels(extra, f'le="{bound}"'))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, labels, _join_labels(extra, 'le="+Inf"'))
+            lines.append(f"{self.name}_bucket{le} {count}")
+            plain = _format_labels(self.labelnames, labels, extra)
+            lines.append(f"{self.name}_sum{plain} {_format_value(total)}")
+            lines.append(f"{self.name}_count{plain} {count}")
+        return lines
+
+
+def _bucket_percentile(buckets: Tuple[float, ...], counts: List[int], total: int, q: float) -> float:
+    """Перцентиль по счётчикам корзин"""
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for index, bucket_count in enumerate(counts):
+        if index >= len(buckets):
+            return buckets[-1]
+        upper = buckets[index]
+        if bucket_count and cumulative + bucket_count >= rank:
+            fraction = (rank - cumulative) / bucket_count
+            return lower + (upper - lower) * fraction
+        cumulative += bucket_count
+        lower = upper
+    return buckets[-1]
+
+
+class MetricsRegistry:
+    """Реестр всех метрик процесса"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        # Последние снимки реестров процессов-обработчиков: номер обработчика -> снимок
+        self._remote: Dict[str, Dict[str, Tuple]] = {}
+
+    def _register(self, metric_class, name: str, documentation: str, labelnames, **kwargs):
+        existing = self._metrics.get(name)
+        if existing is not None:
+            if not isinstance(existing, metric_class):
+                raise ValueError(f"Метрика {name} уже зарегистрирована с другим типом")
+            return existing
+        metric = metric_class(name, documentation, tuple(labelnames), **kwargs)
+        self._metrics[name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        """Получить или создать счётчик"""
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        """Получить или создать gauge"""
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS,
+                  window_seconds: float = 0) -> Histogram:
+        """Получить или создать гистограмму (window_seconds - длина скользящего окна)"""
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets,
+                              window_seconds=window_seconds)
+
+    def get(self, name: str) -> Optional[_Metric]:
+        """Получить метрику по имени"""
+        return self._metrics.get(name)
+
+    def snapshot(self) -> Dict[str, Tuple]:
+        """Снимок всех метрик для передачи в другой процесс: имя -> (тип, описание, метки, корзины, значения)"""
+        return {
+            name: (metric.type_name, metric.documentation, metric.labelnames,
+                   getattr(metric, "buckets", None), metric.samples())
+            for name, metric in self._metrics.items()
+        }
+
+    def merge_snapshot(self, worker: str, snapshot: Dict[str, Tuple]):
+        """Запомнить снимок процесса-обработчика; он заменяет предыдущий снимок того же процесса"""
+        self._remote[worker] = snapshot
+
+    def _metric_from_snapshot(self, name: str, entry: Tuple) -> _Metric:
+        """Пустая метрика по описанию из снимка (метрика есть только в процессах-обработчиках)"""
+        type_name, documentation, labelnames, buckets, _ = entry
+        if type_name == Histogram.type_name:
+            return Histogram(name, documentation, labelnames, buckets=buckets)
+        return (Counter if type_name == Counter.type_name else Gauge)(name, documentation, labelnames)
+
+    def render(self) -> str:
+        """Экспорт всех метрик (своих и из снимков обработчиков) в текстовом формате Prometheus"""
+        lines = []
+        names = set(self._metrics)
+        for snapshot in self._remote.values():
+            names.update(snapshot)
+        for name in sorted(names):
+            remote = [
+                (f'worker="{_escape_label_value(worker)}"', snapshot[name])
+                for worker, snapshot in sorted(self._remote.items()) if name in snapshot
+            ]
+            metric = self._metrics.get(name) or self._metric_from_snapshot(name, remote[0][1])
+            lines.extend(metric.render([(extra, entry[4]) for extra, entry in remote]))
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный реестр метрик процесса
+registry = MetricsRegistry()
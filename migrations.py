@@ -0,0 +1,112 @@
+"""
+Миграции схемы базы данных.
+Номер последней применённой миграции хранится в PRAGMA user_version; init_db применяет
+по порядку все миграции с большим номером. Новую миграцию добавляют в конец MIGRATIONS
+и никогда не меняют уже выпущенные.
+"""
+import logging
+import sqlite3
+
+import request_counters
+import request_rollups
+import response_times
+
+logger = logging.getLogger(__name__)
+
+
+async def _create_feedback_fts(conn):
+    """
+    Полнотекстовый индекс FTS5 по тексту заявки и ответа (внешнее содержимое - feedback_messages).
+    Триггеры держат индекс в актуальном состоянии; существующие заявки индексируются сразу.
+    Если SQLite собран без FTS5, поиск работает через LIKE (см. Database.search_requests).
+    """
+    try:
+        await conn.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS feedback_fts USING fts5(
+                message_text,
+                answer_text,
+                content='feedback_messages',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+        ''')
+    except sqlite3.OperationalError as e:
+        logger.warning(f"FTS5 недоступен, полнотекстовый поиск будет работать через LIKE: {e}")
+        return
+
+    await conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS feedback_fts_insert AFTER INSERT ON feedback_messages BEGIN
+            INSERT INTO feedback_fts(rowid, message_text, answer_text)
+            VALUES (new.id, new.message_text, new.answer_text);
+        END
+    ''')
+    await conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS feedback_fts_delete AFTER DELETE ON feedback_messages BEGIN
+            INSERT INTO feedback_fts(feedback_fts, rowid, message_text, answer_text)
+            VALUES ('delete', old.id, old.message_text, old.answer_text);
+        END
+    ''')
+    await conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS feedback_fts_update AFTER UPDATE OF message_text, answer_text ON feedback_messages BEGIN
+            INSERT INTO feedback_fts(feedback_fts, rowid, message_text, answer_text)
+            VALUES ('delete', old.id, old.message_text, old.answer_text);
+            INSERT INTO feedback_fts(rowid, message_text, answer_text)
+            VALUES (new.id, new.message_text, new.answer_text);
+        END
+    ''')
+    await conn.execute("INSERT INTO feedback_fts(feedback_fts) VALUES ('rebuild')")
+
+
+async def _notification_key_with_kind(conn):
+    """
+    Уведомления одной заявки в одном чате разного типа (staff и teacher - например, если
+    преподаватель сам администратор) хранятся отдельно: тип входит в уникальный ключ
+    """
+    await conn.execute('''
+        CREATE TABLE notification_messages_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            feedback_message_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            kind TEXT DEFAULT 'staff',
+            FOREIGN KEY (feedback_message_id) REFERENCES feedback_messages (id),
+            UNIQUE(feedback_message_id, chat_id, kind)
+        )
+    ''')
+    await conn.execute('''
+        INSERT INTO notification_messages_new (id, feedback_message_id, chat_id, message_id, created_at, kind)
+        SELECT id, feedback_message_id, chat_id, message_id, created_at, kind FROM notification_messages
+    ''')
+    await conn.execute('DROP TABLE notification_messages')
+    await conn.execute('ALTER TABLE notification_messages_new RENAME TO notification_messages')
+    await conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_notification_messages_chat_message
+        ON notification_messages(chat_id, message_id)
+    ''')
+
+
+# (номер, описание, функция миграции)
+MIGRATIONS = [
+    (1, "полнотекстовый поиск по заявкам", _create_feedback_fts),
+    (2, "счётчики заявок для статистики", request_counters.create),
+    (3, "почасовые и посуточные сводки заявок", request_rollups.create),
+    (4, "гистограммы времени ответа на заявки", response_times.create),
+    (5, "учёт заявок, перенесённых в архив, в счётчиках", request_counters.upgrade_for_archive),
+    (6, "тип уведомления в ключе notification_messages", _notification_key_with_kind),
+]
+
+
+async def apply_migrations(conn) -> int:
+    """Применить недостающие миграции; возвращает итоговую версию схемы"""
+    cursor = await conn.execute('PRAGMA user_version')
+    version = (await cursor.fetchone())[0]
+    for number, description, migrate in MIGRATIONS:
+        if number <= version:
+            continue
+        logger.info(f"Миграция БД #{number}: {description}")
+        await migrate(conn)
+        await conn.execute(f'PRAGMA user_version = {number}')
+        await conn.commit()
+        version = number
+    return version
@@ -0,0 +1,107 @@
+"""
+HTTP-сервер мониторинга: метрики в формате Prometheus (/metrics),
+проверка живости (/healthz) и готовности (/readyz) для оркестратора
+"""
+import asyncio
+import logging
+import time
+from aiohttp import web
+
+from config import BOT_MODE, METRICS_HOST, METRICS_PORT, POLLING_STALE_SECONDS
+from database import db
+from metrics import registry
+from api_metrics_middleware import last_success_at
+import webhook_server
+
+logger = logging.getLogger(__name__)
+
+# Таймаут проверки доступности базы данных, секунды
+DB_CHECK_TIMEOUT = 2.0
+
+_started_at = time.monotonic()
+
+
+def get_polling_status():
+    """
+    Состояние polling: (запущен ли, жив ли, секунд с последнего успешного getUpdates).
+    До первого getUpdates polling считается живым в течение POLLING_STALE_SECONDS после старта.
+    """
+    now = time.monotonic()
+    last = last_success_at.get("getUpdates")
+    if last is None:
+        return False, now - _started_at <= POLLING_STALE_SECONDS, None
+    age = now - last
+    return True, age <= POLLING_STALE_SECONDS, age
+
+
+async def check_database() -> bool:
+    """Проверить, что база данных отвечает на простой запрос"""
+    async def ping():
+        async with db.connect() as conn:
+            async with conn.execute("SELECT 1") as cursor:
+                await cursor.fetchone()
+
+    try:
+        await asyncio.wait_for(ping(), timeout=DB_CHECK_TIMEOUT)
+        return True
+    except Exception as e:
+        logger.warning(f"Проверка базы данных не прошла: {e}")
+        return False
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """Метрики в текстовом формате Prometheus"""
+    return web.Response(
+        text=registry.render(),
+        content_type="text/plain",
+        headers={"X-Content-Type-Options": "nosniff"}
+    )
+
+
+async def healthz_handler(request: web.Request) -> web.Response:
+    """Живость: процесс отвечает, polling не завис"""
+    if BOT_MODE == 'webhook':
+        return web.json_response({"status": "ok", "webhook": webhook_server.webhook_active})
+    started, alive, age = get_polling_status()
+    body = {
+        "status": "ok" if alive else "stale",
+        "polling_started": started,
+        "seconds_since_get_updates": round(age, 1) if age is not None else None,
+    }
+    return web.json_response(body, status=200 if alive else 503)
+
+
+async def readyz_handler(request: web.Request) -> web.Response:
+    """Готовность: база данных доступна и бот получает апдейты (polling или webhook)"""
+    database_ok = await check_database()
+    if BOT_MODE == 'webhook':
+        receiving = webhook_server.webhook_active
+    else:
+        started, alive, _ = get_polling_status()
+        receiving = started and alive
+    ready = database_ok and receiving
+    body = {
+        "status": "ready" if ready else "not_ready",
+        "database": database_ok,
+        BOT_MODE: receiving,
+    }
+    return web.json_response(body, status=200 if ready else 503)
+
+
+def create_monitoring_app() -> web.Application:
+    """Создать приложение aiohttp с эндпоинтами мониторинга"""
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    app.router.add_get("/healthz", healthz_handler)
+    app.router.add_get("/readyz", readyz_handler)
+    return app
+
+
+async def start_monitoring_server(host: str = METRICS_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    """Запустить сервер мониторинга; вернуть runner для последующей остановки"""
+    runner = web.AppRunner(create_monitoring_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Сервер мониторинга запущен на http://{host}:{port}")
+    return runner
@@ -0,0 +1,125 @@
+"""
+Постраничный вывод заявок по ключу (created_at, id).
+Курсор - ключ крайней заявки страницы; следующая страница читается одним диапазонным
+сканированием индекса от курсора, поэтому её стоимость не зависит от глубины истории.
+В callback_data курсор кодируется компактно (base36), чтобы уложиться в 64 байта.
+"""
+import struct
+from datetime import datetime, timezone
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+# Направления листания
+OLDER = "o"
+NEWER = "n"
+
+# Формат CURRENT_TIMESTAMP SQLite
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+Cursor = Tuple[str, int]  # (created_at, id)
+
+
+class Page(NamedTuple):
+    """Страница заявок (новые первыми) и курсоры соседних страниц"""
+    rows: List[Any]
+    newer: Optional[Cursor]  # курсор для перехода к более новым заявкам
+    older: Optional[Cursor]  # курсор для перехода к более старым заявкам
+
+
+def _base36(value: int) -> str:
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    text = ""
+    while True:
+        value, rest = divmod(value, 36)
+        text = digits[rest] + text
+        if not value:
+            return text
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    """(created_at, id) -> строка для callback_data"""
+    created_at, request_id = cursor
+    moment = datetime.strptime(created_at[:19], TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+    return f"{_base36(int(moment.timestamp()))}.{_base36(request_id)}"
+
+
+def decode_cursor(text: str) -> Optional[Cursor]:
+    """Строка из callback_data -> (created_at, id); None, если строка повреждена"""
+    try:
+        timestamp, request_id = text.split(".")
+        moment = datetime.fromtimestamp(int(timestamp, 36), tz=timezone.utc)
+        return moment.strftime(TIMESTAMP_FORMAT), int(request_id, 36)
+    except (ValueError, OverflowError):
+        return None
+
+
+def encode_rank_cursor(cursor: Tuple[float, int]) -> str:
+    """(ранг, id) -> строка для callback_data; ранг кодируется точно (8 байт double в hex)"""
+    score, request_id = cursor
+    return f"{struct.pack('>d', score).hex()}.{_base36(request_id)}"
+
+
+def decode_rank_cursor(text: str) -> Optional[Tuple[float, int]]:
+    """Строка из callback_data -> (ранг, id); None, если строка повреждена"""
+    try:
+        score, request_id = text.split(".")
+        return struct.unpack('>d', bytes.fromhex(score))[0], int(request_id, 36)
+    except (ValueError, struct.error):
+        return None
+
+
+def build_page(rows: Sequence[Any], limit: int, cursor: Optional[Cursor], direction: str,
+               key_index: Tuple[int, int]) -> Page:
+    """
+    Собрать страницу из limit + 1 строк, прочитанных от курсора.
+    Для OLDER строки идут от новых к старым, для NEWER - от старых к новым.
+    key_index - позиции created_at и id в строке.
+    """
+    if cursor is None:
+        direction = OLDER
+    rows = list(rows)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == NEWER:
+        rows.reverse()
+    if not rows:
+        return Page([], None, None)
+
+    created_at_pos, id_pos = key_index
+    first = (rows[0][created_at_pos], rows[0][id_pos])
+    last = (rows[-1][created_at_pos], rows[-1][id_pos])
+    if direction == NEWER:
+        return Page(rows, first if has_more else None, last)
+    return Page(rows, first if cursor else None, last if has_more else None)
+
+
+def page_in_memory(rows: Sequence[Any], limit: int, cursor: Optional[Cursor], direction: str,
+                   key_index: Tuple[int, int]) -> Page:
+    """То же листание для уже отсортированного (новые первыми) списка в памяти"""
+    created_at_pos, id_pos = key_index
+
+    def key(row):
+        return row[created_at_pos], row[id_pos]
+
+    if cursor is None:
+        direction = OLDER
+        selected = list(rows[:limit + 1])
+    elif direction == NEWER:
+        selected = [row for row in reversed(rows) if key(row) > tuple(cursor)][:limit + 1]
+    else:
+        selected = [row for row in rows if key(row) < tuple(cursor)][:limit + 1]
+    return build_page(selected, limit, cursor, direction, key_index)
+
+
+def page_callback_data(prefix: str, direction: str, cursor: Cursor, encode=encode_cursor) -> str:
+    """callback_data кнопки листания: префикс:направление:курсор"""
+    return f"{prefix}:{direction}:{encode(cursor)}"
+
+
+def parse_page_callback_data(data: str, prefix: str, decode=decode_cursor) -> Tuple[Optional[Cursor], str]:
+    """Курсор и направление из callback_data; без курсора - первая страница"""
+    rest = data[len(prefix):].lstrip(":")
+    direction, _, encoded = rest.partition(":")
+    cursor = decode(encoded) if encoded else None
+    if cursor is None or direction not in (OLDER, NEWER):
+        return None, OLDER
+    return cursor, direction
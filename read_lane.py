@@ -0,0 +1,40 @@
+"""
+Полоса чтения: отдельные соединения только для чтения для статистики и отчётов.
+Соединение открывается с mode=ro и PRAGMA query_only, поэтому отчёт не может ничего записать
+и в режиме WAL не мешает записи заявок. Одновременно работает не больше READ_LANE_CONCURRENCY
+таких соединений (остальные отчёты ждут своей очереди, а не занимают диск и процессор),
+а обработчик прогресса SQLite прерывает запрос, выполняющийся дольше READ_QUERY_TIMEOUT секунд
+(запрос завершается с sqlite3.OperationalError: interrupted).
+"""
+import asyncio
+import pathlib
+import sqlite3
+import time
+from typing import Callable, Optional
+
+from config import READ_LANE_CONCURRENCY
+
+# Через сколько инструкций виртуальной машины SQLite проверять время запроса
+PROGRESS_STEPS = 1000
+
+# Места в полосе чтения (общие для соединений Database.read, аналитики и выгрузок)
+slots = asyncio.Semaphore(READ_LANE_CONCURRENCY)
+
+
+def deadline_after(timeout: float) -> Callable[[], bool]:
+    """Проверка для обработчика прогресса: истекли ли timeout секунд с этого момента"""
+    deadline = time.monotonic() + timeout
+    return lambda: time.monotonic() > deadline
+
+
+def open_readonly(db_path: str, expired: Optional[Callable[[], bool]] = None) -> sqlite3.Connection:
+    """
+    Открыть базу только для чтения. expired - функция без аргументов; когда она возвращает
+    истину, выполняющийся запрос прерывается
+    """
+    uri = pathlib.Path(db_path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute('PRAGMA query_only = 1')
+    if expired is not None:
+        conn.set_progress_handler(expired, PROGRESS_STEPS)
+    return conn
@@ -0,0 +1,245 @@
+"""
+Материализованные счётчики заявок для экранов статистики.
+Таблица request_counters хранит итоги по статусам, направлениям и ответившим сотрудникам;
+триггеры на feedback_messages меняют её в той же транзакции, что и саму заявку
+(создание, ответ, закрытие, возврат в активные, удаление), поэтому экраны статистики
+читают готовые числа вместо COUNT по всей таблице. rebuild() пересчитывает их с нуля.
+
+Заявки, перенесённые в архив (archive.py), продолжают учитываться: архиватор добавляет
+их вклад обратно в счётчики и в request_counters_archived, откуда его берёт rebuild(),
+а авторов запоминает в archived_authors, чтобы не считать их повторно.
+
+Измерения (dimension, dim_key) и метрики:
+    all, 0              total, active, closed, answered, users (уникальные авторы заявок)
+    direction, id (0 - без направления)   total, active, closed
+    responder, user_id  active, closed, answered (заявки, закрытые сотрудником / с его ответом)
+"""
+from collections import defaultdict
+from typing import Dict, Tuple
+
+CREATE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS request_counters (
+        dimension TEXT NOT NULL,
+        dim_key INTEGER NOT NULL,
+        metric TEXT NOT NULL,
+        value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, dim_key, metric)
+    ) WITHOUT ROWID
+'''
+
+CREATE_ARCHIVE_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS request_counters_archived (
+        dimension TEXT NOT NULL,
+        dim_key INTEGER NOT NULL,
+        metric TEXT NOT NULL,
+        value INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, dim_key, metric)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS archived_authors (
+        user_id INTEGER PRIMARY KEY
+    )
+    ''',
+]
+
+_UPSERT = '''
+    INSERT INTO request_counters (dimension, dim_key, metric, value)
+    SELECT dimension, dim_key, metric, value FROM ({rows}) WHERE true
+    ON CONFLICT (dimension, dim_key, metric) DO UPDATE SET value = value + excluded.value;
+'''
+
+
+def _contribution(row: str, sign: int) -> str:
+    """Вклад одной строки feedback_messages (new или old) в счётчики со знаком sign"""
+    status = f"IFNULL({row}.status, 'active')"
+    direction = f"IFNULL({row}.direction_id, 0)"
+    rows = f'''
+        SELECT 'all' AS dimension, 0 AS dim_key, 'total' AS metric, {sign} AS value
+        UNION ALL SELECT 'all', 0, {status}, {sign}
+        UNION ALL SELECT 'all', 0, 'answered', {sign} WHERE {row}.is_answered
+        UNION ALL SELECT 'direction', {direction}, 'total', {sign}
+        UNION ALL SELECT 'direction', {direction}, {status}, {sign}
+        UNION ALL SELECT 'responder', {row}.answered_by, {status}, {sign} WHERE {row}.answered_by IS NOT NULL
+        UNION ALL SELECT 'responder', {row}.answered_by, 'answered', {sign}
+            WHERE {row}.answered_by IS NOT NULL AND {row}.is_answered
+    '''
+    return _UPSERT.format(rows=rows)
+
+
+def _first_request_of_user(row: str, sign: int) -> str:
+    """Счётчик уникальных авторов: меняется на первой (или последней удалённой) заявке пользователя"""
+    rows = f'''
+        SELECT 'all' AS dimension, 0 AS dim_key, 'users' AS metric, {sign} AS value
+        WHERE NOT EXISTS (SELECT 1 FROM feedback_messages WHERE user_id = {row}.user_id AND id <> {row}.id)
+    '''
+    return _UPSERT.format(rows=rows)
+
+
+def _first_request_of_new_author(row: str, sign: int) -> str:
+    """Как _first_request_of_user, но авторы заявок из архива (archived_authors) уже учтены"""
+    rows = f'''
+        SELECT 'all' AS dimension, 0 AS dim_key, 'users' AS metric, {sign} AS value
+        WHERE NOT EXISTS (SELECT 1 FROM feedback_messages WHERE user_id = {row}.user_id AND id <> {row}.id)
+          AND NOT EXISTS (SELECT 1 FROM archived_authors WHERE user_id = {row}.user_id)
+    '''
+    return _UPSERT.format(rows=rows)
+
+
+TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS request_counters_insert AFTER INSERT ON feedback_messages BEGIN
+        {_contribution("new", 1)}
+        {_first_request_of_user("new", 1)}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS request_counters_update
+    AFTER UPDATE OF status, direction_id, answered_by, is_answered ON feedback_messages
+    WHEN old.status IS NOT new.status OR old.direction_id IS NOT new.direction_id
+      OR old.answered_by IS NOT new.answered_by OR old.is_answered IS NOT new.is_answered
+    BEGIN
+        {_contribution("old", -1)}
+        {_contribution("new", 1)}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS request_counters_delete AFTER DELETE ON feedback_messages BEGIN
+        {_contribution("old", -1)}
+        {_first_request_of_user("old", -1)}
+    END
+    ''',
+]
+
+_REBUILD = [
+    "DELETE FROM request_counters",
+    '''INSERT INTO request_counters (dimension, dim_key, metric, value)
+       SELECT 'all', 0, 'total', COUNT(*) FROM feedback_messages''',
+    '''INSERT INTO request_counters (dimension, dim_key, metric, value)
+       SELECT 'all', 0, 'users', COUNT(DISTINCT user_id) FROM feedback_messages''',
+    '''INSERT INTO request_counters (dimension, dim_key, metric, value)
+       SELECT 'all', 0, 'answered', COUNT(*) FROM feedback_messages WHERE is_answered''',
+    '''INSERT INTO request_counters (dimension, dim_key, metric, value)
+       SELECT 'all', 0, IFNULL(status, 'active'), COUNT(*) FROM feedback_messages GROUP BY 3''',
+    '''INSERT INTO request_counters (dimension, dim_key, metric, value)
+       SELECT 'direction', IFNULL(direction_id, 0), 'total', COUNT(*) FROM feedback_messages GROUP BY 2''',
+    '''INSERT INTO request_counters (dimension, dim_key, metric, value)
+       SELECT 'direction', IFNULL(direction_id, 0), IFNULL(status, 'active'), COUNT(*)
+       FROM feedback_messages GROUP BY 2, 3''',
+    '''INSERT INTO request_counters (dimension, dim_key, metric, value)
+       SELECT 'responder', answered_by, IFNULL(status, 'active'), COUNT(*)
+       FROM feedback_messages WHERE answered_by IS NOT NULL GROUP BY 2, 3''',
+    '''INSERT INTO request_counters (dimension, dim_key, metric, value)
+       SELECT 'responder', answered_by, 'answered', COUNT(*)
+       FROM feedback_messages WHERE answered_by IS NOT NULL AND is_answered GROUP BY 2''',
+]
+
+# Триггеры создания и удаления, учитывающие archived_authors; заменяют свои версии
+# из TRIGGERS в миграции архива (upgrade_for_archive)
+ARCHIVE_TRIGGERS = {
+    "request_counters_insert": f'''
+    CREATE TRIGGER request_counters_insert AFTER INSERT ON feedback_messages BEGIN
+        {_contribution("new", 1)}
+        {_first_request_of_new_author("new", 1)}
+    END
+    ''',
+    "request_counters_delete": f'''
+    CREATE TRIGGER request_counters_delete AFTER DELETE ON feedback_messages BEGIN
+        {_contribution("old", -1)}
+        {_first_request_of_new_author("old", -1)}
+    END
+    ''',
+}
+
+
+def _aggregates(where: str):
+    """Запросы (dimension, dim_key, metric, value) по заявкам, подходящим под условие where (кроме users)"""
+    return [
+        f"SELECT 'all', 0, 'total', COUNT(*) FROM feedback_messages WHERE {where}",
+        f"SELECT 'all', 0, 'answered', COUNT(*) FROM feedback_messages WHERE {where} AND is_answered",
+        f"SELECT 'all', 0, IFNULL(status, 'active'), COUNT(*) FROM feedback_messages WHERE {where} GROUP BY 3",
+        f"""SELECT 'direction', IFNULL(direction_id, 0), 'total', COUNT(*)
+            FROM feedback_messages WHERE {where} GROUP BY 2""",
+        f"""SELECT 'direction', IFNULL(direction_id, 0), IFNULL(status, 'active'), COUNT(*)
+            FROM feedback_messages WHERE {where} GROUP BY 2, 3""",
+        f"""SELECT 'responder', answered_by, IFNULL(status, 'active'), COUNT(*)
+            FROM feedback_messages WHERE {where} AND answered_by IS NOT NULL GROUP BY 2, 3""",
+        f"""SELECT 'responder', answered_by, 'answered', COUNT(*)
+            FROM feedback_messages WHERE {where} AND answered_by IS NOT NULL AND is_answered GROUP BY 2""",
+    ]
+
+
+def _add_into(table: str, select: str) -> str:
+    return f'''
+        INSERT INTO {table} (dimension, dim_key, metric, value) {select}
+        ON CONFLICT (dimension, dim_key, metric) DO UPDATE SET value = value + excluded.value
+    '''
+
+
+async def create(conn):
+    """Создать таблицу, триггеры и заполнить счётчики (миграция)"""
+    await conn.execute(CREATE_TABLE)
+    for trigger in TRIGGERS:
+        await conn.execute(trigger)
+    # Пересчёт в том виде, в каком миграция выпущена (до появления архива)
+    for statement in _REBUILD:
+        await conn.execute(statement)
+
+
+async def upgrade_for_archive(conn):
+    """Таблицы учёта архива и заменяющие триггеры создания и удаления (миграция)"""
+    for statement in CREATE_ARCHIVE_TABLES:
+        await conn.execute(statement)
+    for name, trigger in ARCHIVE_TRIGGERS.items():
+        await conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+        await conn.execute(trigger)
+
+
+async def rebuild(conn):
+    """Пересчитать счётчики по feedback_messages и вкладу архива (вызывающий делает commit)"""
+    await conn.execute("DELETE FROM request_counters")
+    for select in _aggregates("true"):
+        await conn.execute(_add_into("request_counters", select))
+    await conn.execute(_add_into(
+        "request_counters",
+        "SELECT dimension, dim_key, metric, value FROM request_counters_archived WHERE metric <> 'users'",
+    ))
+    await conn.execute('''
+        INSERT INTO request_counters (dimension, dim_key, metric, value)
+        SELECT 'all', 0, 'users', COUNT(*) FROM (
+            SELECT user_id FROM feedback_messages UNION SELECT user_id FROM archived_authors
+        )
+    ''')
+
+
+async def keep_archived(conn, where: str):
+    """
+    Перед удалением заявок where при переносе в архив: запомнить авторов и вклад заявок
+    в request_counters_archived и заранее вернуть в счётчики то, что вычтет триггер удаления
+    """
+    await conn.execute(f'INSERT OR IGNORE INTO archived_authors (user_id) SELECT user_id FROM feedback_messages WHERE {where}')
+    for select in _aggregates(where):
+        await conn.execute(_add_into("request_counters_archived", select))
+        await conn.execute(_add_into("request_counters", select))
+
+
+class RequestCounters:
+    """Снимок счётчиков: counters.get('direction', 5, 'active')"""
+
+    def __init__(self, rows):
+        self._values: Dict[Tuple[str, int, str], int] = defaultdict(int)
+        for dimension, dim_key, metric, value in rows:
+            self._values[(dimension, dim_key, metric)] = value
+
+    def get(self, dimension: str, dim_key: int, metric: str) -> int:
+        return self._values.get((dimension, dim_key, metric), 0)
+
+    def total(self, metric: str) -> int:
+        return self.get('all', 0, metric)
+
+    def direction(self, direction_id: int, metric: str) -> int:
+        return self.get('direction', direction_id, metric)
+
+    def responder(self, user_id: int, metric: str) -> int:
+        return self.get('responder', user_id, metric)
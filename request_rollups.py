@@ -0,0 +1,180 @@
+"""
+Почасовые и посуточные сводки заявок для статистики за период.
+Триггеры на feedback_messages добавляют событие в часовую корзину в той же транзакции,
+что и саму заявку: создание - по created_at, закрытие (и его отмена при возврате
+в активные) - по answered_at. Фоновое сжатие сворачивает часовые корзины старше
+ROLLUP_HOURLY_RETENTION_HOURS в суточные, поэтому каждое событие лежит ровно в одной
+таблице, и счётчик за период - это сумма по нескольким корзинам обеих таблиц.
+
+Уникальных пользователей суммировать по корзинам нельзя, поэтому для них ведётся
+множество (день, пользователь): за период считается COUNT(DISTINCT) по паре десятков
+строк на день вместо просмотра всех заявок.
+
+Удаление заявки сводки не меняет: это история событий (заявка была создана и закрыта),
+она должна переживать очистку и перенос заявок в архив.
+Точность - одна корзина: в пределах часовых корзин - час, дальше - сутки.
+"""
+import asyncio
+import logging
+
+from config import ROLLUP_COMPACT_MINUTES, ROLLUP_HOURLY_RETENTION_HOURS
+
+logger = logging.getLogger(__name__)
+
+# Сколько дней хранить множество (день, пользователь) - с запасом для окна «за месяц»
+USERS_RETENTION_DAYS = 400
+
+CREATE_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS request_rollups_hourly (
+        bucket TEXT NOT NULL,
+        direction_id INTEGER NOT NULL,
+        created INTEGER NOT NULL DEFAULT 0,
+        closed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (bucket, direction_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS request_rollups_daily (
+        day TEXT NOT NULL,
+        direction_id INTEGER NOT NULL,
+        created INTEGER NOT NULL DEFAULT 0,
+        closed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, direction_id)
+    ) WITHOUT ROWID
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS request_rollup_users (
+        day TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        PRIMARY KEY (day, user_id)
+    ) WITHOUT ROWID
+    ''',
+]
+
+HOUR_FORMAT = '%Y-%m-%d %H:00:00'
+
+
+def _add_event(moment: str, direction: str, metric: str, value: int) -> str:
+    """Прибавить value к метрике часовой корзины момента moment"""
+    return f'''
+        INSERT INTO request_rollups_hourly (bucket, direction_id, {metric})
+        VALUES (strftime('{HOUR_FORMAT}', {moment}), IFNULL({direction}, 0), {value})
+        ON CONFLICT (bucket, direction_id) DO UPDATE SET {metric} = {metric} + excluded.{metric};
+    '''
+
+
+TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS request_rollups_insert AFTER INSERT ON feedback_messages BEGIN
+        {_add_event("IFNULL(new.created_at, CURRENT_TIMESTAMP)", "new.direction_id", "created", 1)}
+        INSERT OR IGNORE INTO request_rollup_users (day, user_id)
+        VALUES (date(IFNULL(new.created_at, CURRENT_TIMESTAMP)), new.user_id);
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS request_rollups_close AFTER UPDATE OF status ON feedback_messages
+    WHEN new.status = 'closed' AND old.status IS NOT 'closed'
+    BEGIN
+        {_add_event("IFNULL(new.answered_at, CURRENT_TIMESTAMP)", "new.direction_id", "closed", 1)}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS request_rollups_reopen AFTER UPDATE OF status ON feedback_messages
+    WHEN old.status = 'closed' AND new.status IS NOT 'closed'
+    BEGIN
+        {_add_event("IFNULL(old.answered_at, CURRENT_TIMESTAMP)", "old.direction_id", "closed", -1)}
+    END
+    ''',
+]
+
+def _rebuild_statements(source: str):
+    """Пересчёт сводок по строкам заявок source (таблица или подзапрос с колонками feedback_messages)"""
+    return [
+        "DELETE FROM request_rollups_hourly",
+        "DELETE FROM request_rollups_daily",
+        "DELETE FROM request_rollup_users",
+        f'''INSERT INTO request_rollups_hourly (bucket, direction_id, created)
+            SELECT strftime('{HOUR_FORMAT}', created_at), IFNULL(direction_id, 0), COUNT(*)
+            FROM {source} GROUP BY 1, 2''',
+        f'''INSERT INTO request_rollups_hourly (bucket, direction_id, closed)
+            SELECT strftime('{HOUR_FORMAT}', answered_at), IFNULL(direction_id, 0), COUNT(*)
+            FROM {source} WHERE status = 'closed' AND answered_at IS NOT NULL GROUP BY 1, 2
+            ON CONFLICT (bucket, direction_id) DO UPDATE SET closed = closed + excluded.closed''',
+        f'''INSERT OR IGNORE INTO request_rollup_users (day, user_id)
+            SELECT DISTINCT date(created_at), user_id FROM {source}''',
+    ]
+
+
+async def create(conn):
+    """Создать таблицы, триггеры и заполнить сводки по существующим заявкам (миграция)"""
+    for statement in CREATE_TABLES:
+        await conn.execute(statement)
+    for trigger in TRIGGERS:
+        await conn.execute(trigger)
+    await rebuild(conn)
+
+
+async def rebuild(conn, source: str = 'feedback_messages'):
+    """
+    Пересчитать сводки по заявкам и сразу сжать старые корзины (вызывающий делает commit).
+    source - источник заявок; с подключённым архивом - archive.feedback_source()
+    """
+    for statement in _rebuild_statements(source):
+        await conn.execute(statement)
+    await compact(conn)
+
+
+async def compact(conn, retention_hours: float = ROLLUP_HOURLY_RETENTION_HOURS) -> int:
+    """
+    Свернуть часовые корзины старше retention_hours в суточные (целыми сутками)
+    и удалить устаревшие строки уникальных пользователей. Возвращает число свёрнутых корзин.
+    """
+    cursor = await conn.execute("SELECT date('now', ?)", (f'-{retention_hours} hours',))
+    cutoff = (await cursor.fetchone())[0]
+    await conn.execute('''
+        INSERT INTO request_rollups_daily (day, direction_id, created, closed)
+        SELECT date(bucket), direction_id, SUM(created), SUM(closed)
+        FROM request_rollups_hourly WHERE bucket < ? GROUP BY 1, 2
+        ON CONFLICT (day, direction_id) DO UPDATE SET
+            created = created + excluded.created, closed = closed + excluded.closed
+    ''', (cutoff,))
+    cursor = await conn.execute('DELETE FROM request_rollups_hourly WHERE bucket < ?', (cutoff,))
+    folded = cursor.rowcount
+    await conn.execute(
+        "DELETE FROM request_rollup_users WHERE day < date('now', ?)", (f'-{USERS_RETENTION_DAYS} days',)
+    )
+    return folded
+
+
+def window_query(metric: str, direction_count: int = None) -> str:
+    """
+    Запрос суммы метрики за период. Параметры: модификатор начала периода и id направлений
+    (если direction_count задан) - сначала для часовых, затем для суточных корзин.
+    """
+    if metric not in ('created', 'closed'):
+        raise ValueError(f"Неизвестная метрика {metric}")
+    directions = ''
+    if direction_count is not None:
+        directions = f" AND direction_id IN ({','.join('?' for _ in range(direction_count))})"
+    return f'''
+        SELECT
+            (SELECT IFNULL(SUM({metric}), 0) FROM request_rollups_hourly
+             WHERE bucket >= strftime('{HOUR_FORMAT}', 'now', ?){directions})
+          + (SELECT IFNULL(SUM({metric}), 0) FROM request_rollups_daily
+             WHERE day >= date('now', ?){directions})
+    '''
+
+
+async def run_compactor(database, interval_minutes: float = ROLLUP_COMPACT_MINUTES):
+    """Фоновая задача: периодически сворачивать часовые корзины в суточные"""
+    while True:
+        try:
+            folded = await database.compact_request_rollups()
+            if folded:
+                logger.info(f"Сводки заявок: свёрнуто часовых корзин - {folded}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка сжатия сводок заявок: {e}")
+        await asyncio.sleep(interval_minutes * 60)
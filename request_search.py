@@ -0,0 +1,77 @@
+"""
+Разбор запроса полнотекстового поиска заявок.
+Слова запроса ищутся в тексте заявки и ответа (все слова, по началу слова),
+фильтры задаются в том же сообщении:
+    статус:активные / статус:закрытые
+    с:01.09.2024  по:31.12.2024
+    направление:робото  (часть названия направления)
+"""
+import re
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+STATUS_ALIASES = {
+    "активные": "active", "активная": "active", "active": "active",
+    "закрытые": "closed", "закрытая": "closed", "closed": "closed",
+}
+
+# Ключ фильтра - отдельное слово: «вопрос:xyz» не должно читаться как фильтр «с:»
+_FILTER_RE = re.compile(r'(?<!\w)(статус|с|по|направление):(\S+)', re.IGNORECASE)
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# Маркеры совпадений во фрагменте: заменяются на теги после экранирования HTML
+MATCH_START = "\x02"
+MATCH_END = "\x03"
+
+
+class SearchQueryError(ValueError):
+    """Запрос поиска не удалось разобрать"""
+
+
+def _parse_date(value: str) -> str:
+    try:
+        return datetime.strptime(value, "%d.%m.%Y").strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        raise SearchQueryError(f"Неверная дата «{value}», нужен формат ДД.ММ.ГГГГ")
+
+
+def parse_search_text(text: str, directions: List[tuple]) -> Dict[str, Optional[object]]:
+    """
+    Разобрать сообщение администратора в параметры Database.search_requests.
+    directions - список (id, name) направлений для фильтра по части названия.
+    """
+    params = {"words": [], "status": None, "direction_id": None, "date_from": None, "date_to": None}
+
+    for key, value in _FILTER_RE.findall(text):
+        key = key.lower()
+        if key == "статус":
+            status = STATUS_ALIASES.get(value.lower())
+            if status is None:
+                raise SearchQueryError("Статус может быть «активные» или «закрытые»")
+            params["status"] = status
+        elif key == "с":
+            params["date_from"] = _parse_date(value)
+        elif key == "по":
+            # Включительно: до начала следующего дня
+            day = datetime.strptime(_parse_date(value), "%Y-%m-%d %H:%M:%S") + timedelta(days=1)
+            params["date_to"] = day.strftime("%Y-%m-%d %H:%M:%S")
+        else:
+            matches = [d for d in directions if value.lower() in d[1].lower()]
+            if not matches:
+                raise SearchQueryError(f"Направление «{value}» не найдено")
+            params["direction_id"] = matches[0][0]
+
+    params["words"] = _WORD_RE.findall(_FILTER_RE.sub(" ", text))
+    if not params["words"]:
+        raise SearchQueryError("Укажите хотя бы одно слово для поиска")
+    return params
+
+
+def build_match_query(words: List[str]) -> str:
+    """Запрос MATCH для FTS5: все слова, каждое по началу слова; кавычки исключают синтаксис FTS5"""
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def format_snippet(snippet: str, escape) -> str:
+    """Фрагмент с выделенными совпадениями (HTML); escape - функция экранирования HTML"""
+    return escape(snippet).replace(MATCH_START, "<b>").replace(MATCH_END, "</b>")
@@ -0,0 +1,101 @@
+"""
+Жизненный цикл заявки: закрытие с ответом или без него.
+Все каналы ответа (reply в ЛС, reply в админской группе, ответ из карточки заявки,
+кнопка «Закрыть») проходят через close_request, поэтому при одновременных ответах
+заявку закрывает и уведомляет пользователя только один сотрудник.
+"""
+import re
+from typing import Optional
+from aiogram.types import Message
+
+from database import db
+from lru import LRUCache
+
+# Результаты закрытия заявки
+CLOSED = "closed"
+ALREADY_CLOSED = "already_closed"
+NOT_FOUND = "not_found"
+FORBIDDEN = "forbidden"
+
+# (chat_id, message_id уведомления) -> номер заявки; соответствие не меняется, поэтому кэш безопасен и при WORKERS > 1
+_reply_targets = LRUCache("reply_targets", maxsize=4096)
+
+
+async def resolve_reply_target(chat_id: int, replied_message: Message) -> Optional[int]:
+    """
+    Номер заявки, к которой относится сообщение бота, на которое ответил сотрудник.
+    Сначала ищем по сохранённым уведомлениям (chat_id, message_id), номер в тексте - только запасной вариант
+    для уведомлений, отправленных до появления этой таблицы.
+    """
+    key = (chat_id, replied_message.message_id)
+    request_id = _reply_targets.get(key)
+    if request_id is not None:
+        return request_id
+
+    request_id = await db.get_request_id_by_notification(chat_id, replied_message.message_id)
+    if request_id is not None:
+        _reply_targets.put(key, request_id)
+        return request_id
+
+    match = re.search(r'#(\d+)', replied_message.text or replied_message.caption or "")
+    return int(match.group(1)) if match else None
+
+
+def get_responder_role(is_admin: bool, is_teacher: bool) -> str:
+    """Роль отвечающего для уведомлений"""
+    return "Преподаватель" if is_teacher else "Администратор"
+
+
+def format_user_reply(request_id: int, responder_role: str, original_text: str, answer_text: str) -> str:
+    """Текст ответа пользователю (Markdown)"""
+    return (
+        f"✅ *Ответ на вашу заявку #{request_id}*\n\n"
+        f"👤 *Ответил:* {responder_role}\n"
+        f"📋 *Статус:* Заявка закрыта\n\n"
+        f"💬 *Ваша заявка:*\n{original_text}\n\n"
+        f"📝 *Ответ:*\n{answer_text}\n\n"
+        f"💡 Теперь вы можете создать новую заявку, если это необходимо."
+    )
+
+
+async def close_request(bot, request_id: int, responder_id: int, responder_role: str,
+                        answer_text: str = None, teacher_only: bool = False) -> str:
+    """
+    Закрыть заявку. Заявку атомарно переводит в статус closed только первый
+    из одновременно отвечающих; он же отправляет ответ пользователю и обновляет уведомления.
+
+    teacher_only - отвечающий только преподаватель, проверяем его права на направление заявки.
+    Если ответ не удалось доставить пользователю, заявка возвращается в активные,
+    а исключение пробрасывается вызывающему.
+    """
+    request = await db.get_feedback_message(request_id)
+    if not request:
+        return NOT_FOUND
+
+    if teacher_only and not await db.can_teacher_reply_to_request(responder_id, request_id):
+        return FORBIDDEN
+
+    if not await db.try_close_request(request_id, responder_id, answer_text):
+        return ALREADY_CLOSED
+
+    if answer_text is not None:
+        user_id = request[1]
+        original_text = request[4]
+        try:
+            await bot.send_message(
+                user_id,
+                format_user_reply(request_id, responder_role, original_text, answer_text),
+                parse_mode="Markdown"
+            )
+        except Exception:
+            await db.reopen_request(request_id, responder_id)
+            raise
+
+    # Обновляем статус в админских уведомлениях
+    await db.update_notification_status(bot, request_id, f"Закрыта ({responder_role})", answer_text)
+
+    # Отправляем уведомления преподавателям о закрытии заявки
+    await db.notify_teachers_about_closed_request(
+        bot, request_id, responder_role, answer_text if answer_text is not None else "Заявка закрыта без ответа"
+    )
+    return CLOSED
@@ -0,0 +1,200 @@
+"""
+Время ответа на заявки: перцентили p50/p90/p99 без пересчёта истории.
+Для каждого измерения (все заявки, направление, ответивший сотрудник) хранится
+гистограмма с логарифмическими корзинами (в духе HDR Histogram): граница каждой
+следующей корзины в RATIO раз больше предыдущей, поэтому относительная ошибка
+перцентиля не больше RATIO - 1 на любом масштабе - от секунд до недель.
+Гистограммы складываются покорзинно, так что несколько направлений или
+сотрудников объединяются без доступа к исходным заявкам.
+
+Триггер добавляет наблюдение в той же транзакции, что и закрытие заявки с ответом,
+и вычитает его при возврате заявки в активные. Границы корзин записываются
+в таблицу response_time_bounds при миграции и не меняются: иначе старые
+счётчики потеряют смысл.
+"""
+import bisect
+from collections import defaultdict
+from typing import Dict, Iterable, Optional, Tuple
+
+# Отношение соседних границ корзин и диапазон: от 1 секунды до ~90 суток
+RATIO = 1.1
+MAX_SECONDS = 90 * 24 * 3600
+
+
+def _bounds() -> Tuple[float, ...]:
+    bounds = [1.0]
+    while bounds[-1] < MAX_SECONDS:
+        bounds.append(bounds[-1] * RATIO)
+    return tuple(bounds)
+
+
+# Верхние границы корзин в секундах; последняя корзина - переполнение
+BOUNDS = _bounds()
+OVERFLOW_BUCKET = len(BOUNDS)
+
+CREATE_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS response_time_bounds (
+        bucket INTEGER PRIMARY KEY,
+        upper REAL NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS response_time_sketch (
+        dimension TEXT NOT NULL,
+        dim_key INTEGER NOT NULL,
+        bucket INTEGER NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, dim_key, bucket)
+    ) WITHOUT ROWID
+    ''',
+]
+
+
+def _observe(row: str, sign: int) -> str:
+    """Добавить (sign=1) или убрать (sign=-1) время ответа строки row во всех измерениях"""
+    seconds = f"MAX(0, (julianday({row}.answered_at) - julianday({row}.created_at)) * 86400)"
+    return f'''
+        INSERT INTO response_time_sketch (dimension, dim_key, bucket, count)
+        SELECT dimension, dim_key,
+               IFNULL((SELECT MIN(bucket) FROM response_time_bounds WHERE upper >= {seconds}), {OVERFLOW_BUCKET}),
+               {sign}
+        FROM (SELECT 'all' AS dimension, 0 AS dim_key
+              UNION ALL SELECT 'direction', IFNULL({row}.direction_id, 0)
+              UNION ALL SELECT 'responder', {row}.answered_by WHERE {row}.answered_by IS NOT NULL)
+        WHERE true
+        ON CONFLICT (dimension, dim_key, bucket) DO UPDATE SET count = count + excluded.count;
+    '''
+
+
+TRIGGERS = [
+    f'''
+    CREATE TRIGGER IF NOT EXISTS response_time_close AFTER UPDATE OF status ON feedback_messages
+    WHEN new.status = 'closed' AND old.status IS NOT 'closed'
+      AND new.is_answered AND new.answered_at IS NOT NULL
+    BEGIN
+        {_observe("new", 1)}
+    END
+    ''',
+    f'''
+    CREATE TRIGGER IF NOT EXISTS response_time_reopen AFTER UPDATE OF status ON feedback_messages
+    WHEN old.status = 'closed' AND new.status IS NOT 'closed'
+      AND old.is_answered AND old.answered_at IS NOT NULL
+    BEGIN
+        {_observe("old", -1)}
+    END
+    ''',
+]
+
+
+async def create(conn):
+    """Создать таблицы и триггеры и заполнить гистограммы по уже закрытым заявкам (миграция)"""
+    for statement in CREATE_TABLES:
+        await conn.execute(statement)
+    await conn.execute('DELETE FROM response_time_bounds')
+    await conn.executemany(
+        'INSERT INTO response_time_bounds (bucket, upper) VALUES (?, ?)', enumerate(BOUNDS)
+    )
+    for trigger in TRIGGERS:
+        await conn.execute(trigger)
+    await rebuild(conn)
+
+
+async def rebuild(conn, source: str = 'feedback_messages'):
+    """
+    Пересчитать гистограммы по закрытым заявкам с ответом (вызывающий делает commit).
+    source - источник заявок; с подключённым архивом - archive.feedback_source()
+    """
+    await conn.execute('DELETE FROM response_time_sketch')
+    seconds = "MAX(0, (julianday(answered_at) - julianday(created_at)) * 86400)"
+    for dimension, key in (("'all'", "0"), ("'direction'", "IFNULL(direction_id, 0)"), ("'responder'", "answered_by")):
+        await conn.execute(f'''
+            INSERT INTO response_time_sketch (dimension, dim_key, bucket, count)
+            SELECT {dimension}, {key},
+                   IFNULL((SELECT MIN(bucket) FROM response_time_bounds WHERE upper >= {seconds}),
+                          {OVERFLOW_BUCKET}) AS bucket,
+                   COUNT(*)
+            FROM {source}
+            WHERE status = 'closed' AND is_answered AND answered_at IS NOT NULL AND {key} IS NOT NULL
+            GROUP BY 2, 3
+        ''')
+
+
+class ResponseTimeSketch:
+    """Гистограмма времени ответа: счётчики корзин, слияние и перцентили"""
+
+    def __init__(self, counts: Dict[int, int] = None):
+        self.counts: Dict[int, int] = defaultdict(int, counts or {})
+
+    @staticmethod
+    def bucket_for(seconds: float) -> int:
+        """Номер корзины для времени ответа в секундах (как в триггере: первая граница >= seconds)"""
+        return bisect.bisect_left(BOUNDS, seconds)
+
+    def add(self, seconds: float, count: int = 1):
+        """Добавить наблюдение"""
+        self.counts[self.bucket_for(seconds)] += count
+
+    def merge(self, other: "ResponseTimeSketch") -> "ResponseTimeSketch":
+        """Прибавить другую гистограмму (например, другого направления)"""
+        for bucket, count in other.counts.items():
+            self.counts[bucket] += count
+        return self
+
+    @property
+    def count(self) -> int:
+        """Число наблюдений"""
+        return sum(self.counts.values())
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Перцентиль q (0..1) в секундах: середина корзины в геометрическом смысле,
+        для корзины переполнения - её нижняя граница
+        """
+        total = self.count
+        if total <= 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        for bucket in sorted(self.counts):
+            cumulative += self.counts[bucket]
+            if cumulative >= rank and self.counts[bucket] > 0:
+                if bucket >= OVERFLOW_BUCKET:
+                    return BOUNDS[-1]
+                if bucket == 0:
+                    return BOUNDS[0]
+                return (BOUNDS[bucket - 1] * BOUNDS[bucket]) ** 0.5
+        return BOUNDS[-1]
+
+
+def sketches_from_rows(rows: Iterable[tuple]) -> Dict[Tuple[str, int], ResponseTimeSketch]:
+    """Строки (dimension, dim_key, bucket, count) -> гистограммы по измерениям"""
+    sketches: Dict[Tuple[str, int], ResponseTimeSketch] = defaultdict(ResponseTimeSketch)
+    for dimension, dim_key, bucket, count in rows:
+        if count:
+            sketches[(dimension, dim_key)].counts[bucket] += count
+    return sketches
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    """Длительность для экранов статистики: «45 сек», «12 мин», «3 ч 20 мин», «2 дн 5 ч»"""
+    if seconds is None:
+        return "—"
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return f"{seconds} сек"
+    minutes = seconds // 60
+    if minutes < 60:
+        return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours} ч {minutes} мин" if minutes else f"{hours} ч"
+    days, hours = divmod(hours, 24)
+    return f"{days} дн {hours} ч" if hours else f"{days} дн"
+
+
+def format_percentiles(sketch: ResponseTimeSketch) -> str:
+    """Строка «медиана · p90 · p99» для гистограммы"""
+    return (f"медиана {format_duration(sketch.percentile(0.5))} · "
+            f"p90 {format_duration(sketch.percentile(0.9))} · "
+            f"p99 {format_duration(sketch.percentile(0.99))}")
@@ -18,7 +18,7 @@ from chat_handler import ChatType, ChatBehavior, require_permission
 from enhanced_keyboards import get_schedule_settings_keyboard
 from schedule_parser import schedule_parser
 
-schedule_router = Router()
+schedule_router = Router(name="schedule")
 
 # Состояния для загрузки файлов
 class ScheduleStates(StatesGroup):
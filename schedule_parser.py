@@ -6,11 +6,13 @@ import os
 class ScheduleParser:
     def __init__(self):
         self.schedule_data = None
+        self.loaded_mtime = None
         self.load_schedule()
     
     def load_schedule(self):
         """Загрузить расписание из CSV файла"""
         try:
+            self.loaded_mtime = os.path.getmtime(SCHEDULE_FILE)
             self.schedule_data = pd.read_csv(SCHEDULE_FILE, encoding='utf-8')
             # Удаляем пустые строки
             self.schedule_data = self.schedule_data.dropna(subset=['Направление'])
@@ -77,6 +79,7 @@ class ScheduleParser:
             
             # Сохраняем в CSV для совместимости
             self.schedule_data.to_csv(SCHEDULE_FILE, index=False, encoding='utf-8')
+            self.loaded_mtime = os.path.getmtime(SCHEDULE_FILE)
             
             return True
         except Exception as e:
@@ -116,6 +119,17 @@ class ScheduleParser:
         except Exception as e:
             return False, f"Ошибка проверки файла: {str(e)}"
     
+    def reload_if_changed(self) -> bool:
+        """Перечитать CSV, если файл изменился после последней загрузки (например, другим процессом)"""
+        try:
+            mtime = os.path.getmtime(SCHEDULE_FILE)
+        except OSError:
+            return False
+        if mtime == self.loaded_mtime:
+            return False
+        self.load_schedule()
+        return True
+    
     def get_directions(self) -> List[str]:
         """Получить список всех направлений"""
         if self.schedule_data is None:
@@ -0,0 +1,76 @@
+"""
+Middleware последовательной обработки апдейтов одного пользователя в одном чате:
+апдейты одного ключа выполняются строго по очереди, разные пользователи - параллельно
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, Any, Awaitable, Hashable
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from metrics import registry
+
+sequencer_waiting = registry.gauge(
+    "update_sequencer_waiting", "Апдейты, ожидающие завершения предыдущего апдейта того же пользователя"
+)
+sequencer_wait = registry.histogram(
+    "update_sequencer_wait_seconds", "Время ожидания очереди пользователя"
+)
+
+
+class KeyedLocks:
+    """Блокировки по ключу; блокировка удаляется, когда её никто не держит и не ждёт"""
+
+    def __init__(self):
+        self._locks: Dict[Hashable, list] = {}
+
+    def __len__(self):
+        return len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, key: Hashable):
+        """Захватить блокировку ключа (ожидающие получают её в порядке прихода)"""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+
+class UpdateSequencerMiddleware(BaseMiddleware):
+    """Внешний middleware диспетчера: апдейты одного (чат, пользователь) идут по порядку"""
+
+    def __init__(self):
+        self.locks = KeyedLocks()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        if user is None and chat is None:
+            return await handler(event, data)
+
+        key = (chat.id if chat else None, user.id if user else None)
+        started = time.perf_counter()
+        sequencer_waiting.inc()
+        try:
+            async with self.locks.hold(key):
+                sequencer_waiting.dec()
+                sequencer_wait.observe(time.perf_counter() - started)
+                started = None
+                return await handler(event, data)
+        finally:
+            if started is not None:
+                # Апдейт отменён, не дождавшись своей очереди
+                sequencer_waiting.dec()
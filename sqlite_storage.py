@@ -0,0 +1,139 @@
+"""
+Хранилище состояний FSM в базе данных бота: черновики заявок и мастера админки
+переживают перезапуск, а брошенные состояния удаляются по истечении TTL
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Mapping, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from config import FSM_STATE_TTL_HOURS, FSM_SWEEP_INTERVAL_MINUTES
+from database import db, Database
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+fsm_states_evicted = registry.counter(
+    "fsm_states_evicted_total", "Состояния FSM, удалённые по TTL"
+)
+fsm_states_stored = registry.gauge(
+    "fsm_states_stored", "Состояния FSM в базе данных (по данным последней очистки)"
+)
+
+
+def dump_data(data: Mapping[str, Any]) -> str:
+    """Компактная сериализация данных состояния"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_states. Все записи идут через одно постоянное
+    соединение под asyncio.Lock, чтение - через него же без блокировки
+    """
+
+    def __init__(self, database: Database = db, ttl_hours: float = FSM_STATE_TTL_HOURS,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.database = database
+        self.ttl = int(ttl_hours * 3600)
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._conn = None
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+
+    async def _connection(self):
+        """Постоянное соединение хранилища (открывается при первом обращении)"""
+        if self._conn is None:
+            async with self._connect_lock:
+                if self._conn is None:
+                    self._conn = await self.database.connect()
+        return self._conn
+
+    async def _write(self, *statements):
+        """Выполнить запросы одной транзакцией"""
+        conn = await self._connection()
+        async with self._write_lock:
+            for sql, params in statements:
+                await conn.execute(sql, params)
+            await conn.commit()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        value = state.state if isinstance(state, State) else state
+        now = int(time.time())
+        if value is None:
+            await self._write(
+                ('UPDATE fsm_states SET state = NULL, updated_at = ? WHERE key = ?', (now, storage_key)),
+                ("DELETE FROM fsm_states WHERE key = ? AND data = '{}'", (storage_key,)),
+            )
+            return
+        await self._write((
+            '''
+            INSERT INTO fsm_states (key, state, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at
+            ''',
+            (storage_key, value, now)
+        ))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        conn = await self._connection()
+        async with conn.execute('SELECT state FROM fsm_states WHERE key = ?', (self.key_builder.build(key),)) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise ValueError(f"Данные состояния должны быть словарём, получено: {type(data).__name__}")
+        storage_key = self.key_builder.build(key)
+        now = int(time.time())
+        if not data:
+            await self._write(
+                ("UPDATE fsm_states SET data = '{}', updated_at = ? WHERE key = ?", (now, storage_key)),
+                ('DELETE FROM fsm_states WHERE key = ? AND state IS NULL', (storage_key,)),
+            )
+            return
+        await self._write((
+            '''
+            INSERT INTO fsm_states (key, data, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            ''',
+            (storage_key, dump_data(data), now)
+        ))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        conn = await self._connection()
+        async with conn.execute('SELECT data FROM fsm_states WHERE key = ?', (self.key_builder.build(key),)) as cursor:
+            row = await cursor.fetchone()
+        return json.loads(row[0]) if row else {}
+
+    async def evict_expired(self) -> int:
+        """Удалить состояния, не менявшиеся дольше TTL; вернуть число удалённых"""
+        conn = await self._connection()
+        async with self._write_lock:
+            cursor = await conn.execute('DELETE FROM fsm_states WHERE updated_at < ?', (int(time.time()) - self.ttl,))
+            evicted = cursor.rowcount
+            await conn.commit()
+            async with conn.execute('SELECT COUNT(*) FROM fsm_states') as count_cursor:
+                stored = (await count_cursor.fetchone())[0]
+        fsm_states_evicted.inc(amount=evicted)
+        fsm_states_stored.set(stored)
+        return evicted
+
+    async def run_sweeper(self, interval_minutes: float = FSM_SWEEP_INTERVAL_MINUTES):
+        """Фоновая задача периодической очистки устаревших состояний"""
+        while True:
+            try:
+                evicted = await self.evict_expired()
+                if evicted:
+                    logger.info(f"Удалено устаревших состояний FSM: {evicted}")
+            except Exception as e:
+                logger.error(f"Ошибка очистки состояний FSM: {e}")
+            await asyncio.sleep(interval_minutes * 60)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
@@ -11,10 +11,12 @@ from aiogram.types import InlineKeyboardButton
 
 from database import db
 from chat_handler import ChatType, ChatBehavior, require_permission
-from enhanced_keyboards import get_teacher_requests_keyboard
+from enhanced_keyboards import get_teacher_requests_keyboard, get_page_navigation_buttons
+from pagination import OLDER, parse_page_callback_data
 from schedule_parser import schedule_parser
+from response_times import ResponseTimeSketch, format_percentiles
 
-teacher_router = Router()
+teacher_router = Router(name="teacher")
 
 def escape_markdown(text: str) -> str:
     """Экранирует специальные символы Markdown"""
@@ -24,27 +26,29 @@ def escape_markdown(text: str) -> str:
 
 # Основные команды для преподавателей
 
-@teacher_router.message(F.text == "🎫 Мои заявки")
-@require_permission("my_requests")
-async def teacher_my_requests(message: Message, **kwargs):
-    """Заявки преподавателя"""
-    teacher_id = message.from_user.id
-    
-    # Получаем заявки для преподавателя
-    my_requests = await db.get_teacher_requests(teacher_id)
-    
-    if not my_requests:
-        text = (
-            "🎫 *Ваши заявки*\n\n"
-            "✅ У вас нет активных заявок!\n\n"
-            "💡 Заявки будут появляться здесь, когда студенты обратятся по вашим направлениям."
-        )
-        await message.answer(text, parse_mode="Markdown")
-        return
-    
-    text = f"🎫 *Ваши активные заявки* ({len(my_requests)})\n\n"
+# Заявок на странице списка преподавателя
+TEACHER_REQUESTS_PAGE_SIZE = 10
+
+async def render_teacher_requests(teacher_id: int, cursor=None, direction: str = OLDER):
+    """Текст и клавиатура страницы активных заявок преподавателя; None, если заявок нет"""
+    page = await db.get_requests_page(
+        status='active', teacher_id=teacher_id, cursor=cursor, direction=direction, limit=TEACHER_REQUESTS_PAGE_SIZE
+    )
+    if not page.rows and cursor:
+        # Заявки страницы успели закрыть - показываем начало списка
+        page = await db.get_requests_page(status='active', teacher_id=teacher_id, limit=TEACHER_REQUESTS_PAGE_SIZE)
+    if not page.rows:
+        return None
+    
+    # Общее число - из счётчиков заявок по направлениям преподавателя, без подсчёта по таблице
+    counters = await db.get_request_counters()
+    total = sum(
+        counters.direction(direction_id, 'active')
+        for direction_id, _ in await db.get_directions_for_teacher(teacher_id)
+    )
+    text = f"🎫 *Ваши активные заявки* ({total})\n\n"
     
-    for request in my_requests[:10]:  # Показываем первые 10
+    for request in page.rows:
         msg_id, user_id, username, first_name, msg_text, created_at, status, direction_name = request
         
         created_date = datetime.fromisoformat(created_at).strftime("%d.%m %H:%M")
@@ -57,18 +61,59 @@ async def teacher_my_requests(message: Message, **kwargs):
         text += f"📚 {direction_name}\n"
         text += f"💬 {short_message}\n\n"
     
-    if len(my_requests) > 10:
-        text += f"... и еще {len(my_requests) - 10} заявок\n\n"
-    
     text += "💡 *Для ответа:* сделайте reply на уведомление о заявке или используйте /msg ID_пользователя"
     
-    # Добавляем кнопки управления
+    # Листание и кнопки управления
     builder = InlineKeyboardBuilder()
-    builder.add(InlineKeyboardButton(text="📊 Статистика", callback_data=f"teacher_stats:{teacher_id}"))
-    builder.add(InlineKeyboardButton(text="📚 Мои направления", callback_data=f"teacher_directions:{teacher_id}"))
-    builder.adjust(2)
+    navigation = get_page_navigation_buttons(page, f"teacher_requests:{teacher_id}")
+    if navigation:
+        builder.row(*navigation)
+    builder.row(
+        InlineKeyboardButton(text="📊 Статистика", callback_data=f"teacher_stats:{teacher_id}"),
+        InlineKeyboardButton(text="📚 Мои направления", callback_data=f"teacher_directions:{teacher_id}")
+    )
+    return text, builder.as_markup()
+
+@teacher_router.message(F.text == "🎫 Мои заявки")
+@require_permission("my_requests")
+async def teacher_my_requests(message: Message, **kwargs):
+    """Заявки преподавателя"""
+    teacher_id = message.from_user.id
     
-    await message.answer(text, parse_mode="Markdown", reply_markup=builder.as_markup())
+    # Получаем первую страницу заявок для преподавателя
+    rendered = await render_teacher_requests(teacher_id)
+    
+    if not rendered:
+        text = (
+            "🎫 *Ваши заявки*\n\n"
+            "✅ У вас нет активных заявок!\n\n"
+            "💡 Заявки будут появляться здесь, когда студенты обратятся по вашим направлениям."
+        )
+        await message.answer(text, parse_mode="Markdown")
+        return
+    
+    text, keyboard = rendered
+    await message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
+
+@teacher_router.callback_query(F.data.startswith("teacher_requests:"))
+async def teacher_requests_page(callback: CallbackQuery):
+    """Заявки преподавателя: листание и возврат к списку"""
+    teacher_id = callback.from_user.id
+    if not await db.is_teacher(teacher_id):
+        await callback.answer("❌ У вас нет прав для выполнения этой команды.", show_alert=True)
+        return
+    
+    # teacher_requests:teacher_id[:направление:курсор]; список всегда строится для нажавшего
+    prefix = ":".join(callback.data.split(":")[:2])
+    cursor, direction = parse_page_callback_data(callback.data, prefix)
+    rendered = await render_teacher_requests(teacher_id, cursor, direction)
+    
+    if not rendered:
+        await callback.message.edit_text("🎫 *Ваши заявки*\n\n✅ У вас нет активных заявок!", parse_mode="Markdown")
+    else:
+        text, keyboard = rendered
+        await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=keyboard)
+    await callback.answer()
 
 @teacher_router.message(F.text == "📚 Мои направления")
 @require_permission("my_requests")
@@ -270,45 +315,47 @@ async def get_teacher_statistics(teacher_id: int) -> str:
         
         direction_ids = [d[0] for d in directions]
         
-        # Статистика заявок
-        async with aiosqlite.connect(db.db_path) as conn:
-            placeholders = ','.join(['?' for _ in direction_ids])
-            
-            cursor = await conn.execute(f'''
-                SELECT 
-                    COUNT(*) as total_requests,
-                    COUNT(CASE WHEN status = 'active' THEN 1 END) as active_requests,
-                    COUNT(CASE WHEN is_answered = 1 AND answered_by = ? THEN 1 END) as answered_by_me,
-                    COUNT(CASE WHEN created_at > datetime('now', '-7 days') THEN 1 END) as week_requests
-                FROM feedback_messages 
-                WHERE direction_id IN ({placeholders})
-            ''', [teacher_id] + direction_ids)
-            
-            stats = await cursor.fetchone()
-            
-            if not stats:
-                return "📊 *Ваша статистика*\n\n❌ Данные не найдены"
-            
-            total, active, answered, week = stats
-            
-            text = "📊 *Ваша статистика*\n\n"
-            text += f"📚 *Направлений:* {len(directions)}\n\n"
-            text += f"🎫 *Заявки:*\n"
-            text += f"• Всего по вашим направлениям: {total}\n"
-            text += f"• Активных: {active}\n"
-            text += f"• Отвечено вами: {answered}\n"
-            text += f"• За неделю: {week}\n\n"
-            
-            if total > 0 and answered > 0:
-                response_rate = round((answered / total) * 100, 1)
-                text += f"📈 *Ваш процент ответов:* {response_rate}%\n\n"
-            
-            text += f"💡 *Направления:*\n"
-            for _, direction_name in directions:
-                short_name = direction_name[:30] + "..." if len(direction_name) > 30 else direction_name
-                text += f"• {short_name}\n"
-            
-            return text
+        # Итоги - из счётчиков заявок по направлениям; ответы преподавателя считаются только
+        # по его текущим направлениям (счётчик сотрудника включает и ответы по другим направлениям)
+        counters = await db.get_request_counters()
+        total = sum(counters.direction(direction_id, 'total') for direction_id in direction_ids)
+        active = sum(counters.direction(direction_id, 'active') for direction_id in direction_ids)
+        answered = await db.count_answered_by(teacher_id, direction_ids)
+        week = await db.count_requests_since('-7 days', direction_ids=direction_ids)
+        
+        # Время ответа: свои ответы и все ответы по своим направлениям (слияние гистограмм)
+        sketches = await db.get_response_time_sketches()
+        mine = sketches.get(('responder', teacher_id), ResponseTimeSketch())
+        directions_sketch = ResponseTimeSketch()
+        for direction_id in direction_ids:
+            directions_sketch.merge(sketches.get(('direction', direction_id), ResponseTimeSketch()))
+        
+        text = "📊 *Ваша статистика*\n\n"
+        text += f"📚 *Направлений:* {len(directions)}\n\n"
+        text += f"🎫 *Заявки:*\n"
+        text += f"• Всего по вашим направлениям: {total}\n"
+        text += f"• Активных: {active}\n"
+        text += f"• Отвечено вами: {answered}\n"
+        text += f"• За неделю: {week}\n\n"
+        
+        if total > 0 and answered > 0:
+            response_rate = round((answered / total) * 100, 1)
+            text += f"📈 *Ваш процент ответов:* {response_rate}%\n\n"
+        
+        if mine.count > 0 or directions_sketch.count > 0:
+            text += f"⏱ *Время ответа:*\n"
+            if mine.count > 0:
+                text += f"• Ваше: {format_percentiles(mine)}\n"
+            if directions_sketch.count > 0:
+                text += f"• По вашим направлениям: {format_percentiles(directions_sketch)}\n"
+            text += "\n"
+        
+        text += f"💡 *Направления:*\n"
+        for _, direction_name in directions:
+            short_name = direction_name[:30] + "..." if len(direction_name) > 30 else direction_name
+            text += f"• {short_name}\n"
+        
+        return text
             
     except Exception as e:
         # Экранируем специальные символы Markdown в сообщении об ошибке
@@ -318,25 +365,14 @@ async def get_teacher_statistics(teacher_id: int) -> str:
 async def get_active_requests_count_for_direction(direction_id: int) -> int:
     """Получить количество активных заявок для направления"""
     try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            cursor = await conn.execute('''
-                SELECT COUNT(*) FROM feedback_messages 
-                WHERE direction_id = ? AND status = 'active'
-            ''', (direction_id,))
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+        return await db.count_active_requests_for_direction(direction_id)
     except Exception:
         return 0
 
 async def get_total_requests_for_direction(direction_id: int) -> int:
     """Получить общее количество заявок для направления"""
     try:
-        async with aiosqlite.connect(db.db_path) as conn:
-            cursor = await conn.execute('''
-                SELECT COUNT(*) FROM feedback_messages 
-                WHERE direction_id = ?
-            ''', (direction_id,))
-            result = await cursor.fetchone()
-            return result[0] if result else 0
+        counters = await db.get_request_counters()
+        return counters.direction(direction_id, 'total')
     except Exception:
         return 0
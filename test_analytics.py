@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Тесты отчёта аналитики: порционное чтение, тепловая карта, возраст заявок, когорты и кэш.
+"""
+
+import asyncio
+import os
+import sqlite3
+from datetime import datetime
+
+# Модули бота читают токен из окружения при импорте config
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+
+import pandas as pd
+
+import analytics
+from database import Database
+
+NOW = datetime(2024, 10, 16, 12, 0, 0)  # среда, UTC
+
+
+def make_database(tmp_path):
+    database = Database()
+    database.db_path = str(tmp_path / "analytics.db")
+    asyncio.run(database.init_db())
+    conn = sqlite3.connect(database.db_path)
+    conn.execute("INSERT INTO directions (id, name) VALUES (1, 'Робототехника')")
+    requests = [
+        # user_id, created_at, status, direction_id
+        (1, "2024-08-05 09:10:00", "closed", 1),
+        (1, "2024-09-10 09:20:00", "closed", 1),
+        (2, "2024-09-11 15:00:00", "closed", None),
+        (2, "2024-10-16 11:30:00", "active", 1),
+        (3, "2024-10-14 09:40:00", "active", 1),
+    ]
+    conn.executemany(
+        "INSERT INTO feedback_messages (user_id, message_text, created_at, status, direction_id) "
+        "VALUES (?, 'Вопрос', ?, ?, ?)", requests
+    )
+    conn.executemany(
+        "INSERT INTO users_log (user_id, first_interaction, last_interaction, total_messages) VALUES (?, ?, ?, ?)",
+        [(1, "2024-08-05 09:00:00", "2024-09-10 09:00:00", 7),
+         (2, "2024-10-15 10:00:00", "2024-10-15 18:00:00", 1)],
+    )
+    conn.commit()
+    conn.close()
+    return database
+
+
+def test_report_is_built_from_chunks(tmp_path, monkeypatch):
+    """Итоги не зависят от размера порции"""
+    database = make_database(tmp_path)
+    monkeypatch.setattr(analytics, "ANALYTICS_CHUNK_SIZE", 2)
+    monkeypatch.setattr(analytics, "_local_offset", lambda: pd.Timedelta(0))
+
+    report = analytics.build_report(database.db_path, now=NOW)
+
+    assert report.total_requests == 5
+    assert report.heatmap.sum() == 5
+    assert report.heatmap[0, 9] == 2  # понедельники, 9 часов
+    assert list(report.backlog) == [1, 0, 1, 0, 0]  # 30 минут и двое суток
+    assert report.direction_weeks.loc[1].sum() == 3  # август не попадает в 8 недель
+    assert report.direction_weeks.loc[1].iloc[-1] == 2
+    # Когорта августа: автор 1 вернулся через месяц; сентября: автор 2 - тоже
+    assert report.cohorts.loc["2024-08", 0] == 1 and report.cohorts.loc["2024-08", 1] == 1
+    assert report.cohorts.loc["2024-09", 0] == 1 and report.cohorts.loc["2024-09", 1] == 1
+    assert report.users == {"total": 2, "new_30": 1, "active_7": 1, "active_30": 1, "returning": 1}
+    assert list(report.messages) == [1, 0, 1, 0]
+    assert "Робототехника" in analytics.format_requests_report(report, lambda text: text)
+    assert "Когорты" in analytics.format_users_report(report)
+
+
+def test_cache_builds_report_once_per_day(tmp_path, monkeypatch):
+    """Одновременные запросы получают один и тот же отчёт, построенный один раз"""
+    database = make_database(tmp_path)
+    builds = []
+    original = analytics.build_report
+
+    def counting_build(db_path, **kwargs):
+        builds.append(db_path)
+        return original(db_path, **kwargs)
+
+    monkeypatch.setattr(analytics, "build_report", counting_build)
+    cache = analytics.AnalyticsCache()
+
+    async def run():
+        return await asyncio.gather(*(cache.get(database.db_path) for _ in range(3)))
+
+    reports = asyncio.run(run())
+    assert len(builds) == 1
+    assert reports[0] is reports[1] is reports[2]
+
+
+def test_report_on_empty_database(tmp_path):
+    """Пустые таблицы не ломают отчёт"""
+    database = Database()
+    database.db_path = str(tmp_path / "empty.db")
+    asyncio.run(database.init_db())
+
+    report = analytics.build_report(database.db_path, now=NOW)
+
+    assert report.total_requests == 0
+    assert report.users["total"] == 0
+    assert "Статистика заявок" in analytics.format_requests_report(report, lambda text: text)
+    assert analytics.format_users_report(report)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Тесты распределения апдейтов по процессам-обработчикам, их упорядочивания и антифлуда.
+"""
+
+import asyncio
+import os
+import queue
+
+# Модули бота читают токен из окружения при импорте config
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+
+from aiogram.types import Update
+
+from cluster import ForwardToWorkerMiddleware, route_key
+
+
+def make_update(update_id: int, user_id: int) -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 1700000000,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Тест"},
+            "text": "📤 Отправить заявку",
+        },
+    })
+
+
+def test_updates_of_one_user_go_to_one_worker():
+    """Апдейты одного пользователя попадают в одну очередь и восстанавливаются без потерь"""
+    queues = [queue.Queue() for _ in range(3)]
+    middleware = ForwardToWorkerMiddleware(queues)
+
+    async def handler(event, data):
+        raise AssertionError("Главный процесс не должен обрабатывать апдейты")
+
+    async def run():
+        for update_id in range(1, 4):
+            await middleware(handler, make_update(update_id, 1001), {})
+        await middleware(handler, make_update(4, 1002), {})
+
+    asyncio.run(run())
+
+    first = queues[1001 % 3]
+    forwarded = [first.get_nowait() for _ in range(3)]
+    assert [item["update_id"] for item in forwarded] == [1, 2, 3]
+    assert Update.model_validate(forwarded[0]) == make_update(1, 1001)
+    assert queues[1002 % 3].qsize() == 1
+    assert route_key(make_update(5, 42)) == 42
+
+
+def test_supervisor_merges_metrics_and_counts_lost_updates():
+    """Надзор принимает снимки метрик обработчиков и учитывает апдейты упавшего процесса"""
+    import cluster
+    from cluster import WorkerPool
+    from metrics import MetricsRegistry, registry
+
+    class FakeProcess:
+        def __init__(self, alive):
+            self.alive = alive
+            self.exitcode = None if alive else 1
+
+        def is_alive(self):
+            return self.alive
+
+    worker = MetricsRegistry()
+    worker.gauge(cluster.worker_in_flight.name, "Тест").set(3)
+    pool = WorkerPool(2)
+    pool.metrics_queue = queue.Queue()
+    pool.metrics_queue.put((1, worker.snapshot()))
+    pool.processes = [FakeProcess(True), FakeProcess(False)]
+    spawned = []
+    pool._spawn = spawned.append
+    before = cluster.lost_updates.get("1")
+
+    pool.check_workers()
+
+    assert spawned == [1]
+    assert cluster.lost_updates.get("1") == before + 3
+    assert pool.in_flight == [0, 0]
+    assert 'cluster_worker_updates_in_flight{worker="1"} 3' in registry.render()
+    registry.merge_snapshot("1", {})
+
+
+def test_sequencer_orders_updates_of_one_user():
+    """Апдейты одного пользователя выполняются по очереди, разных - параллельно"""
+    from sequencer_middleware import UpdateSequencerMiddleware
+    from aiogram.types import Chat, User
+
+    middleware = UpdateSequencerMiddleware()
+    events = []
+    running = {"max": 0, "now": 0}
+
+    async def handler(event, data):
+        running["now"] += 1
+        running["max"] = max(running["max"], running["now"])
+        events.append(("start", event))
+        await asyncio.sleep(0.01)
+        events.append(("end", event))
+        running["now"] -= 1
+
+    def data_for(user_id):
+        return {
+            "event_from_user": User(id=user_id, is_bot=False, first_name="Тест"),
+            "event_chat": Chat(id=user_id, type="private"),
+        }
+
+    async def run():
+        await asyncio.gather(
+            middleware(handler, "a1", data_for(1)),
+            middleware(handler, "a2", data_for(1)),
+            middleware(handler, "b1", data_for(2)),
+        )
+
+    asyncio.run(run())
+
+    user_events = [item for item in events if item[1].startswith("a")]
+    assert user_events == [("start", "a1"), ("end", "a1"), ("start", "a2"), ("end", "a2")]
+    assert running["max"] == 2
+    assert len(middleware.locks) == 0
+
+
+def test_throttling_rejects_over_limit_callbacks():
+    """Лишние нажатия тяжёлой кнопки получают callback.answer и учитываются в метрике"""
+    import throttling_middleware
+    from throttling_middleware import ThrottlingMiddleware, route_class_of
+    from aiogram.types import CallbackQuery, User
+
+    user = User(id=7, is_bot=False, first_name="Тест")
+    answers = []
+
+    class FakeCallback(CallbackQuery):
+        async def answer(self, text=None, **kwargs):
+            answers.append(text)
+
+    callback = FakeCallback(id="1", from_user=user, chat_instance="x", data="requests_active")
+    middleware = ThrottlingMiddleware("heavy=0.01:2")
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event)
+
+    async def run():
+        for _ in range(4):
+            await middleware(handler, callback, {"event_from_user": user})
+
+    before = throttling_middleware.throttled_updates.get("heavy")
+    asyncio.run(run())
+
+    assert route_class_of(callback) == "heavy"
+    assert len(handled) == 2
+    assert len(answers) == 2
+    assert throttling_middleware.throttled_updates.get("heavy") == before + 2
+    assert middleware.allow(8, "message")
+
+
+def test_throttling_runs_before_user_queue():
+    """В настоящем диспетчере лишнее нажатие отклоняется, не дожидаясь блокировки пользователя"""
+    from aiogram import Bot
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from aiogram.methods import AnswerCallbackQuery
+    from main import build_dispatcher
+    from sequencer_middleware import UpdateSequencerMiddleware
+    from throttling_middleware import ThrottlingMiddleware
+
+    calls = []
+
+    class FakeBot(Bot):
+        async def __call__(self, method, request_timeout=None):
+            calls.append(method)
+            return True
+
+    bot = FakeBot(token="123456:test")
+    dp = build_dispatcher(MemoryStorage())
+    throttling = next(m for m in dp.update.outer_middleware if isinstance(m, ThrottlingMiddleware))
+    sequencer = next(m for m in dp.update.outer_middleware if isinstance(m, UpdateSequencerMiddleware))
+    update = Update.model_validate({
+        "update_id": 1,
+        "callback_query": {
+            "id": "1", "chat_instance": "x", "data": "requests_active",
+            "from": {"id": 7, "is_bot": False, "first_name": "Тест"},
+        },
+    })
+
+    async def run():
+        while throttling.allow(7, "heavy"):
+            pass
+        async with sequencer.locks.hold((None, 7)):
+            await asyncio.wait_for(dp.feed_update(bot, update), timeout=1)
+
+    asyncio.run(run())
+
+    assert [type(call) for call in calls] == [AnswerCallbackQuery]
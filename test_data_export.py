@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Тесты выгрузки заявок и пользователей в CSV и XLSX.
+"""
+
+import asyncio
+import csv
+import os
+import sqlite3
+
+# Модули бота читают токен из окружения при импорте config
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+
+from openpyxl import load_workbook
+
+import data_export
+from database import Database
+
+
+def make_database(tmp_path):
+    database = Database()
+    database.db_path = str(tmp_path / "export.db")
+    asyncio.run(database.init_db())
+    conn = sqlite3.connect(database.db_path)
+    conn.execute("INSERT INTO directions (id, name) VALUES (1, 'Робототехника')")
+    conn.executemany(
+        "INSERT INTO feedback_messages (user_id, username, message_text, direction_id, answer_text) VALUES (?, ?, ?, ?, ?)",
+        [(100 + i, f"user{i}", f"Вопрос {i}", 1 if i % 2 else None, None) for i in range(25)]
+        + [(200, None, "=HYPERLINK(\"http://example.com\")\x02", 1, "Ответ")],
+    )
+    conn.commit()
+    conn.close()
+    return database
+
+
+def test_export_streams_all_rows(tmp_path, monkeypatch):
+    """Все строки выгружаются порциями; формулы и управляющие символы не попадают в файл как есть"""
+    database = make_database(tmp_path)
+    monkeypatch.setattr(data_export, "EXPORT_BATCH_SIZE", 4)
+
+    async def run():
+        xlsx = await data_export.export_table(database.db_path, "requests", "xlsx", str(tmp_path))
+        csv_file = await data_export.export_table(database.db_path, "requests", "csv", str(tmp_path))
+        return xlsx, csv_file
+
+    (xlsx_path, xlsx_count), (csv_path, csv_count) = asyncio.run(run())
+    assert xlsx_count == csv_count == 26
+
+    sheet = load_workbook(xlsx_path, read_only=True).active
+    rows = list(sheet.iter_rows(values_only=True))
+    assert rows[0] == data_export.TABLES["requests"].headers
+    assert len(rows) == 27
+    assert rows[2][3] == "Робототехника"
+    assert rows[-1][7] == '=HYPERLINK("http://example.com")'
+    assert rows[-1][8] == "Ответ"
+
+    with open(csv_path, encoding="utf-8-sig", newline="") as file:
+        csv_rows = list(csv.reader(file, delimiter=";"))
+    assert len(csv_rows) == 27
+    assert csv_rows[-1][7].startswith("'=")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Тесты обслуживания базы данных: окно тихих часов, возврат свободного места и резервные копии.
+"""
+
+import asyncio
+import gzip
+import os
+import sqlite3
+
+# Модули бота читают токен из окружения при импорте config
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+
+import backup
+import maintenance
+from database import Database
+
+
+def test_quiet_window_crosses_midnight():
+    window = maintenance.parse_quiet_hours("23:30-04:00")
+    assert maintenance.in_window("23:45", window)
+    assert maintenance.in_window("03:59", window)
+    assert not maintenance.in_window("04:00", window)
+    assert not maintenance.in_window("12:00", maintenance.parse_quiet_hours("02:00-05:00"))
+    assert maintenance.parse_quiet_hours("") is None
+
+
+def test_maintenance_reclaims_space(tmp_path):
+    """Старая база переводится в incremental auto_vacuum, место после удаления возвращается"""
+    database = Database()
+    database.db_path = str(tmp_path / "maintenance.db")
+    # База, созданная до появления обслуживания: auto_vacuum выключен
+    conn = sqlite3.connect(database.db_path)
+    conn.execute("CREATE TABLE legacy (id INTEGER PRIMARY KEY)")
+    conn.close()
+    asyncio.run(database.init_db())
+
+    conn = sqlite3.connect(database.db_path)
+    conn.executemany(
+        "INSERT INTO feedback_messages (user_id, message_text) VALUES (?, ?)",
+        [(i, "Вопрос " * 500) for i in range(200)],
+    )
+    conn.commit()
+    conn.execute("DELETE FROM feedback_messages")
+    conn.commit()
+    conn.close()
+
+    runs = maintenance.maintenance_runs.get()
+    first = asyncio.run(database.run_maintenance())
+    second = asyncio.run(database.run_maintenance())
+
+    conn = sqlite3.connect(database.db_path)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == maintenance.AUTO_VACUUM_INCREMENTAL
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] > 0
+    conn.close()
+    assert first.reclaimed_bytes > 0
+    assert set(second.steps) == {"analyze", "vacuum", "checkpoint"}
+    assert maintenance.maintenance_runs.get() == runs + 2
+    assert maintenance.maintenance_duration.get("total") == second.duration
+
+
+def test_backup_snapshot_and_rotation(tmp_path):
+    """Копия сжата, открывается как база с теми же данными; старые копии удаляются"""
+    database = Database()
+    database.db_path = str(tmp_path / "bot.db")
+    database.archive_path = str(tmp_path / "archive.db")
+    asyncio.run(database.init_db())
+    conn = sqlite3.connect(database.db_path)
+    conn.executemany(
+        "INSERT INTO feedback_messages (user_id, message_text) VALUES (?, ?)",
+        [(i, "Вопрос " * 50) for i in range(100)],
+    )
+    conn.commit()
+    conn.close()
+    directory = tmp_path / "backups"
+    directory.mkdir()
+    for day in (1, 2, 3):
+        (directory / f"bot_2020010{day}_000000.db.gz").write_bytes(b"")
+    # Копии базы с именем, начинающимся так же (архив bot_archive.db), не затрагиваются
+    (directory / "bot_archive_20990101_000000.db.gz").write_bytes(b"")
+
+    created = asyncio.run(backup.backup_database(database, str(directory), keep=2))
+
+    assert len(created) == 1  # архива ещё нет
+    assert sorted(os.listdir(directory)) == sorted(
+        ["bot_20200103_000000.db.gz", "bot_archive_20990101_000000.db.gz", os.path.basename(created[0].path)]
+    )
+    restored = tmp_path / "restored.db"
+    with gzip.open(created[0].path, "rb") as packed:
+        restored.write_bytes(packed.read())
+    conn = sqlite3.connect(restored)
+    assert conn.execute("SELECT COUNT(*) FROM feedback_messages").fetchone()[0] == 100
+    conn.close()
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Тесты реестра метрик и middleware учёта вызовов Bot API.
+"""
+
+import asyncio
+import os
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+# Модули бота читают токен из окружения при импорте config
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+
+from metrics import MetricsRegistry
+import api_metrics_middleware
+from api_metrics_middleware import TelegramApiMetricsMiddleware, error_code
+
+
+def test_histogram_percentiles():
+    """Перцентили оцениваются внутри корзин"""
+    metrics = MetricsRegistry()
+    histogram = metrics.histogram("test_seconds", "Тест", ("method",), buckets=(0.1, 0.2, 0.5, 1.0))
+
+    for _ in range(90):
+        histogram.observe(0.05, "a")
+    for _ in range(10):
+        histogram.observe(0.4, "a")
+
+    assert histogram.count("a") == 100
+    assert histogram.percentile(0.5, "a") <= 0.1
+    assert 0.2 < histogram.percentile(0.99, "a") <= 0.5
+    assert histogram.percentile(0.5, "b") is None
+
+
+def test_render_prometheus_format():
+    """Экспорт в текстовый формат Prometheus"""
+    metrics = MetricsRegistry()
+    counter = metrics.counter("test_total", "Счётчик", ("method", "result"))
+    counter.inc("sendMessage", "ok")
+    counter.inc("sendMessage", "ok")
+    histogram = metrics.histogram("test_seconds", "Гистограмма", ("method",), buckets=(0.1, 1.0))
+    histogram.observe(0.5, "getMe")
+
+    text = metrics.render()
+
+    assert '# TYPE test_total counter' in text
+    assert 'test_total{method="sendMessage",result="ok"} 2' in text
+    assert 'test_seconds_bucket{method="getMe",le="0.1"} 0' in text
+    assert 'test_seconds_bucket{method="getMe",le="+Inf"} 1' in text
+    assert 'test_seconds_count{method="getMe"} 1' in text
+
+
+def test_render_merges_worker_snapshots():
+    """Снимки метрик процессов-обработчиков выводятся вместе со своими с меткой worker"""
+    import pickle
+
+    worker = MetricsRegistry()
+    worker.counter("test_total", "Счётчик", ("method",)).inc("sendMessage", amount=3)
+    worker.histogram("test_seconds", "Гистограмма", ("handler",), buckets=(0.1, 1.0)).observe(0.5, "start")
+    worker.gauge("test_worker_only", "Только в обработчике").set(2)
+
+    metrics = MetricsRegistry()
+    metrics.counter("test_total", "Счётчик", ("method",)).inc("getUpdates")
+    metrics.merge_snapshot("0", pickle.loads(pickle.dumps(worker.snapshot())))
+    text = metrics.render()
+
+    assert text.count('# TYPE test_total counter') == 1
+    assert 'test_total{method="getUpdates"} 1' in text
+    assert 'test_total{method="sendMessage",worker="0"} 3' in text
+    assert 'test_seconds_bucket{handler="start",worker="0",le="1.0"} 1' in text
+    assert 'test_seconds_count{handler="start",worker="0"} 1' in text
+    assert '# TYPE test_worker_only gauge' in text
+    assert 'test_worker_only{worker="0"} 2' in text
+
+
+def test_api_middleware_records_retry_after():
+    """Middleware учитывает ошибки и retry-after по методу"""
+    method = SendMessage(chat_id=1, text="test")
+    before = api_metrics_middleware.api_retry_after.get("sendMessage")
+
+    async def make_request(bot, method):
+        raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=3)
+
+    async def run():
+        try:
+            await TelegramApiMetricsMiddleware()(make_request, None, method)
+        except TelegramRetryAfter:
+            return True
+        return False
+
+    assert asyncio.run(run())
+    assert api_metrics_middleware.api_retry_after.get("sendMessage") == before + 1
+    assert error_code(TelegramRetryAfter(method=method, message="", retry_after=1)) == "429"
+
+
+def test_histogram_rolling_window():
+    """Скользящее окно учитывает только свежие наблюдения"""
+    metrics = MetricsRegistry()
+    histogram = metrics.histogram("test_window_seconds", "Тест", ("handler",),
+                                  buckets=(0.1, 1.0), window_seconds=60)
+
+    histogram.observe(0.05, "a")
+    histogram.observe(0.5, "a")
+
+    counts, total = histogram.recent_counts("a")
+    assert total == 2
+    assert counts[0] == 1 and counts[1] == 1
+    assert histogram.recent_percentile(0.5, "a") <= 0.1
+    assert histogram.recent_counts("b") == ([], 0)
+
+
+def test_handler_timing_records_trace():
+    """Middleware хендлера заполняет трассу апдейта и учитывает время Bot API"""
+    import handler_timing_middleware
+    from handler_timing_middleware import UpdateTimingMiddleware, HandlerTimingMiddleware
+    from update_trace import current_trace
+    from aiogram import Router
+    from datetime import datetime
+    from aiogram.types import Chat, Message, Update
+
+    seen = {}
+
+    async def show_active_requests(event, data):
+        await TelegramApiMetricsMiddleware()(fake_request, None, SendMessage(chat_id=1, text="x"))
+        seen["trace"] = current_trace.get()
+
+    async def fake_request(bot, method):
+        return True
+
+    class HandlerStub:
+        callback = show_active_requests
+
+    async def inner(event, data):
+        return await HandlerTimingMiddleware()(show_active_requests, event, data)
+
+    async def run():
+        message = Message(message_id=1, date=datetime.now(), chat=Chat(id=1, type="private"))
+        update = Update(update_id=1, message=message)
+        data = {"event_router": Router(name="admin"), "handler": HandlerStub()}
+        await UpdateTimingMiddleware(threshold_ms=0)(inner, update, data)
+
+    asyncio.run(run())
+
+    trace = seen["trace"]
+    assert trace.router == "admin"
+    assert trace.handler == "show_active_requests"
+    assert trace.api_calls == 1
+    assert handler_timing_middleware.handler_latency.count("admin", "show_active_requests") >= 1
+    assert current_trace.get() is None
+
+
+def test_monitoring_endpoints(tmp_path):
+    """Эндпоинты мониторинга отдают метрики и состояние базы/polling"""
+    from aiohttp.test_utils import TestClient, TestServer
+    import monitoring_server
+    from api_metrics_middleware import last_success_at
+    from database import db
+
+    async def run():
+        db.db_path = str(tmp_path / "test.db")
+        client = TestClient(TestServer(monitoring_server.create_monitoring_app()))
+        await client.start_server()
+        try:
+            metrics_response = await client.get("/metrics")
+            metrics_text = await metrics_response.text()
+
+            last_success_at.pop("getUpdates", None)
+            not_ready = await client.get("/readyz")
+
+            last_success_at["getUpdates"] = time.monotonic()
+            ready = await client.get("/readyz")
+            health = await client.get("/healthz")
+            return metrics_response.status, metrics_text, not_ready.status, ready.status, health.status
+        finally:
+            await client.close()
+
+    original_path = db.db_path
+    try:
+        status, text, not_ready, ready, health = asyncio.run(run())
+    finally:
+        db.db_path = original_path
+
+    assert status == 200
+    assert "# TYPE db_connections_open gauge" in text
+    assert not_ready == 503
+    assert ready == 200
+    assert health == 200
+
+
+def test_loop_watchdog_captures_blocking_frame():
+    """Сторож снимает стек блокирующего кода и учитывает место блокировки"""
+    import loop_watchdog
+    from loop_watchdog import LoopWatchdog
+
+    def blocking_call():
+        time.sleep(0.3)
+
+    async def run():
+        task = asyncio.create_task(LoopWatchdog(threshold_ms=100, interval=0.02).run())
+        await asyncio.sleep(0.05)
+        blocking_call()
+        await asyncio.sleep(0.05)
+        task.cancel()
+
+    before = loop_watchdog.loop_stalls.get("test_metrics.py:blocking_call")
+    asyncio.run(run())
+    assert loop_watchdog.loop_stalls.get("test_metrics.py:blocking_call") == before + 1
+
+
+def test_webhook_handler_rejects_when_backlog_full():
+    """Webhook отвечает 503, когда заняты все слоты и очередь ожидания"""
+    from aiohttp.test_utils import TestClient, TestServer
+    from aiohttp import web
+    from aiogram import Bot, Dispatcher
+    import webhook_server
+    from webhook_server import BoundedRequestHandler
+
+    async def run():
+        release = asyncio.Event()
+        dp = Dispatcher()
+
+        @dp.message()
+        async def slow_handler(message):
+            await release.wait()
+
+        bot = Bot(token="123456:test")
+        app = web.Application()
+        BoundedRequestHandler(dp, bot, concurrency=1, backlog=1, secret_token="secret").register(app, path="/webhook")
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            def update(update_id):
+                return {"update_id": update_id, "message": {
+                    "message_id": update_id, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "x"
+                }}
+
+            headers = {"X-Telegram-Bot-Api-Secret-Token": "secret"}
+            unauthorized = await client.post("/webhook", json=update(1))
+            statuses = [(await client.post("/webhook", json=update(i), headers=headers)).status for i in range(1, 4)]
+            await asyncio.sleep(0)
+            backlog = webhook_server.webhook_backlog.get()
+            release.set()
+            await asyncio.sleep(0.05)
+            return unauthorized.status, statuses, backlog
+        finally:
+            await client.close()
+
+    unauthorized, statuses, backlog = asyncio.run(run())
+    assert unauthorized == 401
+    assert statuses == [200, 200, 503]
+    assert backlog == 1
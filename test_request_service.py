@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+"""
+Тесты закрытия заявок через общий сервис жизненного цикла и поиска заявки по ответу.
+"""
+
+import asyncio
+import os
+
+# Модули бота читают токен из окружения при импорте config
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+
+import pytest
+
+import request_service
+from database import db
+
+
+class FakeBot:
+    """Бот, запоминающий отправленные сообщения"""
+
+    def __init__(self, fail: bool = False):
+        self.sent = []
+        self.fail = fail
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("Forbidden: bot was blocked by the user")
+        self.sent.append((chat_id, text))
+
+    async def edit_message_text(self, **kwargs):
+        pass
+
+
+@pytest.fixture
+def database(tmp_path):
+    original_path, original_archive = db.db_path, db.archive_path
+    db.db_path = str(tmp_path / "test.db")
+    db.archive_path = str(tmp_path / "archive.db")
+    asyncio.run(db.init_db())
+    yield db
+    db.db_path, db.archive_path = original_path, original_archive
+
+
+def test_concurrent_replies_close_request_once(database):
+    """Из двух одновременных ответов пользователь получает только один"""
+    bot = FakeBot()
+
+    async def run():
+        request_id = await database.save_feedback_message(100, "user", "Иван", "Когда занятие?")
+        results = await asyncio.gather(
+            request_service.close_request(bot, request_id, 1, "Администратор", answer_text="В среду"),
+            request_service.close_request(bot, request_id, 2, "Преподаватель", answer_text="В четверг"),
+        )
+        return request_id, results, await database.get_feedback_message(request_id)
+
+    request_id, results, row = asyncio.run(run())
+
+    assert sorted(results) == sorted([request_service.CLOSED, request_service.ALREADY_CLOSED])
+    assert len(bot.sent) == 1
+    assert bot.sent[0][0] == 100
+    assert row[7] == "closed"
+
+
+def test_failed_delivery_reopens_request(database):
+    """Если ответ не доставлен, заявка остаётся активной"""
+    async def run():
+        request_id = await database.save_feedback_message(100, "user", "Иван", "Вопрос")
+        with pytest.raises(RuntimeError):
+            await request_service.close_request(FakeBot(fail=True), request_id, 1, "Администратор", answer_text="Ответ")
+        missing = await request_service.close_request(FakeBot(), 999, 1, "Администратор")
+        return await database.get_feedback_message(request_id), missing
+
+    row, missing = asyncio.run(run())
+    assert row[7] == "active"
+    assert not row[6]
+    assert missing == request_service.NOT_FOUND
+
+
+def test_reply_target_resolved_by_notification_message(database):
+    """Заявка определяется по сохранённому уведомлению, а не по первому #номеру в тексте"""
+    from datetime import datetime
+    from aiogram.types import Chat, Message
+
+    chat = Chat(id=-100500, type="supergroup")
+    notification = Message(
+        message_id=77, date=datetime.now(), chat=chat,
+        text="🎫 Новая заявка\nТекст заявки: ошибка в задании #3\n📝 Номер заявки: #12"
+    )
+    legacy = Message(message_id=78, date=datetime.now(), chat=chat, text="📝 Номер заявки: #5")
+
+    async def run():
+        await database.save_notification_message(12, chat.id, 77)
+        first = await request_service.resolve_reply_target(chat.id, notification)
+        cached = await request_service.resolve_reply_target(chat.id, notification)
+        fallback = await request_service.resolve_reply_target(chat.id, legacy)
+        return first, cached, fallback
+
+    assert asyncio.run(run()) == (12, 12, 5)
+
+
+def test_staff_and_teacher_notifications_in_one_chat(database):
+    """Уведомления staff и teacher одной заявки в одном чате хранятся оба"""
+    from datetime import datetime
+    from aiogram.types import Chat, Message
+
+    chat = Chat(id=42, type="private")
+
+    async def run():
+        request_id = await database.save_feedback_message(100, None, "Иван", "Вопрос")
+        await database.save_notification_message(request_id, chat.id, 301)
+        await database.save_notification_message(request_id, chat.id, 302, kind='teacher')
+        targets = [
+            await request_service.resolve_reply_target(
+                chat.id, Message(message_id=message_id, date=datetime.now(), chat=chat, text="Уведомление")
+            )
+            for message_id in (301, 302)
+        ]
+        return request_id, targets, await database.get_notification_messages(request_id)
+
+    request_id, targets, staff = asyncio.run(run())
+    assert targets == [request_id, request_id]
+    assert [tuple(row) for row in staff] == [(42, 301)]
+
+
+def test_active_registry_matches_database(database):
+    """Чтения активных заявок из реестра совпадают с запросами к БД и обновляются при закрытии"""
+    async def snapshot(direction_id):
+        return (
+            await database.has_active_request(100),
+            await database.get_active_request(100),
+            [tuple(row) for row in (await database.get_requests_page(status='active', limit=50)).rows],
+            [tuple(row) for row in await database.get_teacher_requests(7)],
+            await database.count_active_requests_for_direction(direction_id),
+        )
+
+    async def run():
+        await database.sync_directions(["Робототехника"])
+        direction_id = (await database.get_direction_by_name("Робототехника"))[0]
+        await database.assign_teacher_to_direction(7, direction_id, 1)
+        first = await database.save_feedback_message(100, "user", "Иван", "Вопрос", direction_id)
+        await database.save_feedback_message(200, None, "Пётр", "Другой вопрос")
+
+        cached = await snapshot(direction_id)
+        database.active.enabled = False
+        direct = await snapshot(direction_id)
+        database.active.enabled = True
+
+        await request_service.close_request(FakeBot(), first, 1, "Администратор")
+        return cached, direct, await snapshot(direction_id), await database.get_active_requests_counts()
+
+    cached, direct, after_close, counts = asyncio.run(run())
+    assert cached == direct
+    assert cached[0] is True and len(cached[2]) == 2 and cached[4] == 1
+    assert cached[3][0][7] == "Робототехника"
+    assert after_close[:2] == (False, None)
+    assert len(after_close[2]) == 1 and after_close[3] == [] and after_close[4] == 0
+    assert counts == (1, 1, 1)
+
+
+def test_requests_page_walks_history_with_cursors(database):
+    """Листание по курсорам проходит всю историю без пропусков в обе стороны, из БД и из реестра"""
+    from pagination import NEWER, OLDER, decode_cursor, encode_cursor
+
+    async def walk(**filters):
+        ids, page = [], await database.get_requests_page(limit=3, **filters)
+        pages = [page]
+        while page.older:
+            cursor = decode_cursor(encode_cursor(page.older))
+            page = await database.get_requests_page(cursor=cursor, direction=OLDER, limit=3, **filters)
+            pages.append(page)
+        for page in pages:
+            ids.extend(row[0] for row in page.rows)
+        back = await database.get_requests_page(cursor=pages[-1].newer, direction=NEWER, limit=3, **filters)
+        return ids, [row[0] for row in back.rows], pages[0].newer
+
+    async def run():
+        created = [await database.save_feedback_message(100, "user", "Иван", f"Вопрос {i}") for i in range(8)]
+        # Половина заявок создана в одну секунду: порядок задаёт id
+        async with database.connect() as conn:
+            await conn.execute("UPDATE feedback_messages SET created_at = '2024-01-01 10:00:00' WHERE id <= 4")
+            await conn.commit()
+        database.active.invalidate()
+        from_registry = await walk(status='active')
+        database.active.enabled = False
+        from_sql = await walk(user_id=100)
+        database.active.enabled = True
+        return created, from_registry, from_sql
+
+    created, from_registry, from_sql = asyncio.run(run())
+    expected = list(reversed(created))
+    assert from_registry[0] == from_sql[0] == expected
+    assert from_registry[1] == from_sql[1] == expected[3:6]
+    assert from_registry[2] is None and from_sql[2] is None
+
+
+def test_full_text_search_ranks_filters_and_pages(database):
+    """Поиск по тексту заявки и ответа: фрагменты, фильтры, листание по рангу и запасной LIKE"""
+    from pagination import OLDER, decode_rank_cursor, encode_rank_cursor
+    from request_search import parse_search_text, MATCH_START
+
+    async def run():
+        assert database.fts_available
+        ids = [await database.save_feedback_message(100 + i, None, "Иван", f"Не получается войти в Roblox, заявка {i}")
+               for i in range(5)]
+        other = await database.save_feedback_message(200, None, "Пётр", "Когда занятие по робототехнике?")
+        # Ответ индексируется триггером при закрытии заявки
+        await request_service.close_request(FakeBot(), other, 1, "Администратор", answer_text="Вход в Roblox через портал")
+
+        params = parse_search_text("roblox войти", [])
+        first = await database.search_requests(**params, limit=3)
+        cursor = decode_rank_cursor(encode_rank_cursor(first.older))
+        second = await database.search_requests(**params, cursor=cursor, direction=OLDER, limit=3)
+        answered = await database.search_requests(**parse_search_text("портал статус:закрытые", []))
+        active_only = await database.search_requests(**parse_search_text("roblox статус:активные", []))
+        # Слово, оканчивающееся на «с» или «по», перед двоеточием - не фильтр даты
+        colon = parse_search_text("заявка:roblox вопрос:xyz", [])
+        assert colon["date_from"] is None and colon["words"] == ["заявка", "roblox", "вопрос", "xyz"]
+        assert parse_search_text("roblox с:01.09.2024", [])["date_from"] == "2024-09-01 00:00:00"
+        colon_page = await database.search_requests(**parse_search_text("заявка:roblox", []), limit=10)
+        assert sorted(row[0] for row in colon_page.rows) == sorted(ids)
+
+        database.fts_available = False
+        fallback = await database.search_requests(**parse_search_text("roblox", []), limit=10)
+        database.fts_available = True
+        return ids, other, first, second, answered, active_only, fallback
+
+    ids, other, first, second, answered, active_only, fallback = asyncio.run(run())
+    found = [row[0] for row in first.rows + second.rows]
+    assert sorted(found) == sorted(ids) and len(set(found)) == 5
+    assert MATCH_START in first.rows[0][7]
+    assert second.older is None and second.newer is not None
+    assert [row[0] for row in answered.rows] == [other]
+    assert other not in [row[0] for row in active_only.rows]
+    assert sorted(row[0] for row in fallback.rows) == sorted(ids + [other])
+
+
+def test_search_detects_fts_without_init_db(database):
+    """Процесс-обработчик не вызывает init_db, но поиск всё равно идёт по индексу FTS5"""
+    from database import Database
+    from request_search import parse_search_text, MATCH_START
+
+    async def run():
+        request_id = await database.save_feedback_message(100, None, "Иван", "Не получается войти в Roblox")
+        worker_db = Database()
+        worker_db.db_path, worker_db.archive_path = database.db_path, database.archive_path
+        page = await worker_db.search_requests(**parse_search_text("roblox", []))
+        return request_id, worker_db.fts_available, page
+
+    request_id, fts_available, page = asyncio.run(run())
+    assert fts_available is True
+    assert [row[0] for row in page.rows] == [request_id]
+    assert MATCH_START in page.rows[0][7]
+
+
+def test_request_counters_follow_lifecycle(database):
+    """Счётчики, которые ведут триггеры, совпадают с пересчётом с нуля"""
+    async def run():
+        first = await database.save_feedback_message(100, "user", "Иван", "Вопрос 1")
+        second = await database.save_feedback_message(100, "user", "Иван", "Вопрос 2")
+        await database.save_feedback_message(200, None, "Пётр", "Вопрос 3")
+        await request_service.close_request(FakeBot(), first, 1, "Администратор", answer_text="Ответ")
+        with pytest.raises(RuntimeError):
+            await request_service.close_request(FakeBot(fail=True), second, 1, "Администратор", answer_text="Ответ")
+        live = await database.get_request_counters()
+        await database.rebuild_request_counters()
+        return live, await database.get_request_counters()
+
+    live, rebuilt = asyncio.run(run())
+    # После вычитаний в таблице остаются нулевые строки, пересчёт их не создаёт
+    nonzero = lambda counters: {key: value for key, value in counters._values.items() if value}
+    assert nonzero(live) == nonzero(rebuilt)
+    assert (live.total("total"), live.total("active"), live.total("closed"), live.total("users")) == (3, 2, 1, 2)
+    assert live.responder(1, "answered") == 1
+    assert live.direction(0, "total") == 3
+
+
+def test_request_rollups_windows_and_compaction(database):
+    """Счётчики за период - сумма корзин; сжатие в суточные корзины не меняет итоги"""
+    async def run():
+        async with database.connect() as conn:
+            for days_ago, user_id in [(0, 1), (0, 2), (3, 1), (10, 3), (40, 4)]:
+                await conn.execute(
+                    "INSERT INTO feedback_messages (user_id, message_text, created_at) "
+                    "VALUES (?, 'Вопрос', datetime('now', ?))", (user_id, f'-{days_ago} days')
+                )
+            await conn.commit()
+        fresh = await database.save_feedback_message(5, None, "Иван", "Вопрос")
+        await request_service.close_request(FakeBot(), fresh, 1, "Администратор", answer_text="Ответ")
+
+        def windows():
+            return asyncio.gather(
+                database.count_requests_since('-1 hour'),
+                database.count_requests_since('-7 days'),
+                database.count_requests_since('-30 days'),
+                database.count_requests_since('-1 day', metric='closed'),
+                database.count_users_since('-30 days'),
+            )
+
+        before = await windows()
+        folded = await database.compact_request_rollups()
+        return before, folded, await windows()
+
+    before, folded, after = asyncio.run(run())
+    assert before == [3, 4, 5, 1, 4]
+    assert folded > 0
+    assert after == before
+
+
+def test_response_time_percentiles_follow_closes(database):
+    """Гистограммы времени ответа обновляются при закрытии и возврате заявки и совпадают с пересчётом"""
+    from response_times import RATIO
+
+    async def run():
+        ids = []
+        async with database.connect() as conn:
+            for minutes in (5, 10, 30, 120):
+                cursor = await conn.execute(
+                    "INSERT INTO feedback_messages (user_id, message_text, created_at) "
+                    "VALUES (?, 'Вопрос', datetime('now', ?))", (100 + minutes, f'-{minutes} minutes')
+                )
+                ids.append(cursor.lastrowid)
+            await conn.commit()
+        database.active.invalidate()
+        for request_id in ids:
+            await request_service.close_request(FakeBot(), request_id, 1, "Администратор", answer_text="Ответ")
+        failed = await database.save_feedback_message(300, None, "Пётр", "Вопрос")
+        with pytest.raises(RuntimeError):
+            await request_service.close_request(FakeBot(fail=True), failed, 2, "Преподаватель", answer_text="Ответ")
+        live = await database.get_response_time_sketches()
+        await database.rebuild_response_times()
+        return live, await database.get_response_time_sketches()
+
+    live, rebuilt = asyncio.run(run())
+    overall = live[('all', 0)]
+    assert overall.count == 4
+    assert live[('responder', 1)].count == 4
+    assert live.get(('responder', 2)) is None or live[('responder', 2)].count == 0
+    # Медиана из 4 наблюдений - второе (10 минут) с точностью до ширины корзины
+    assert abs(overall.percentile(0.5) - 600) <= 600 * (RATIO - 1)
+    assert abs(overall.percentile(0.99) - 7200) <= 7200 * (RATIO - 1)
+    assert {key: dict(s.counts) for key, s in live.items() if s.count} == \
+        {key: dict(s.counts) for key, s in rebuilt.items() if s.count}
+
+
+def test_archive_moves_old_closed_requests(database):
+    """Старые закрытые заявки переносятся в архив порциями, счётчики при этом не меняются"""
+    async def run():
+        ids = []
+        async with database.connect() as conn:
+            for days_ago, user_id, status in [(400, 1, 'closed'), (300, 1, 'closed'), (250, 2, 'closed'),
+                                              (300, 3, 'active'), (10, 2, 'closed')]:
+                cursor = await conn.execute(
+                    "INSERT INTO feedback_messages (user_id, message_text, created_at, status, is_answered, answered_by) "
+                    "VALUES (?, 'Вопрос', datetime('now', ?), ?, ?, 1)",
+                    (user_id, f'-{days_ago} days', status, status == 'closed')
+                )
+                ids.append(cursor.lastrowid)
+            await conn.commit()
+        database.active.invalidate()
+        for request_id in ids:
+            await database.save_notification_message(request_id, 500, 1000 + request_id)
+            await database.save_attachment(request_id, f"file{request_id}", "photo")
+        before = await database.get_request_counters()
+        moved = await database.archive_old_requests(older_than_days=180, batch_size=2)
+        again = await database.archive_old_requests(older_than_days=180, batch_size=2)
+        live = await database.get_request_counters()
+        await database.rebuild_request_counters()
+        rebuilt = await database.get_request_counters()
+        hot = await database.get_user_conversation(1)
+        full = await database.get_user_conversation(1, include_archive=True)
+        async with database.connect() as conn:
+            await conn.execute('ATTACH DATABASE ? AS archive', (database.archive_path,))
+            cursor = await conn.execute(
+                "SELECT (SELECT COUNT(*) FROM archive.notification_messages), (SELECT COUNT(*) FROM archive.attachments), "
+                "(SELECT COUNT(*) FROM main.notification_messages), (SELECT COUNT(*) FROM main.attachments)"
+            )
+            moved_rows = await cursor.fetchone()
+        return ids, moved, again, before, live, rebuilt, hot, full, moved_rows
+
+    ids, moved, again, before, live, rebuilt, hot, full, moved_rows = asyncio.run(run())
+    assert (moved, again) == (3, 0)
+    assert moved_rows == (3, 3, 2, 2)
+    nonzero = lambda counters: {key: value for key, value in counters._values.items() if value}
+    assert nonzero(before) == nonzero(live) == nonzero(rebuilt)
+    assert (live.total("total"), live.total("closed"), live.total("users")) == (5, 4, 3)
+    assert hot == []
+    assert [row[0] for row in full] == ids[:2]
+
+
+def test_statistics_rebuild_keeps_archived_history(database):
+    """Пересчёт сводок, гистограмм и отчёт аналитики после переноса в архив учитывают архивные заявки"""
+    import analytics
+
+    async def run():
+        async with database.connect() as conn:
+            for days_ago, status in [(400, 'closed'), (300, 'closed'), (200, 'closed'), (10, 'closed'), (5, 'active')]:
+                await conn.execute(
+                    "INSERT INTO feedback_messages (user_id, message_text, created_at, answered_at, status, is_answered, answered_by) "
+                    "VALUES (?, 'Вопрос', datetime('now', ?), datetime('now', ?, '+1 hour'), ?, ?, 1)",
+                    (days_ago, f'-{days_ago} days', f'-{days_ago} days', status, status == 'closed')
+                )
+            await conn.commit()
+        database.active.invalidate()
+        await database.rebuild_request_rollups()
+        await database.rebuild_response_times()
+
+        async def snapshot():
+            sketches = await database.get_response_time_sketches()
+            return (
+                sketches[('all', 0)].count,
+                await database.count_requests_since('-500 days'),
+                await database.count_requests_since('-500 days', metric='closed'),
+            )
+
+        before = await snapshot()
+        moved = await database.archive_old_requests(older_than_days=180)
+        archived = await snapshot()
+        await database.rebuild_request_rollups()
+        await database.rebuild_response_times()
+        return before, moved, archived, await snapshot()
+
+    before, moved, archived, rebuilt = asyncio.run(run())
+    assert moved == 3
+    assert before == archived == rebuilt == (4, 5, 4)
+    report = analytics.build_report(database.db_path, archive_path=database.archive_path)
+    assert report.total_requests == 5
+    assert analytics.build_report(database.db_path).total_requests == 2
+
+
+def test_broadcast_and_direction_totals_include_archive(database):
+    """Рассылка и заявки по направлениям учитывают авторов и заявки из архива"""
+    from admin_handlers import get_all_bot_users, get_requests_by_directions
+
+    async def run():
+        await database.sync_directions(["Робототехника"])
+        (direction_id, _), = await database.get_all_directions()
+        async with database.connect() as conn:
+            for days_ago, user_id, status, direction in [(400, 1, 'closed', direction_id), (300, 2, 'closed', None),
+                                                         (5, 2, 'active', direction_id)]:
+                await conn.execute(
+                    "INSERT INTO feedback_messages (user_id, message_text, created_at, status, direction_id) "
+                    "VALUES (?, 'Вопрос', datetime('now', ?), ?, ?)",
+                    (user_id, f'-{days_ago} days', status, direction)
+                )
+            await conn.commit()
+        database.active.invalidate()
+        moved = await database.archive_old_requests(older_than_days=180)
+        return moved, await get_all_bot_users(), await get_requests_by_directions()
+
+    moved, users, directions = asyncio.run(run())
+    assert moved == 2
+    assert sorted(users) == [1, 2]
+    assert directions == [("Робототехника", 1, 2), ("Без направления", 0, 1)]
+
+
+def test_teacher_statistics_count_only_own_answers_in_own_directions(database):
+    """«Отвечено вами» - ответы этого преподавателя по его направлениям, а не общий счётчик"""
+    from teacher_handlers import get_teacher_statistics
+
+    async def run():
+        await database.sync_directions(["Робототехника", "Шахматы"])
+        directions = dict((name, direction_id) for direction_id, name in await database.get_all_directions())
+        await database.assign_teacher_to_direction(10, directions["Робототехника"], 1)
+        bot = FakeBot()
+        for user_id, direction, responder in [(100, "Робототехника", 10), (101, "Робототехника", 10),
+                                              (102, "Робототехника", 20), (103, "Шахматы", 10)]:
+            request_id = await database.save_feedback_message(user_id, None, "Иван", "Вопрос", directions[direction])
+            await request_service.close_request(bot, request_id, responder, "Преподаватель", answer_text="Ответ")
+        return await get_teacher_statistics(10), await get_teacher_statistics(20)
+
+    mine, other = asyncio.run(run())
+    assert "Всего по вашим направлениям: 3" in mine
+    assert "Отвечено вами: 2" in mine
+    assert "Отвечено вами" not in other
+
+
+def test_read_lane_is_read_only_and_interrupts_runaway_queries(database):
+    """Соединение полосы чтения не пишет, долгий запрос прерывается, а запись заявок продолжается"""
+    import sqlite3
+    from database import ReadOnlyConnection
+
+    async def run():
+        await database.save_feedback_message(100, "user", "Иван", "Вопрос")
+        async with database.read() as conn:
+            with pytest.raises(sqlite3.OperationalError):
+                await conn.execute("DELETE FROM feedback_messages")
+        async with ReadOnlyConnection(database.db_path, timeout=0.05) as conn:
+            runaway = conn.execute(
+                "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n) SELECT COUNT(*) FROM n"
+            )
+            saved = await database.save_feedback_message(200, None, "Пётр", "Вопрос")
+            with pytest.raises(sqlite3.OperationalError, match="interrupted"):
+                await runaway
+        counters = await database.get_request_counters()
+        return saved, counters
+
+    saved, counters = asyncio.run(run())
+    assert saved is not None
+    assert counters.total("total") == 2
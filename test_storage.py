@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Тесты хранилища состояний FSM и журнала апдейтов в базе данных бота.
+"""
+
+import asyncio
+import os
+import time
+
+# Модули бота читают токен из окружения при импорте config
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+
+from aiogram.fsm.storage.base import StorageKey
+
+from database import Database
+from handlers import FeedbackStates
+from sqlite_storage import SQLiteStorage
+
+
+def make_database(tmp_path) -> Database:
+    database = Database()
+    database.db_path = str(tmp_path / "test.db")
+    return database
+
+
+def test_state_and_data_survive_restart(tmp_path):
+    """Черновик заявки с вложениями сохраняется между экземплярами хранилища"""
+    database = make_database(tmp_path)
+    key = StorageKey(bot_id=1, chat_id=100, user_id=100)
+    attachments = [{"file_id": "abc", "file_type": "photo", "file_name": "Фото.jpg", "file_size": 10}]
+
+    async def run():
+        await database.init_db()
+        storage = SQLiteStorage(database)
+        await storage.set_state(key, FeedbackStates.waiting_for_attachments)
+        await storage.update_data(key, {"feedback_text": "Вопрос", "attachments": attachments})
+        await storage.close()
+
+        restarted = SQLiteStorage(database)
+        state = await restarted.get_state(key)
+        data = await restarted.get_data(key)
+
+        await restarted.set_state(key, None)
+        await restarted.set_data(key, {})
+        async with database.connect() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM fsm_states") as cursor:
+                rows = (await cursor.fetchone())[0]
+        await restarted.close()
+        return state, data, rows
+
+    state, data, rows = asyncio.run(run())
+    assert state == FeedbackStates.waiting_for_attachments.state
+    assert data == {"feedback_text": "Вопрос", "attachments": attachments}
+    assert rows == 0
+
+
+def test_evict_expired_states(tmp_path):
+    """Очистка удаляет только состояния старше TTL"""
+    database = make_database(tmp_path)
+    stale_key = StorageKey(bot_id=1, chat_id=1, user_id=1)
+    fresh_key = StorageKey(bot_id=1, chat_id=2, user_id=2)
+
+    async def run():
+        await database.init_db()
+        storage = SQLiteStorage(database, ttl_hours=1)
+        await storage.set_state(stale_key, "FeedbackStates:waiting_for_message")
+        await storage.set_state(fresh_key, "FeedbackStates:waiting_for_message")
+        async with database.connect() as conn:
+            await conn.execute(
+                "UPDATE fsm_states SET updated_at = ? WHERE key = ?",
+                (int(time.time()) - 7200, storage.key_builder.build(stale_key))
+            )
+            await conn.commit()
+
+        evicted = await storage.evict_expired()
+        result = evicted, await storage.get_state(stale_key), await storage.get_state(fresh_key)
+        await storage.close()
+        return result
+
+    evicted, stale_state, fresh_state = asyncio.run(run())
+    assert evicted == 1
+    assert stale_state is None
+    assert fresh_state == "FeedbackStates:waiting_for_message"
+
+
+def test_update_ledger_drops_redelivered_updates(tmp_path):
+    """Повторно доставленный апдейт отбрасывается, в том числе после перезапуска"""
+    from update_ledger import UpdateLedger, UpdateDeduplicationMiddleware
+    from aiogram.types import Update
+
+    database = make_database(tmp_path)
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.update_id)
+
+    async def run():
+        await database.init_db()
+        ledger = UpdateLedger(database)
+        middleware = UpdateDeduplicationMiddleware(ledger)
+        await middleware(handler, Update(update_id=10), {})
+        await middleware(handler, Update(update_id=10), {})
+        await ledger.close()
+
+        restarted = UpdateDeduplicationMiddleware(UpdateLedger(database))
+        await restarted(handler, Update(update_id=10), {})
+        await restarted(handler, Update(update_id=11), {})
+        await restarted.ledger.close()
+
+    asyncio.run(run())
+    assert handled == [10, 11]
+
+
+def test_metadata_cache_avoids_repeated_api_calls(tmp_path):
+    """Профиль бота запрашивается один раз, а имена сотрудников берутся из кэша"""
+    from types import SimpleNamespace
+    from metadata_cache import MetadataCache
+
+    database = make_database(tmp_path)
+
+    class FakeBot:
+        def __init__(self):
+            self.calls = []
+
+        async def get_me(self):
+            self.calls.append("getMe")
+            return SimpleNamespace(username="TestBot")
+
+        async def get_chat(self, chat_id):
+            self.calls.append(chat_id)
+            return SimpleNamespace(username=f"user{chat_id}", first_name="Имя", title=None, type="private")
+
+    async def run():
+        await database.init_db()
+        await database.add_admin(1, "old_name", "Имя", None)
+        await database.add_admin(2, None, None, None)
+        cache = MetadataCache(database)
+        await cache.load()
+        cache.remember_user(1, "new_name", "Имя")
+        bot = FakeBot()
+
+        usernames = [await cache.get_bot_username(bot) for _ in range(3)]
+        updated = await cache.sync_staff_profiles(bot)
+        return usernames, updated, bot.calls, await database.get_all_admins()
+
+    usernames, updated, calls, admins = asyncio.run(run())
+    assert usernames == ["TestBot"] * 3
+    assert calls == ["getMe", 2]
+    assert updated == 2
+    assert sorted(row for row in admins if row[0] in (1, 2)) == [(1, "new_name", "Имя"), (2, "user2", "Имя")]
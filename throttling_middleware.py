@@ -0,0 +1,127 @@
+"""
+Middleware защиты от флуда: token bucket на каждую пару (пользователь, класс действия).
+Лишние нажатия кнопок получают дешёвый callback.answer, лишние сообщения отбрасываются.
+Регистрируется внешним middleware апдейтов до журнала и очереди пользователя, чтобы лишний
+апдейт отклонялся сразу, не дожидаясь блокировки пользователя и не занимая место обработчика
+"""
+import time
+from typing import Callable, Dict, Any, Awaitable, Tuple
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, Message, TelegramObject, Update
+
+from config import THROTTLE_RATES
+from metrics import registry
+
+# Как часто удалять полностью восстановившиеся корзины, секунды
+EXPIRY_INTERVAL = 60
+
+# Тяжёлые кнопки: каждый вызов стоит запросов к БД и редактирования сообщения
+HEAVY_CALLBACKS = {
+    "requests_active", "requests_closed", "requests_recent", "requests_by_direction",
+    "update_admins_info", "schedule_reload_csv",
+}
+SCHEDULE_CALLBACKS = {"schedule", "quick_schedule"}
+
+throttled_updates = registry.counter(
+    "throttled_updates_total", "Апдейты, отклонённые антифлудом", ("route_class",)
+)
+
+
+def parse_rates(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Разобрать строку вида heavy=0.2:3,message=2:20 в {класс: (токенов в секунду, ёмкость)}"""
+    rates = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        route_class, _, value = item.partition("=")
+        rate, _, burst = value.partition(":")
+        rates[route_class.strip()] = (float(rate), float(burst or rate))
+    return rates
+
+
+def route_class_of(event: TelegramObject) -> str:
+    """Класс действия для апдейта"""
+    if isinstance(event, CallbackQuery):
+        data = event.data or ""
+        if data in HEAVY_CALLBACKS or data.startswith("stats_") or data.endswith(("_refresh", "_export")):
+            return "heavy"
+        if data in SCHEDULE_CALLBACKS:
+            return "schedule"
+        return "callback"
+    if isinstance(event, Message):
+        text = event.text or ""
+        if text == "📅 Расписание":
+            return "schedule"
+        if text.startswith("/"):
+            return "command"
+    return "message"
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов (а также сообщений и callback-запросов) с token bucket на пользователя и класс"""
+
+    def __init__(self, rates: str = THROTTLE_RATES):
+        self.rates = parse_rates(rates)
+        # (user_id, класс) -> [токены, время последнего обновления]
+        self._buckets: Dict[Tuple[int, str], list] = {}
+        self._next_expiry = time.monotonic() + EXPIRY_INTERVAL
+
+    def allow(self, user_id: int, route_class: str) -> bool:
+        """Списать токен из корзины; False, если корзина пуста"""
+        limit = self.rates.get(route_class)
+        if limit is None:
+            return True
+        rate, burst = limit
+        now = time.monotonic()
+        if now >= self._next_expiry:
+            self._expire(now)
+
+        key = (user_id, route_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._buckets[key] = [burst - 1, now]
+            return True
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1
+        return True
+
+    def _expire(self, now: float):
+        """Удалить корзины, которые за время простоя успели наполниться до ёмкости"""
+        expired = []
+        for key, (tokens, updated) in self._buckets.items():
+            rate, burst = self.rates[key[1]]
+            if tokens + (now - updated) * rate >= burst:
+                expired.append(key)
+        for key in expired:
+            del self._buckets[key]
+        self._next_expiry = now + EXPIRY_INTERVAL
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        target = event
+        if isinstance(event, Update):
+            # Ограничиваются только сообщения и нажатия кнопок
+            target = event.message or event.callback_query
+            if target is None:
+                return await handler(event, data)
+
+        route_class = route_class_of(target)
+        if self.allow(user.id, route_class):
+            return await handler(event, data)
+
+        throttled_updates.inc(route_class)
+        if isinstance(target, CallbackQuery):
+            await target.answer("⏳ Слишком часто, подождите пару секунд")
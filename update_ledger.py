@@ -0,0 +1,108 @@
+"""
+Журнал обработанных апдейтов: после падения или перезапуска Telegram может
+доставить апдейты повторно, и неидемпотентные хендлеры (создание заявки, ответ,
+рассылка) выполнились бы дважды. Журнал отбрасывает такие апдейты до хендлеров.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Dict, Any, Awaitable
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from config import UPDATE_DEDUP_RETENTION_HOURS
+from database import db, Database
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних update_id держать в памяти
+RING_SIZE = 10000
+# Как часто удалять устаревшие записи журнала, секунды
+TRIM_INTERVAL = 3600
+
+duplicate_updates = registry.counter(
+    "duplicate_updates_total", "Повторно доставленные апдейты, отброшенные журналом", ("source",)
+)
+
+
+class UpdateLedger:
+    """Кольцевой буфер последних update_id поверх таблицы processed_updates"""
+
+    def __init__(self, database: Database = db, retention_hours: float = UPDATE_DEDUP_RETENTION_HOURS,
+                 ring_size: int = RING_SIZE):
+        self.database = database
+        self.retention = int(retention_hours * 3600)
+        self._ring = deque(maxlen=ring_size)
+        self._seen = set()
+        self._conn = None
+        self._lock = asyncio.Lock()
+        self._next_trim = 0.0
+
+    def _remember(self, update_id: int):
+        if len(self._ring) == self._ring.maxlen:
+            self._seen.discard(self._ring[0])
+        self._ring.append(update_id)
+        self._seen.add(update_id)
+
+    async def _connection(self):
+        if self._conn is None:
+            self._conn = await self.database.connect()
+        return self._conn
+
+    async def mark_processed(self, update_id: int) -> bool:
+        """
+        Отметить апдейт как обработанный.
+        Возвращает False, если он уже встречался (повторная доставка).
+        """
+        if update_id in self._seen:
+            duplicate_updates.inc("memory")
+            return False
+
+        now = int(time.time())
+        async with self._lock:
+            conn = await self._connection()
+            cursor = await conn.execute(
+                'INSERT OR IGNORE INTO processed_updates (update_id, processed_at) VALUES (?, ?)',
+                (update_id, now)
+            )
+            inserted = cursor.rowcount == 1
+            if time.monotonic() >= self._next_trim:
+                await conn.execute('DELETE FROM processed_updates WHERE processed_at < ?', (now - self.retention,))
+                self._next_trim = time.monotonic() + TRIM_INTERVAL
+            await conn.commit()
+
+        self._remember(update_id)
+        if not inserted:
+            duplicate_updates.inc("database")
+        return inserted
+
+    async def close(self):
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+
+class UpdateDeduplicationMiddleware(BaseMiddleware):
+    """Внешний middleware диспетчера: повторно доставленные апдейты не доходят до хендлеров"""
+
+    def __init__(self, ledger: UpdateLedger):
+        self.ledger = ledger
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any]
+    ) -> Any:
+        try:
+            fresh = await self.ledger.mark_processed(event.update_id)
+        except Exception as e:
+            # Журнал недоступен - лучше обработать апдейт, чем потерять его
+            logger.error(f"Ошибка журнала апдейтов: {e}")
+            fresh = True
+        if not fresh:
+            logger.info(f"Апдейт {event.update_id} уже обработан, пропускаем")
+            return None
+        return await handler(event, data)
@@ -0,0 +1,45 @@
+"""
+Трассировка обработки одного апдейта: какой роутер и хендлер его обработал,
+сколько времени ушло на запросы к базе данных и на вызовы Bot API
+"""
+from contextvars import ContextVar
+from typing import Optional
+
+
+class UpdateTrace:
+    """Накопитель времени по одному апдейту"""
+    __slots__ = (
+        "update_id", "update_type", "router", "handler", "handler_time",
+        "db_time", "db_calls", "api_time", "api_calls"
+    )
+
+    def __init__(self, update_id: int, update_type: str):
+        self.update_id = update_id
+        self.update_type = update_type
+        self.router = None
+        self.handler = None
+        self.handler_time = 0.0
+        self.db_time = 0.0
+        self.db_calls = 0
+        self.api_time = 0.0
+        self.api_calls = 0
+
+
+# Трасса апдейта, обрабатываемого в текущей задаче
+current_trace: ContextVar[Optional[UpdateTrace]] = ContextVar("current_trace", default=None)
+
+
+def add_db_time(seconds: float):
+    """Учесть время запроса к базе данных в текущей трассе"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.db_time += seconds
+        trace.db_calls += 1
+
+
+def add_api_time(seconds: float):
+    """Учесть время вызова Bot API в текущей трассе"""
+    trace = current_trace.get()
+    if trace is not None:
+        trace.api_time += seconds
+        trace.api_calls += 1
@@ -5,6 +5,7 @@ from typing import Callable, Dict, Any, Awaitable
 from aiogram import BaseMiddleware
 from aiogram.types import Message, CallbackQuery
 from database import db
+from metadata_cache import metadata
 
 
 class UserLoggingMiddleware(BaseMiddleware):
@@ -29,6 +30,8 @@ class UserLoggingMiddleware(BaseMiddleware):
                 first_name=user.first_name,
                 last_name=user.last_name
             )
+            # Свежее имя пользователя попадает в кэш метаданных без запросов к Telegram
+            metadata.remember_user(user.id, user.username, user.first_name)
         
         # Продолжаем обработку события
         return await handler(event, data)
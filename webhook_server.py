@@ -0,0 +1,113 @@
+"""
+Режим получения апдейтов через webhook на базе интеграции aiogram с aiohttp:
+проверка секретного токена, ограничение числа одновременно работающих
+хендлеров и ограниченная очередь ожидания
+"""
+import asyncio
+import logging
+from typing import Any, Dict
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import (
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    HANDLER_CONCURRENCY, HANDLER_BACKLOG
+)
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+webhook_in_flight = registry.gauge(
+    "webhook_handlers_in_flight", "Апдейты webhook, обрабатываемые прямо сейчас"
+)
+webhook_backlog = registry.gauge(
+    "webhook_backlog_depth", "Апдейты webhook, ожидающие свободного слота обработки"
+)
+webhook_rejected = registry.counter(
+    "webhook_rejected_total", "Апдейты webhook, отклонённые из-за переполнения очереди"
+)
+
+# Установлен ли webhook и принимает ли сервер запросы (для /readyz)
+webhook_active = False
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик webhook, отвечающий Telegram сразу и обрабатывающий апдейт в фоне.
+    Одновременно работает не больше concurrency хендлеров, ещё не больше backlog
+    апдейтов ждут своей очереди; сверх этого отвечаем 503, и Telegram повторит доставку позже.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, concurrency: int = HANDLER_CONCURRENCY,
+                 backlog: int = HANDLER_BACKLOG, secret_token: str = WEBHOOK_SECRET, **data: Any):
+        super().__init__(dispatcher, bot, secret_token=secret_token, **data)
+        self.concurrency = concurrency
+        self.backlog = backlog
+        self._slots = asyncio.Semaphore(concurrency)
+        self._accepted = 0
+        # Свои фоновые задачи: внутренние поля SimpleRequestHandler не используются
+        self._tasks = set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """Точка входа aiohttp: проверить секрет, поставить апдейт в очередь и сразу ответить"""
+        bot = await self.resolve_bot(request)
+        if not self.verify_secret(request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), bot):
+            return web.Response(body="Unauthorized", status=401)
+
+        if self._accepted >= self.concurrency + self.backlog:
+            webhook_rejected.inc()
+            return web.Response(status=503, text="Backlog is full", headers={"Retry-After": "1"})
+
+        update = await request.json(loads=bot.session.json_loads)
+        self._accepted += 1
+        webhook_backlog.inc()
+        task = asyncio.create_task(self._bounded_feed_update(bot, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _bounded_feed_update(self, bot: Bot, update: Dict[str, Any]):
+        """Обработать апдейт, дождавшись свободного слота"""
+        try:
+            async with self._slots:
+                webhook_backlog.dec()
+                webhook_in_flight.inc()
+                try:
+                    result = await self.dispatcher.feed_raw_update(bot=bot, update=update, **self.data)
+                    if isinstance(result, TelegramMethod):
+                        await self.dispatcher.silent_call_request(bot=bot, result=result)
+                except Exception as e:
+                    logger.exception(f"Ошибка обработки апдейта из webhook: {e}")
+                finally:
+                    webhook_in_flight.dec()
+        finally:
+            self._accepted -= 1
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, allowed_updates):
+    """Установить webhook и обслуживать входящие апдейты до остановки"""
+    global webhook_active
+
+    app = web.Application()
+    BoundedRequestHandler(dp, bot).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+        await site.start()
+        await bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=allowed_updates,
+            max_connections=min(100, max(1, HANDLER_CONCURRENCY))
+        )
+        webhook_active = True
+        logger.info(f"Webhook слушает http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        await asyncio.Event().wait()
+    finally:
+        webhook_active = False
+        await runner.cleanup()